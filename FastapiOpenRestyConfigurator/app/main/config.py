@@ -1,5 +1,6 @@
 import os
 from functools import lru_cache
+from typing import Optional
 
 from pydantic_settings import BaseSettings
 from pydantic import SecretStr, validator, DirectoryPath
@@ -14,11 +15,46 @@ class Settings(BaseSettings):
     FORC_VERSION: str = '0.2'
     DEBUG: bool = False
     LOG_LEVEL: str = "INFO"
+    FORC_LOG_FORMAT: str = "text"
+    FORC_LOG_FILE: Optional[str] = "/var/log/all_forc_logs.log"
+    FORC_LOG_QUEUE_SIZE: int = 10000
+    FORC_LOG_SAMPLE_RATE: float = 0.01
     FORC_API_KEY: SecretStr
     FORC_SECRET_KEY: SecretStr = 'my_precious_secret_key'
+    FORC_API_KEYS_FILE: Optional[str] = None
+    FORC_API_KEY_RATE_LIMIT: float = 0.0
+    FORC_RATE_LIMIT: float = 50.0
+    FORC_RATE_BURST: int = 100
     FORC_BACKEND_PATH: DirectoryPath
     FORC_TEMPLATE_PATH: DirectoryPath
+    FORC_TEMPLATE_CACHE_PATH: Optional[str] = None
     FORC_USER_PATH: str = "users"
+    FORC_STATE_PATH: str = ".forc"
+    FORC_WATCH_POLL_INTERVAL: float = 2.0
+    FORC_WATCH_USE_INOTIFY: bool = True
+    FORC_USER_RESYNC_INTERVAL: float = 0.0
+    FORC_RELOAD_COMMAND: str = "sudo openresty -s reload"
+    FORC_RELOAD_WINDOW: float = 0.5
+    FORC_VALIDATE_CONFIG: bool = True
+    FORC_VALIDATE_COMMAND: str = "sudo openresty -t"
+    FORC_IO_WORKERS: int = 8
+    FORC_ROUTING_MODE: str = "files"
+    FORC_ROUTING_ADMIN_URL: str = "http://127.0.0.1:8081/forc/routes"
+    FORC_ROUTING_SYNC_INTERVAL: float = 30.0
+    FORC_EVENT_BUFFER_SIZE: int = 1000
+    FORC_EVENT_POLL_INTERVAL: float = 0.25
+    FORC_METADATA_DB: Optional[str] = None
+    FORC_IMPORT_TIME_BUDGET: float = 1.5
+    FORC_HEALTH_CHECK_INTERVAL: float = 30.0
+    FORC_HEALTH_CHECK_TIMEOUT: float = 3.0
+    FORC_HEALTH_CHECK_CONCURRENCY: int = 50
+    FORC_HEALTH_CACHE_TTL: float = 90.0
+    FORC_GC_MODE: str = "dry-run"
+    FORC_GC_INTERVAL: float = 300.0
+    FORC_GC_BATCH_SIZE: int = 500
+    FORC_GC_TIME_BUDGET: float = 0.5
+    FORC_GC_GRACE_PERIOD: float = 600.0
+    FORC_GC_QUARANTINE_PATH: str = "quarantine"
 
     @validator('FORC_USER_PATH', pre=True)
     def apply_backend_path(cls, v, values):
@@ -35,6 +71,83 @@ class Settings(BaseSettings):
             # should only happen when there was an error with FORC_BACKEND_PATH
             return "/var/forc/backend_path/users"
 
+    @validator('FORC_ROUTING_MODE')
+    def check_routing_mode(cls, v):
+        """
+        Validates forc routing mode.
+        :param v: Value for forc routing mode.
+        :return: FORC_ROUTING_MODE in lower case.
+        """
+        v = v.lower()
+        if v not in ("files", "dynamic"):
+            raise ValueError("FORC_ROUTING_MODE must be 'files' or 'dynamic'.")
+        return v
+
+    @validator('FORC_LOG_FORMAT')
+    def check_log_format(cls, v):
+        """
+        Validates forc log format.
+        :param v: Value for forc log format.
+        :return: FORC_LOG_FORMAT in lower case.
+        """
+        v = v.lower()
+        if v not in ("text", "json"):
+            raise ValueError("FORC_LOG_FORMAT must be 'text' or 'json'.")
+        return v
+
+    @validator('FORC_STATE_PATH', pre=True)
+    def apply_backend_path_to_state_path(cls, v, values):
+        """
+        Validates forc state path, relative paths are placed inside the forc backend path.
+        :param v: Value for forc state path.
+        :param values: Values already read for settings object.
+        :return: Updated FORC_STATE_PATH.
+        """
+        if os.path.isabs(v):
+            return v
+        if FORC_BACKEND_PATH := values.get('FORC_BACKEND_PATH'):
+            return f"{FORC_BACKEND_PATH}/{v}"
+        else:
+            return f"/var/forc/backend_path/{v}"
+
+    @validator('FORC_METADATA_DB')
+    def apply_state_path_to_metadata_db(cls, v, values):
+        """
+        Validates forc metadata db, relative paths are placed inside the forc state path.
+        :param v: Value for forc metadata db.
+        :param values: Values already read for settings object.
+        :return: Updated FORC_METADATA_DB, None if the metadata store is disabled.
+        """
+        if not v:
+            return None
+        if os.path.isabs(v):
+            return v
+        return f"{values.get('FORC_STATE_PATH', '/var/forc/backend_path/.forc')}/{v}"
+
+    @validator('FORC_GC_MODE')
+    def check_gc_mode(cls, v):
+        """
+        Validates forc garbage collection mode.
+        :param v: Value for forc garbage collection mode.
+        :return: FORC_GC_MODE in lower case.
+        """
+        v = v.lower()
+        if v not in ("dry-run", "quarantine", "remove"):
+            raise ValueError("FORC_GC_MODE must be 'dry-run', 'quarantine' or 'remove'.")
+        return v
+
+    @validator('FORC_GC_QUARANTINE_PATH')
+    def apply_state_path_to_quarantine_path(cls, v, values):
+        """
+        Validates forc garbage collection quarantine path, relative paths are placed inside the forc state path.
+        :param v: Value for forc garbage collection quarantine path.
+        :param values: Values already read for settings object.
+        :return: Updated FORC_GC_QUARANTINE_PATH.
+        """
+        if os.path.isabs(v):
+            return v
+        return f"{values.get('FORC_STATE_PATH', '/var/forc/backend_path/.forc')}/{v}"
+
     class Config:
         """
         Config for settings object.
@@ -3,6 +3,8 @@ Serializers for incoming and outgoing models.
 """
 import re
 import logging
+from typing import Any, Dict, List, Optional
+
 from pydantic import BaseModel, Field, validator
 
 logger = logging.getLogger("validation")
@@ -20,6 +22,10 @@ tags_metadata = [
         "name": "Users",
         "description": "Operations with users.",
     },
+    {
+        "name": "Events",
+        "description": "Feed of backend and user changes.",
+    },
     {
         "name": "Miscellanous",
         "description": "Operations with miscellanous.",
@@ -61,7 +67,7 @@ class BackendBase(BaseModel):
         :param owner: Value to assign to owner.
         :return: Value or AssertionError.
         """
-        logger.info(f"Validate owner name -> {owner}")
+        logger.debug(f"Validate owner name -> {owner}")
         if re.fullmatch(owner_regex, owner):
             return owner
         else:
@@ -145,6 +151,54 @@ class BackendTemp(BackendIn, BackendOut):
     upstream_url: str = None
 
 
+class BackendBatchIn(BaseModel):
+    """
+    Batch of backends to create.
+    """
+    backends: List[BackendIn] = Field(..., min_length=1, description="Backends to create.")
+
+
+class BackendBatchDelete(BaseModel):
+    """
+    Batch of backend ids to delete.
+    """
+    ids: List[int] = Field(..., min_length=1, description="IDs of the backends to delete.")
+
+
+class BackendCount(BaseModel):
+    """
+    Backend count model.
+    """
+    count: int = Field(..., description="Number of matching backends.")
+
+
+class BackendBatchResult(BaseModel):
+    """
+    Result for a single item of a backend batch.
+    """
+    index: int = Field(..., description="Position of the item in the batch.")
+    id: Optional[int] = Field(None, description="ID of the created or deleted backend.")
+    backend: Optional[BackendOut] = Field(None, description="Created backend.")
+    error: Optional[str] = Field(None, description="Reason why the item failed, empty on success.")
+
+
+class BackendHealth(BaseModel):
+    """
+    Cached result of the last health check of the upstream of a backend.
+    """
+    id: int = Field(..., description="ID of the backend.")
+    upstream_url: Optional[str] = Field(None, description="Upstream url which was checked.")
+    status: str = Field(
+        ...,
+        description="'up' if the upstream answered with a status below 500, 'down' if it did not answer or failed, "
+                    "'unknown' if it was not checked within the cache TTL."
+    )
+    status_code: Optional[int] = Field(None, description="HTTP status code of the upstream.")
+    latency: Optional[float] = Field(None, description="Duration of the check in seconds.")
+    checked: Optional[float] = Field(None, description="Unix time of the check.")
+    error: Optional[str] = Field(None, description="Reason why the upstream is down.")
+
+
 class Template(BaseModel):
     """
     Template model.
@@ -161,8 +215,119 @@ class User(BaseModel):
     user: str
 
 
+class UserList(BaseModel):
+    """
+    User list model.
+    """
+    users: List[str] = Field(..., description="User ids.", example=["21894723853fhdzug92@elixir-europe.org"])
+
+
+class UserMembership(BaseModel):
+    """
+    Result of a membership change of a backend.
+    """
+    added: List[str] = Field([], description="Users which were added.")
+    removed: List[str] = Field([], description="Users which were removed.")
+    failed: List[str] = Field([], description="Users which could not be added or removed.")
+
+
+class Event(BaseModel):
+    """
+    Change event model.
+    """
+    id: str = Field(..., description="Event id, pass it as Last-Event-ID or since to resume after this event.")
+    type: str = Field(
+        ...,
+        description="backend.created, backend.deleted, users.changed or reset if events were missed.",
+        example="backend.created"
+    )
+    time: float = Field(..., description="Unix time of the change.")
+    data: Dict[str, Any] = Field({}, description="Changed backend or users of a backend.")
+
+
+class EventBatch(BaseModel):
+    """
+    Long-poll response model of change events.
+    """
+    events: List[Event] = Field([], description="Events after the given event id, empty on timeout.")
+    last_id: str = Field(..., description="Id to resume from with the next request.")
+
+
 class Util(BaseModel):
     """
     Util model.
     """
     version: str
+
+
+class Readiness(BaseModel):
+    """
+    Worker readiness model.
+    """
+    ready: bool = Field(..., description="Whether all indexes and caches of this worker are built.")
+    preloaded: bool = Field(..., description="Whether the indexes were built before the worker was forked.")
+    import_time: Optional[float] = Field(None, description="Seconds it took to import the application.")
+    phases: Dict[str, float] = Field(..., description="Duration of each startup phase in seconds.")
+
+
+class ExecutorStats(BaseModel):
+    """
+    Statistics model of the executor for blocking filesystem work.
+    """
+    max_workers: int = Field(..., description="Number of worker threads.")
+    submitted: int = Field(..., description="Number of submitted calls.")
+    active: int = Field(..., description="Number of calls currently running.")
+    queued: int = Field(..., description="Number of calls currently waiting for a worker.")
+    max_queued: int = Field(..., description="Highest number of calls waiting for a worker at once.")
+
+
+class ReloadStats(BaseModel):
+    """
+    OpenResty reload statistics model.
+    """
+    requests: int = Field(..., description="Number of requested reloads.")
+    reloads: int = Field(..., description="Number of executed reloads.")
+    failures: int = Field(..., description="Number of failed reloads.")
+    last_latency: Optional[float] = Field(None, description="Duration of the last reload in seconds.")
+    average_latency: Optional[float] = Field(None, description="Average duration of a reload in seconds.")
+    leader: bool = Field(False, description="Whether this worker process runs the reloads of all workers.")
+
+
+class GcFinding(BaseModel):
+    """
+    Orphaned or malformed entry found by the garbage collection.
+    """
+    kind: str = Field(
+        ...,
+        description="'orphaned_user_dir', 'malformed_file', 'stale_temp_file' or 'duplicate_upstream'."
+    )
+    scope: str = Field(..., description="'backends' for the backend path, 'users' for the user path.")
+    name: str = Field(..., description="File or directory name.")
+    backend_id: Optional[int] = Field(None, description="ID of a duplicate backend.")
+    action: str = Field(..., description="'none' in dry-run, 'quarantined', 'removed', 'skipped' or 'failed'.")
+    error: Optional[str] = Field(None, description="Reason why the action failed or was skipped.")
+
+
+class GcReport(BaseModel):
+    """
+    Result of a garbage collection run.
+    """
+    mode: str = Field(..., description="Configured mode, 'dry-run', 'quarantine' or 'remove'.")
+    dry_run: bool = Field(..., description="Whether findings were only reported.")
+    started: float = Field(..., description="Unix time of the start of the run.")
+    duration: float = Field(..., description="Duration of the run in seconds.")
+    scanned: int = Field(..., description="Number of entries checked in this run.")
+    pending: int = Field(..., description="Number of entries left for the next runs of the current sweep.")
+    findings: List[GcFinding] = Field([], description="Entries found in this run.")
+
+
+class RoutingStats(BaseModel):
+    """
+    Dynamic routing statistics model.
+    """
+    mode: str = Field(..., description="Routing mode, 'files' or 'dynamic'.")
+    generation: Optional[str] = Field(None, description="Route generation currently held by OpenResty.")
+    pushes: int = Field(..., description="Number of pushed route changes.")
+    syncs: int = Field(..., description="Number of full route syncs.")
+    failures: int = Field(..., description="Number of failed pushes and syncs.")
+    last_sync: Optional[float] = Field(None, description="Unix time of the last full sync.")
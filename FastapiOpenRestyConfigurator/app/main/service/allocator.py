@@ -0,0 +1,127 @@
+"""
+Allocation of backend ids and location url suffixes.
+Ids come from a counter which is persisted in blocks, so an id is never handed out twice, also not across restarts
+or by different worker processes.
+Suffixes are the lowest suffix of a user key url which is neither used by a backend nor reserved by a create in
+progress, so suffixes of deleted backends are reused and there is no upper limit. The registry keeps the free
+suffixes of every user key url, so the used suffixes are not scanned.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Dict, Optional, Set
+
+from ..service.registry import BackendRegistry, backend_registry
+from ..service.transaction import write_atomic
+from ..util.executor import run_blocking
+from ..util.locking import FileLock
+from ..config import get_settings
+
+logger = logging.getLogger("service")
+settings = get_settings()
+
+FIRST_ID = 1000000000
+
+
+class BackendAllocator:
+    """
+    Hands out backend ids and location url suffixes.
+    """
+
+    def __init__(self, registry: BackendRegistry, state_path: Optional[str] = None, block_size: int = 1000):
+        """
+        :param registry: Registry of the existing backends.
+        :param state_path: Directory of the state file, the counter is not persisted without it.
+        :param block_size: Number of ids reserved with a single write of the state file.
+        """
+        self.registry = registry
+        self.state_file = os.path.join(state_path, "allocator.json") if state_path else None
+        self._state_lock = FileLock(f"{self.state_file}.lock") if self.state_file else None
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        # Serializes the reservations of blocks, which run in executor threads
+        self._reserve_lock = threading.Lock()
+        self._next_id: Optional[int] = None
+        # Ids below this watermark are persisted as handed out
+        self._reserved_until = 0
+        self._reserved_suffixes: Dict[str, Set[int]] = {}
+
+    async def allocate_id(self) -> int:
+        """
+        Get a new backend id, the next block of ids is reserved in the executor once the current one is used up.
+        """
+        while True:
+            with self._lock:
+                if self._next_id is None:
+                    self._load()
+                if self._next_id < self._reserved_until:
+                    backend_id = self._next_id
+                    self._next_id += 1
+                    # Only collides with backend files created outside of FORC
+                    if self.registry.get(backend_id) is None:
+                        return backend_id
+                    continue
+            await run_blocking(self._reserve_block)
+
+    def allocate_suffix(self, user_key_url: str) -> int:
+        """
+        Get the lowest free suffix for a user key url and reserve it until it is released.
+        """
+        with self._lock:
+            reserved = self._reserved_suffixes.setdefault(user_key_url, set())
+            suffix = self.registry.free_suffix(user_key_url, reserved)
+            reserved.add(suffix)
+            return suffix
+
+    def release_suffix(self, user_key_url: str, suffix: int):
+        """
+        Release a reserved suffix, after its backend was written or its creation failed.
+        """
+        with self._lock:
+            reserved = self._reserved_suffixes.get(user_key_url)
+            if reserved is not None:
+                reserved.discard(suffix)
+                if not reserved:
+                    del self._reserved_suffixes[user_key_url]
+
+    def _load(self):
+        max_id = self.registry.max_id()
+        self._next_id = max(FIRST_ID, max_id + 1 if max_id is not None else FIRST_ID)
+        self._reserved_until = self._next_id
+
+    def _reserve_block(self):
+        """
+        Reserve the next block of ids. The block starts after all blocks reserved by other worker processes, which
+        share the state file. Blocks the calling thread on the state file lock, so it runs in the executor.
+        """
+        with self._reserve_lock:
+            with self._lock:
+                if self._next_id < self._reserved_until:
+                    # Reserved by a concurrent call
+                    return
+                next_id = self._next_id
+            if self.state_file is not None:
+                try:
+                    with self._state_lock:
+                        next_id = max(next_id, self._read_state())
+                        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+                        write_atomic(self.state_file, json.dumps({"next_id": next_id + self.block_size}))
+                except OSError as e:
+                    # Ids stay unique within this process, the registry check covers existing backends after a restart.
+                    logger.warning(f"Was not able to save allocator state {self.state_file}: {e}")
+            with self._lock:
+                self._next_id, self._reserved_until = next_id, next_id + self.block_size
+
+    def _read_state(self) -> int:
+        if not os.path.isfile(self.state_file):
+            return FIRST_ID
+        try:
+            with open(self.state_file, 'r') as state_file:
+                return int(json.load(state_file)["next_id"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Was not able to load allocator state {self.state_file}: {e}")
+            return FIRST_ID
+
+
+backend_allocator = BackendAllocator(backend_registry, settings.FORC_STATE_PATH)
@@ -3,151 +3,297 @@ Helper/service functions regarding backends.
 """
 import logging
 import os
-import re
-from random import randint
-from typing import List, Dict
-
-from werkzeug.exceptions import NotFound, InternalServerError
-
-from ..model.serializers import BackendOut, BackendIn, BackendTemp
-from ..service.openresty import reload_openresty
+from typing import List, Dict, Optional, Tuple
+
+from werkzeug.exceptions import HTTPException, NotFound, InternalServerError
+
+from ..model.serializers import BackendOut, BackendIn, BackendTemp, BackendBatchResult
+from ..service.allocator import backend_allocator
+from ..service.events import publish, publish_all, BACKEND_CREATED, BACKEND_DELETED
+from ..service.metadata import metadata_store, record_backend_changes
+from ..service.openresty import validate_openresty_config
+from ..service.registry import backend_lock, backend_registry
+from ..service.routing import apply_backend_changes, dynamic_routing
+from ..service.transaction import BackendTransaction
+from ..util.executor import run_blocking
+from ..util.metrics import file_writes
 from ..util.templating import generate_backend_by_template
 from ..config import get_settings
 
 logger = logging.getLogger("service")
 settings = get_settings()
 
-file_regex = r"(\d*)%([a-z0-9\-\@.]*?)%([^%]*)%([^%]*)%([^%]*)\.conf"
-
-
-async def random_with_n_digits(n):
-    range_start = 10 ** (n - 1)
-    range_end = (10 ** n) - 1
-    return randint(range_start, range_end)
-
 
 async def get_backends() -> List[BackendOut]:
-    if not os.path.exists(settings.FORC_BACKEND_PATH) and not os.access(settings.FORC_BACKEND_PATH, os.W_OK):
-        logger.error("Not able to access configured backend path.")
-        return []
-    if len(os.listdir(settings.FORC_BACKEND_PATH)) == 0:
-        return []
-    backend_path_files = os.listdir(settings.FORC_BACKEND_PATH)
-    logger.info(backend_path_files)
-    valid_backends = []
-    for file in backend_path_files:
-        match = re.fullmatch(file_regex, file)
-        if not match:
-            logger.warning("Found a backend file with wrong naming, skipping it: " + str(file))
-            continue
-        backend: BackendOut = BackendOut(
-                id=match.group(1),
-            owner=match.group(2),
-            location_url=match.group(3),
-            template=match.group(4),
-            template_version=match.group(5),
-            file_path=os.path.join(settings.FORC_BACKEND_PATH, file)
-        )
-        valid_backends.append(backend)
-    return valid_backends
-
-
-async def get_backends_upstream_urls() -> Dict[str, List[BackendOut]]:
-    valid_backends: List[BackendOut] = await get_backends()
-    upstream_urls = {}
-
-    for backend in valid_backends:
-        upstream_url = extract_proxy_pass(backend.file_path)
-        if upstream_url:
-            if upstream_url not in upstream_urls:
-                upstream_urls[upstream_url] = []
-            upstream_urls[upstream_url].append(backend)
-
-    return upstream_urls
-
-
-def extract_proxy_pass(file_path):
-    with open(file_path, 'r') as file:
-        content = file.read()
-
-    match = re.search(r'proxy_pass\s+(http[^\s;]+);', content)
-
-    if match:
-        return match.group(1)
+    return backend_registry.all()
+
+
+def generation() -> str:
+    return backend_registry.content_hash()
+
+
+async def count_backends(owner: Optional[str] = None, template: Optional[str] = None,
+                         template_version: Optional[str] = None) -> int:
+    """
+    Count backends, optionally filtered by owner, template and template version.
+    Uses the indexes of the metadata store if it is enabled, otherwise the registry of this process.
+    """
+    if metadata_store is not None:
+        return await run_blocking(metadata_store.count_backends, owner, template, template_version)
+    if template_version is not None and template is not None:
+        backends = backend_registry.by_template_version(template, template_version)
+    elif template is not None:
+        backends = backend_registry.by_template(template)
+    elif owner is not None:
+        backends = backend_registry.by_owner(owner)
     else:
-        return None
-
-
-async def generate_suffix_number(user_key_url):
-    current_backends: List[BackendOut] = await get_backends()
-    same_name_backend_ids = []
-
-    for backend in current_backends:
-        if backend.location_url.split("_")[0] == user_key_url:
-            same_name_backend_ids.append(int(backend.location_url.split("_")[1]))
+        backends = backend_registry.all()
+    return sum(
+        1 for backend in backends
+        if (owner is None or backend.owner == owner)
+        and (template is None or backend.template == template)
+        and (template_version is None or backend.template_version == template_version)
+    )
+
+
+async def get_backends_page(cursor: Optional[int] = None, limit: Optional[int] = None) \
+        -> Tuple[List[BackendOut], Optional[int]]:
+    """
+    Get backends ordered by id, starting after the cursor.
+    :param cursor: Id of the last backend of the previous page.
+    :param limit: Maximum number of backends.
+    :return: Backends and the cursor of the next page, None if there is none.
+    """
+    backends = backend_registry.page(cursor, limit)
+    next_cursor = backends[-1].id if limit is not None and len(backends) == limit else None
+    return backends, next_cursor
+
+
+async def iter_backends(cursor: Optional[int] = None, limit: Optional[int] = None, chunk_size: int = 500):
+    """
+    Iterate over backends ordered by id in chunks, so only one chunk is held at a time.
+    :param cursor: Id of the last backend already returned.
+    :param limit: Maximum number of backends.
+    :param chunk_size: Number of backends per chunk.
+    """
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        backends = backend_registry.page(cursor, size)
+        if not backends:
+            return
+        yield backends
+        if len(backends) < size:
+            return
+        cursor = backends[-1].id
+        if remaining is not None:
+            remaining -= len(backends)
+
+
+async def get_backend(backend_id) -> Optional[BackendOut]:
+    return backend_registry.get(backend_id)
+
+
+async def get_backends_by_owner(owner: str) -> List[BackendOut]:
+    return backend_registry.by_owner(owner)
+
+
+async def get_backends_by_template(template: str, template_version: str = None) -> List[BackendOut]:
+    if template_version is None:
+        return backend_registry.by_template(template)
+    return backend_registry.by_template_version(template, template_version)
 
-    if not same_name_backend_ids:
-        return "100"
 
-    same_name_backend_ids.sort()
-    highest_id = same_name_backend_ids[-1]
-    if highest_id == 999:
-        logger.warning("Reached max index number for requested user_key_url: " + user_key_url)
-        raise InternalServerError("Reached max index number for requested user_key_url (limit=999).")
+async def get_backends_upstream_urls() -> Dict[str, List[BackendOut]]:
+    return backend_registry.upstream_urls()
 
-    return str(highest_id + 1)
 
+def backend_file_name(backend: BackendTemp) -> str:
+    return f"{backend.id}%{backend.owner}%{backend.location_url}%{backend.template}%{backend.template_version}.conf"
 
-async def create_backend(payload: BackendIn):
-    payload: BackendTemp = BackendTemp(**payload.dict())
-    suffix_number = await generate_suffix_number(payload.user_key_url)
 
-    payload.id = str(await random_with_n_digits(10))
+async def render_backend(payload: BackendIn, suffix_number: int) -> Tuple[BackendTemp, str]:
+    """
+    Assign id and location url to a new backend and render its config from the template.
+    :param payload: Backend to render.
+    :param suffix_number: Suffix for the location url, allocated by the backend allocator.
+    :return: Backend and rendered backend file contents.
+    """
+    payload: BackendTemp = BackendTemp(**payload.model_dump())
+    payload.id = await backend_allocator.allocate_id()
 
     backend_file_contents = await generate_backend_by_template(payload, suffix_number)
     if not backend_file_contents:
         raise InternalServerError("Server was not able to template a new backend.")
 
     payload.location_url = f"{payload.user_key_url}_{suffix_number}"
+    return payload, backend_file_contents
+
+
+async def write_backends(backends: List[Tuple[BackendTemp, str]]) -> List[BackendOut]:
+    """
+    Write rendered backends to the backend path, replacing backends with the same upstream url.
+    All deletions and creations are applied as one journaled transaction, which is rolled back if the resulting
+    OpenResty config does not pass the config test. Does not reload OpenResty.
+    Has to be called holding the backend lock, so the config test only sees the changes of this transaction.
+    :param backends: Backends with their rendered backend file contents.
+    :return: Backends which were replaced.
+    """
+    transaction = BackendTransaction()
+    replaced_backends: List[BackendOut] = []
+    for payload, backend_file_contents in backends:
+        # check for duplicated in ip and port:
+        matching_urls_backends: List[BackendOut] = backend_registry.by_upstream(payload.upstream_url)
+        for backend in matching_urls_backends:
+            logger.info(f"Deleting existing Backend with same Upstream Url - {payload.upstream_url}")
+            transaction.delete(os.path.basename(backend.file_path))
+            replaced_backends.append(backend)
+        transaction.create(backend_file_name(payload), backend_file_contents)
+
+    with file_writes.time("backend"):
+        await run_blocking(transaction.commit)
+
+    for backend in replaced_backends:
+        backend_registry.remove(backend.id)
+    for payload, backend_file_contents in backends:
+        await run_blocking(backend_registry.add_file, backend_file_name(payload), backend_file_contents)
+
+    # Backend files are not included by OpenResty with dynamic routing, so there is nothing to test.
+    if settings.FORC_VALIDATE_CONFIG and not dynamic_routing():
+        valid, output = await validate_openresty_config(backend_registry.content_hash())
+        if not valid:
+            logger.error(f"OpenResty config test failed, rolling back new backends: {output}")
+            await run_blocking(transaction.rollback)
+            for payload, _ in backends:
+                backend_registry.remove(payload.id)
+            for backend in replaced_backends:
+                await run_blocking(backend_registry.add_file, os.path.basename(backend.file_path))
+            raise InternalServerError(f"Rendered backend config did not pass the OpenResty config test: {output}")
+
+    await run_blocking(transaction.validated)
+    await run_blocking(transaction.finalize)
+    await run_blocking(
+        record_backend_changes,
+        [(payload, backend_file_name(payload), payload.upstream_url) for payload, _ in backends],
+        [backend.id for backend in replaced_backends]
+    )
+    events = [(BACKEND_DELETED, backend.model_dump(exclude={"file_path"})) for backend in replaced_backends]
+    for payload, _ in backends:
+        backend = backend_registry.get(payload.id)
+        if backend is not None:
+            events.append((BACKEND_CREATED, backend.model_dump(exclude={"file_path"})))
+    await run_blocking(publish_all, events)
+    return replaced_backends
 
-    # check for duplicated in ip and port:
-    upstream_urls: Dict[str, List[BackendOut]] = await get_backends_upstream_urls()
-    matching_urls_backends: List[BackendOut] = upstream_urls.get(payload.upstream_url, [])
-    for backend in matching_urls_backends:
-        logger.info(f"Deleting existing Backend with same Upstream Url - {payload.upstream_url}")
-        await delete_backend(backend.id)
-
-    # create backend file in filesystem
-    filename = f"{payload.id}%{payload.owner}%{payload.location_url}%{payload.template}%{payload.template_version}.conf"
 
-    with open(f"{settings.FORC_BACKEND_PATH}/{filename}", 'w') as backend_file:
-        backend_file.write(backend_file_contents)
-
-    # attempt to reload openrest
-    await reload_openresty()
+async def create_backend(payload: BackendIn):
+    user_key_url = payload.user_key_url
+    async with backend_lock.hold():
+        suffix_number = backend_allocator.allocate_suffix(user_key_url)
+        try:
+            payload, backend_file_contents = await render_backend(payload, suffix_number)
+            replaced_backends = await write_backends([(payload, backend_file_contents)])
+        except OSError as e:
+            logger.exception(f"Was not able to write backend: {e}")
+            raise InternalServerError("Server was not able to write the backend.")
+        finally:
+            backend_allocator.release_suffix(user_key_url, suffix_number)
+
+    # attempt to reload openresty or to push the new route
+    await apply_backend_changes([payload], replaced_backends)
     return payload
 
 
-async def delete_backend(backend_id) -> bool:
-    if not os.path.exists(settings.FORC_BACKEND_PATH) and not os.access(settings.FORC_BACKEND_PATH, os.W_OK):
-        logger.error("Not able to access configured backend path.")
-        return False
-    if len(os.listdir(settings.FORC_BACKEND_PATH)) == 0:
-        return False
-    backend_path_files = os.listdir(settings.FORC_BACKEND_PATH)
-    for file in backend_path_files:
-        match = re.fullmatch(file_regex, file)
-        if not match:
-            logger.warning(f"Found a backend file with wrong naming, skipping it: {file}")
-            continue
-        if int(match.group(1)) == int(backend_id):
-            logger.info(f"Attempting to delete backend with id: {backend_id} as file: {settings.FORC_BACKEND_PATH}/{file}")
+async def create_backends(payloads: List[BackendIn]) -> List[BackendBatchResult]:
+    """
+    Create several backends with a single OpenResty reload.
+    The whole batch is validated and rendered before any file is written, and all files are written in a single
+    transaction.
+    :param payloads: Backends to create.
+    :return: One result per payload, in the order of the payloads.
+    """
+    results = [BackendBatchResult(index=index) for index in range(len(payloads))]
+    seen_upstream_urls: Dict[str, int] = {}
+    reserved_suffixes: List[Tuple[str, int]] = []
+    rendered = []
+    async with backend_lock.hold():
+        try:
+            for index, payload in enumerate(payloads):
+                if payload.upstream_url in seen_upstream_urls:
+                    results[index].error = \
+                        f"Upstream url is already used by item {seen_upstream_urls[payload.upstream_url]}."
+                    continue
+                seen_upstream_urls[payload.upstream_url] = index
+                suffix_number = backend_allocator.allocate_suffix(payload.user_key_url)
+                reserved_suffixes.append((payload.user_key_url, suffix_number))
+                try:
+                    backend, backend_file_contents = await render_backend(payload, suffix_number)
+                    rendered.append((index, backend, backend_file_contents))
+                except HTTPException as e:
+                    results[index].error = e.description
+
+            if not rendered:
+                return results
             try:
-                os.remove(f"{settings.FORC_BACKEND_PATH}/{file}")
-                logger.info(f"Deleted backend with id: {backend_id}")
-                await reload_openresty()
-                return True
+                replaced_backends = await write_backends(
+                    [(backend, backend_file_contents) for _, backend, backend_file_contents in rendered]
+                )
             except OSError as e:
-                logger.warning(f"Was not able to delete backend with id: {backend_id} ERROR: {e}")
-                raise InternalServerError("Server was not able to delete this backend. Contact the admin.")
-    raise NotFound("Backend was not found.")
+                logger.exception(f"Was not able to write backend batch: {e}")
+                for index, _, _ in rendered:
+                    results[index].error = "Server was not able to write the backend."
+                return results
+            except InternalServerError as e:
+                for index, _, _ in rendered:
+                    results[index].error = e.description
+                return results
+        finally:
+            for user_key_url, suffix_number in reserved_suffixes:
+                backend_allocator.release_suffix(user_key_url, suffix_number)
+    for index, backend, _ in rendered:
+        results[index].id = backend.id
+        results[index].backend = backend
+
+    await apply_backend_changes([backend for _, backend, _ in rendered], replaced_backends)
+    return results
+
+
+async def delete_backend(backend_id, reload: bool = True) -> BackendOut:
+    async with backend_lock.hold():
+        backend: Optional[BackendOut] = backend_registry.get(backend_id)
+        if backend is None:
+            raise NotFound("Backend was not found.")
+        logger.debug(f"Attempting to delete backend with id: {backend_id} as file: {backend.file_path}")
+        try:
+            await run_blocking(os.remove, backend.file_path)
+        except OSError as e:
+            logger.warning(f"Was not able to delete backend with id: {backend_id} ERROR: {e}")
+            raise InternalServerError("Server was not able to delete this backend. Contact the admin.")
+        backend_registry.remove(backend_id)
+        await run_blocking(record_backend_changes, removed=[backend.id])
+    await run_blocking(publish, BACKEND_DELETED, backend.model_dump(exclude={"file_path"}))
+    logger.info(f"Deleted backend with id: {backend_id}")
+    if reload:
+        await apply_backend_changes(removed=[backend])
+    return backend
+
+
+async def delete_backends(backend_ids: List[int]) -> List[BackendBatchResult]:
+    """
+    Delete several backends with a single OpenResty reload.
+    :param backend_ids: Ids of the backends to delete.
+    :return: One result per id, in the order of the ids.
+    """
+    results = []
+    removed_backends = []
+    for index, backend_id in enumerate(backend_ids):
+        result = BackendBatchResult(index=index, id=backend_id)
+        try:
+            removed_backends.append(await delete_backend(backend_id, reload=False))
+        except HTTPException as e:
+            result.error = e.description
+        results.append(result)
+
+    if removed_backends:
+        await apply_backend_changes(removed=removed_backends)
+    return results
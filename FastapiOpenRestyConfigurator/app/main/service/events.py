@@ -0,0 +1,286 @@
+"""
+Feed of backend and user changes.
+The worker process which made a change appends it to a journal in the state path, and every worker process reads the
+journal into a bounded ring buffer, so subscribers may resume from the last event they have seen on any worker.
+Changes made by others than FORC are found by the watchers of every worker process, but only published by the reload
+leader, and only if the worker which made the change did not publish it already.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, List, Optional, Set, Tuple
+
+from ..model.serializers import BackendOut, Event
+from ..service.openresty import reload_coordinator
+from ..service.registry import backend_registry
+from ..util.executor import run_blocking
+from ..util.locking import SharedJournal
+from ..util.metrics import metrics
+from ..config import get_settings
+
+logger = logging.getLogger("service")
+settings = get_settings()
+
+BACKEND_CREATED = "backend.created"
+BACKEND_DELETED = "backend.deleted"
+USERS_CHANGED = "users.changed"
+# Sent instead of the missed events if a subscriber fell out of the buffer, it has to list everything again.
+RESET = "reset"
+
+# Size in bytes after which the journal is started over, subscribers of the replaced journal get a reset event.
+JOURNAL_SIZE = 8 * 1024 * 1024
+
+
+class EventFeed:
+    """
+    Ring buffer of the events in the shared journal with waiters for new events.
+    Event ids are the position of the event in the journal prefixed by the epoch of the journal, so they are equal in
+    all worker processes. Events may be published from any thread.
+    """
+
+    def __init__(self, state_path: str, size: int, poll_interval: float, detection_grace: float = 1.0,
+                 detection_window: float = 30.0):
+        """
+        :param state_path: Directory of the journal shared with the other worker processes.
+        :param size: Number of events kept in the buffer.
+        :param poll_interval: Seconds between two reads of the journal while subscribers wait.
+        :param detection_grace: Seconds the worker which made a change has to publish it, before a detected change is
+            published.
+        :param detection_window: Seconds a published event may be older than a detected change to be the same change.
+        """
+        self.poll_interval = poll_interval
+        self.detection_grace = detection_grace
+        self.detection_window = detection_window
+        self._journal = SharedJournal(os.path.join(state_path, "events.journal"), max_size=JOURNAL_SIZE)
+        self._epoch: Optional[str] = None
+        self._counter = 0
+        self._buffer: Deque[Tuple[int, Event]] = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        # (time of detection, event type, data) of changes found by a watcher
+        self._detected: List[Tuple[float, str, dict]] = []
+        self._task: Optional[asyncio.Task] = None
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The buffer matches the journal position, only the locks and tasks of the parent are not usable.
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._waiters = set()
+        self._detected = []
+        self._task = None
+
+    def start(self):
+        """
+        Read the journal of all worker processes while subscribers wait or detected changes are pending.
+        """
+        # Subscribers of all worker processes share the epoch of the journal from the start
+        self._journal.append([])
+        self.sync()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if not self._waiters and not self._detected:
+                continue
+            try:
+                await run_blocking(self.sync)
+                if self._detected:
+                    await run_blocking(self.publish_due)
+            except Exception:
+                logger.exception("Was not able to read change events of other worker processes.")
+
+    @property
+    def last_id(self) -> str:
+        return f"{self._epoch or 0}-{self._counter}"
+
+    def publish(self, events: List[Tuple[str, dict]]):
+        """
+        Append events to the journal.
+        :param events: Type and data of every event.
+        """
+        now = time.time()
+        lines = [json.dumps({"type": event_type, "time": now, "data": data}, separators=(",", ":"))
+                 for event_type, data in events]
+        try:
+            self._journal.append(lines)
+        except OSError as e:
+            logger.warning(f"Was not able to publish {len(lines)} change events to {self._journal.path}: {e}")
+            return
+        for event_type, _ in events:
+            events_published.inc(event_type)
+        self.sync()
+
+    def detected(self, event_type: str, data: dict):
+        """
+        Publish a change found by a watcher after the grace period, unless the worker which made it published it.
+        """
+        with self._lock:
+            self._detected.append((time.time(), event_type, data))
+
+    def publish_due(self):
+        """
+        Publish the detected changes whose grace period is over and which were not published yet.
+        """
+        now = time.time()
+        with self._lock:
+            due = [change for change in self._detected if now - change[0] >= self.detection_grace]
+            self._detected = [change for change in self._detected if now - change[0] < self.detection_grace]
+            events = [event for _, event in self._buffer]
+        missing = []
+        for detected, event_type, data in due:
+            if not any(event.type == event_type and event.data == data
+                       and event.time >= detected - self.detection_window for event in events):
+                missing.append((event_type, data))
+        if missing:
+            logger.info(f"Publishing {len(missing)} changes made by others than FORC.")
+            self.publish(missing)
+
+    def sync(self):
+        """
+        Read the events appended to the journal since the last sync and wake the waiters.
+        """
+        with self._sync_lock:
+            try:
+                lines = self._journal.read()
+                if lines is None:
+                    # The journal was started over, its events are numbered from the start
+                    lines = self._journal.read() or []
+            except OSError as e:
+                logger.warning(f"Was not able to read change events from {self._journal.path}: {e}")
+                return
+            if not lines and self._journal.epoch == self._epoch:
+                return
+            with self._lock:
+                if self._journal.epoch != self._epoch:
+                    self._epoch = self._journal.epoch
+                    self._counter = 0
+                    self._buffer.clear()
+                # Only the events which fit into the buffer are parsed, but all are counted.
+                skipped = max(0, len(lines) - self._buffer.maxlen)
+                self._counter += skipped
+                for line in lines[skipped:]:
+                    self._counter += 1
+                    try:
+                        entry = json.loads(line)
+                        event = Event(id=f"{self._epoch}-{self._counter}", type=entry["type"], time=entry["time"],
+                                      data=entry["data"])
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning(f"Skipping malformed change event {self._counter} in {self._journal.path}.")
+                        continue
+                    self._buffer.append((self._counter, event))
+                waiters = list(self._waiters)
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(waiter.set)
+            except RuntimeError:
+                # Loop of the waiter is closed already
+                pass
+
+    def since(self, last_event_id: Optional[str]) -> List[Event]:
+        """
+        Get the events after an event id.
+        :param last_event_id: Id of the last seen event, None for only new events.
+        :return: Missed events, or a single reset event if they are not in the buffer anymore.
+        """
+        with self._lock:
+            if last_event_id is None:
+                return []
+            epoch, _, counter = last_event_id.rpartition("-")
+            if epoch != str(self._epoch or 0) or not counter.isdigit() or int(counter) > self._counter:
+                return [Event(id=self.last_id, type=RESET, time=time.time(), data={})]
+            if int(counter) == self._counter:
+                return []
+            oldest = self._buffer[0][0] if self._buffer else self._counter + 1
+            if int(counter) < oldest - 1:
+                return [Event(id=self.last_id, type=RESET, time=time.time(), data={})]
+            return [event for position, event in self._buffer if position > int(counter)]
+
+    async def current_id(self) -> str:
+        """
+        :return: Id of the last event of all worker processes.
+        """
+        await run_blocking(self.sync)
+        return self.last_id
+
+    async def wait(self, last_event_id: Optional[str], timeout: float) -> List[Event]:
+        """
+        Wait until there are events after an event id.
+        :param last_event_id: Id of the last seen event, None to wait for the next event.
+        :param timeout: Seconds to wait at most.
+        :return: Events after the event id, empty on timeout.
+        """
+        if last_event_id is None:
+            last_event_id = await self.current_id()
+        else:
+            await run_blocking(self.sync)
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                waiter[1].clear()
+                events = self.since(last_event_id)
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return events
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    def __len__(self):
+        return len(self._waiters)
+
+
+event_feed = EventFeed(settings.FORC_STATE_PATH, settings.FORC_EVENT_BUFFER_SIZE, settings.FORC_EVENT_POLL_INTERVAL)
+
+events_published = metrics.counter("forc_events_total", "Number of published change events by type.", ("type",))
+metrics.gauge("forc_event_subscribers", "Number of subscribers waiting for change events.", lambda: len(event_feed))
+
+
+def publish(event_type: str, data: dict):
+    event_feed.publish([(event_type, data)])
+
+
+def publish_all(events: List[Tuple[str, dict]]):
+    event_feed.publish(events)
+
+
+def publish_detected(event_type: str, data: dict):
+    """
+    Publish a change found by a watcher, only done by the reload leader, as the watchers of all worker processes
+    find it.
+    """
+    if reload_coordinator.leader.is_leader:
+        event_feed.detected(event_type, data)
+
+
+def _publish_detected_backends(added: List[BackendOut], removed: List[BackendOut]):
+    for backend in removed:
+        publish_detected(BACKEND_DELETED, backend.model_dump(exclude={"file_path"}))
+    for backend in added:
+        publish_detected(BACKEND_CREATED, backend.model_dump(exclude={"file_path"}))
+
+
+backend_registry.add_listener(_publish_detected_backends)
@@ -0,0 +1,308 @@
+"""
+Service to check whether the upstreams of backends are reachable.
+Every upstream of the upstream index is probed in the background with a single HTTP request, the status line is
+enough to know whether RStudio or Jupyter answers. Probes run with bounded concurrency at jittered intervals and the
+results are cached, so clients ask FORC instead of polling the proxied urls through the access phase of OpenResty.
+Only the reload leader probes in the background and shares its results with the other worker processes through a
+file in the state path.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import ssl
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+from ..model.serializers import BackendHealth
+from ..service.openresty import reload_coordinator
+from ..service.registry import backend_registry
+from ..util.executor import run_blocking
+from ..util.metrics import metrics
+from ..config import get_settings
+
+logger = logging.getLogger("service")
+settings = get_settings()
+
+STATUS_UP = "up"
+STATUS_DOWN = "down"
+STATUS_UNKNOWN = "unknown"
+
+
+class UpstreamCheck(NamedTuple):
+    status: str
+    status_code: Optional[int]
+    latency: float
+    checked: float
+    error: Optional[str]
+
+
+class HealthChecker:
+    """
+    Probes upstreams and caches the results by upstream url, backends sharing an upstream share its result.
+    """
+
+    def __init__(self, state_path: str, interval: float, timeout: float, concurrency: int, ttl: float,
+                 jitter: float = 0.1):
+        """
+        :param state_path: Directory of the file shared with the other worker processes.
+        :param interval: Seconds between two probes of an upstream, 0 disables probing in the background.
+        :param timeout: Seconds a probe may take before the upstream is considered down.
+        :param concurrency: Number of probes running at once.
+        :param ttl: Seconds a result is valid, older results are reported as unknown.
+        :param jitter: Share of the interval by which probes are spread randomly.
+        """
+        self.shared_file = os.path.join(state_path, "health.json")
+        self.interval = interval
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.ttl = ttl
+        self.jitter = jitter
+        self._results: Dict[str, UpstreamCheck] = {}
+        # upstream url -> monotonic time of the next background probe
+        self._due: Dict[str, float] = {}
+        self._probing: Dict[str, asyncio.Task] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._shared_mtime: Optional[int] = None
+        self._ssl_context: Optional[ssl.SSLContext] = None
+
+    def start(self):
+        """
+        Probe all upstreams in the background.
+        """
+        if self.interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        tick = min(1.0, self.interval)
+        while True:
+            try:
+                await self.check_due()
+            except Exception:
+                logger.exception("Was not able to check the health of upstreams.")
+            await asyncio.sleep(tick)
+
+    async def check_due(self):
+        """
+        Probe the upstreams whose interval elapsed, only done by the reload leader.
+        """
+        if not reload_coordinator.leader.is_leader:
+            return
+        upstreams = backend_registry.upstream_urls()
+        now = time.monotonic()
+        for upstream_url in set(self._due).difference(upstreams):
+            self._due.pop(upstream_url, None)
+            self._results.pop(upstream_url, None)
+        due = []
+        for upstream_url in upstreams:
+            if upstream_url not in self._due:
+                # Spread the first probes of all upstreams over one interval
+                self._due[upstream_url] = now + random.uniform(0, self.interval)
+            elif self._due[upstream_url] <= now:
+                due.append(upstream_url)
+        if due:
+            await asyncio.gather(*(self.probe(upstream_url) for upstream_url in due))
+            await run_blocking(self._save_shared)
+
+    async def probe(self, upstream_url: str) -> UpstreamCheck:
+        """
+        Probe an upstream now, concurrent probes of the same upstream wait for the same result.
+        """
+        task = self._probing.get(upstream_url)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._probe(upstream_url))
+            self._probing[upstream_url] = task
+            task.add_done_callback(lambda _: self._probing.pop(upstream_url, None))
+        return await asyncio.shield(task)
+
+    async def _probe(self, upstream_url: str) -> UpstreamCheck:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            started = time.perf_counter()
+            status_code = None
+            try:
+                status_code = await asyncio.wait_for(self._request(upstream_url), self.timeout)
+                status = STATUS_UP if status_code < 500 else STATUS_DOWN
+                error = None if status == STATUS_UP else f"HTTP status {status_code}"
+            except asyncio.TimeoutError:
+                status, error = STATUS_DOWN, f"No response within {self.timeout}s"
+            except (OSError, ValueError) as e:
+                status, error = STATUS_DOWN, str(e) or type(e).__name__
+            latency = time.perf_counter() - started
+        health_checks.observe(latency, status)
+        check = UpstreamCheck(status, status_code, latency, time.time(), error)
+        self._results[upstream_url] = check
+        self._due[upstream_url] = time.monotonic() + self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        return check
+
+    async def _request(self, upstream_url: str) -> int:
+        """
+        Send a HEAD request and read the status line.
+        :return: HTTP status code.
+        """
+        url = urlsplit(upstream_url)
+        if url.scheme not in ("http", "https") or not url.hostname:
+            raise ValueError(f"Unsupported upstream url {upstream_url}")
+        https = url.scheme == "https"
+        reader, writer = await asyncio.open_connection(
+            url.hostname, url.port or (443 if https else 80), ssl=self._get_ssl_context() if https else None
+        )
+        try:
+            writer.write(
+                f"HEAD {url.path or '/'} HTTP/1.0\r\nHost: {url.netloc}\r\nUser-Agent: forc-health-check\r\n"
+                f"Connection: close\r\n\r\n".encode()
+            )
+            await writer.drain()
+            status_line = await reader.readline()
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                # The status is already read, a failed close (e.g. an unclean TLS shutdown) does not matter.
+                pass
+        parts = status_line.split()
+        if len(parts) < 2 or not parts[0].startswith(b"HTTP/") or not parts[1].isdigit():
+            raise ValueError("Invalid HTTP response")
+        return int(parts[1])
+
+    def _get_ssl_context(self) -> ssl.SSLContext:
+        if self._ssl_context is None:
+            # Only liveness is checked, upstreams are addressed by ip and mostly have self-signed certificates.
+            self._ssl_context = ssl.create_default_context()
+            self._ssl_context.check_hostname = False
+            self._ssl_context.verify_mode = ssl.CERT_NONE
+        return self._ssl_context
+
+    async def load_shared(self):
+        """
+        Take over the results of the leader, once per request before reading cached results.
+        """
+        if not reload_coordinator.leader.is_leader:
+            await run_blocking(self._load_shared)
+
+    def cached(self, upstream_url: str) -> Optional[UpstreamCheck]:
+        """
+        :return: Result of the last probe of an upstream, None if it is older than the TTL.
+        """
+        check = self._results.get(upstream_url)
+        if check is None or time.time() - check.checked > self.ttl:
+            return None
+        return check
+
+    def _save_shared(self):
+        content = json.dumps({upstream_url: check._asdict() for upstream_url, check in self._results.items()})
+        try:
+            os.makedirs(os.path.dirname(self.shared_file), exist_ok=True)
+            temp_file = f"{self.shared_file}.{os.getpid()}.tmp"
+            with open(temp_file, 'w') as shared_file:
+                shared_file.write(content)
+            os.replace(temp_file, self.shared_file)
+        except OSError as e:
+            logger.warning(f"Was not able to save health checks {self.shared_file}: {e}")
+
+    def _load_shared(self):
+        """
+        Take over results of the leader which are newer than the own results.
+        """
+        try:
+            mtime = os.stat(self.shared_file).st_mtime_ns
+            if mtime == self._shared_mtime:
+                return
+            with open(self.shared_file, 'r') as shared_file:
+                results = json.load(shared_file)
+        except (OSError, ValueError):
+            return
+        self._shared_mtime = mtime
+        for upstream_url, values in results.items():
+            check = UpstreamCheck(**values)
+            own = self._results.get(upstream_url)
+            if own is None or own.checked < check.checked:
+                self._results[upstream_url] = check
+
+    def up_count(self) -> int:
+        now = time.time()
+        return sum(1 for check in list(self._results.values())
+                   if check.status == STATUS_UP and now - check.checked <= self.ttl)
+
+
+health_checker = HealthChecker(
+    settings.FORC_STATE_PATH,
+    interval=settings.FORC_HEALTH_CHECK_INTERVAL,
+    timeout=settings.FORC_HEALTH_CHECK_TIMEOUT,
+    concurrency=settings.FORC_HEALTH_CHECK_CONCURRENCY,
+    ttl=settings.FORC_HEALTH_CACHE_TTL
+)
+
+health_checks = metrics.histogram(
+    "forc_health_check_duration_seconds", "Duration of upstream health checks by resulting status.", ("status",)
+)
+metrics.gauge("forc_health_upstreams_up", "Number of upstreams which were up at their last check.",
+              health_checker.up_count)
+
+
+def health_of(backend_id: int, upstream_url: Optional[str], check: Optional[UpstreamCheck]) -> BackendHealth:
+    if check is None:
+        return BackendHealth(
+            id=backend_id,
+            upstream_url=upstream_url,
+            status=STATUS_UNKNOWN,
+            error=None if upstream_url else "Backend has no upstream url."
+        )
+    return BackendHealth(id=backend_id, upstream_url=upstream_url, **check._asdict())
+
+
+async def get_backend_health(backend_id: int, refresh: bool = False) -> Optional[BackendHealth]:
+    """
+    Health of a single backend, its upstream is probed if it was not checked within the TTL.
+    :param backend_id: Id of the backend.
+    :param refresh: Probe the upstream even if a cached result exists.
+    :return: Health or None if the backend does not exist.
+    """
+    if backend_registry.get(backend_id) is None:
+        return None
+    upstream_url = backend_registry.upstream_of(backend_id)
+    if upstream_url is None:
+        return health_of(backend_id, None, None)
+    if not refresh:
+        await health_checker.load_shared()
+    check = None if refresh else health_checker.cached(upstream_url)
+    if check is None:
+        check = await health_checker.probe(upstream_url)
+    return health_of(backend_id, upstream_url, check)
+
+
+async def get_backends_health(backend_ids: Optional[Iterable[int]] = None, probe: bool = False) -> List[BackendHealth]:
+    """
+    Cached health of many backends.
+    :param backend_ids: Ids of the backends, all backends if None. Unknown ids are skipped.
+    :param probe: Probe upstreams without a result within the TTL instead of reporting them as unknown.
+    :return: Health of the backends ordered by id.
+    """
+    if backend_ids is None:
+        backends = sorted(backend_registry.all(), key=lambda backend: backend.id)
+    else:
+        backends = [backend for backend in map(backend_registry.get, sorted(set(backend_ids))) if backend is not None]
+    upstreams = {backend.id: backend_registry.upstream_of(backend.id) for backend in backends}
+    await health_checker.load_shared()
+    checks = {upstream_url: health_checker.cached(upstream_url) for upstream_url in set(upstreams.values())
+              if upstream_url is not None}
+    if probe:
+        missing = [upstream_url for upstream_url, check in checks.items() if check is None]
+        for upstream_url, check in zip(missing, await asyncio.gather(*map(health_checker.probe, missing))):
+            checks[upstream_url] = check
+    return [health_of(backend.id, upstreams[backend.id], checks.get(upstreams[backend.id]))
+            for backend in backends]
@@ -0,0 +1,304 @@
+"""
+Optional SQLite metadata store of backends and their users.
+The backend and user files stay the source of truth for OpenResty, the store mirrors them with indexes and additional
+metadata like the upstream url and the creation time. It runs in WAL mode, so all worker processes can read it while
+one of them writes. Every worker process records its own changes, changes made by others than FORC are recorded by
+the reload leader, whose watchers find them. SQLite is only imported if the store is enabled.
+"""
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Tuple
+
+from ..model.serializers import BackendOut
+from ..service.openresty import reload_coordinator
+from ..service.registry import backend_registry, extract_proxy_pass, parse_backend_file, location_prefix
+from ..config import get_settings
+
+if TYPE_CHECKING:
+    import sqlite3
+
+logger = logging.getLogger("service")
+settings = get_settings()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS backends (
+    id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    location_url TEXT NOT NULL,
+    user_key_url TEXT NOT NULL,
+    template TEXT NOT NULL,
+    template_version TEXT NOT NULL,
+    upstream_url TEXT,
+    file_name TEXT NOT NULL,
+    created REAL NOT NULL,
+    mtime INTEGER
+);
+CREATE INDEX IF NOT EXISTS backends_owner ON backends (owner);
+CREATE INDEX IF NOT EXISTS backends_template ON backends (template, template_version);
+CREATE INDEX IF NOT EXISTS backends_user_key_url ON backends (user_key_url);
+CREATE INDEX IF NOT EXISTS backends_upstream_url ON backends (upstream_url);
+CREATE TABLE IF NOT EXISTS users (
+    backend_id INTEGER NOT NULL,
+    user TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (backend_id, user)
+) WITHOUT ROWID;
+"""
+
+
+class MetadataStore:
+    """
+    SQLite database with a connection per thread.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _connection(self) -> "sqlite3.Connection":
+        """
+        Connection of the current thread, opened on first use, so no connection is inherited by forked workers.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            import sqlite3
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with connection:
+                connection.executescript(SCHEMA)
+                columns = {row["name"] for row in connection.execute("PRAGMA table_info(backends)")}
+                if "mtime" not in columns:
+                    # Stores created before the file mtimes were recorded
+                    connection.execute("ALTER TABLE backends ADD COLUMN mtime INTEGER")
+            self._local.connection = connection
+        return connection
+
+    def _after_fork(self):
+        self._local = threading.local()
+
+    def apply(self, added: Iterable[Tuple[BackendOut, str, Optional[str]]] = (), removed: Iterable[int] = ()):
+        """
+        Apply backend changes in one transaction.
+        :param added: Created backends with their file name and upstream url.
+        :param removed: Ids of deleted backends, their users are deleted as well.
+        """
+        now = time.time()
+        with self._connection() as connection:
+            for backend_id in removed:
+                connection.execute("DELETE FROM backends WHERE id = ?", (int(backend_id),))
+                connection.execute("DELETE FROM users WHERE backend_id = ?", (int(backend_id),))
+            for backend, file_name, upstream_url in added:
+                self._insert_backend(
+                    connection, backend, file_name, upstream_url, now, backend_registry.mtime_of(backend.id)
+                )
+
+    def set_users(self, backend_id, users: Set[str]):
+        """
+        Set the users of a backend, keeping the creation time of existing users.
+        """
+        with self._connection() as connection:
+            existing = {
+                row["user"] for row in
+                connection.execute("SELECT user FROM users WHERE backend_id = ?", (int(backend_id),))
+            }
+            self._change_users(connection, backend_id, users - existing, existing - users, time.time())
+
+    @staticmethod
+    def _change_users(connection, backend_id, added: Iterable[str], removed: Iterable[str], created: float):
+        connection.executemany(
+            "DELETE FROM users WHERE backend_id = ? AND user = ?", [(int(backend_id), user) for user in removed]
+        )
+        connection.executemany(
+            "INSERT INTO users (backend_id, user, created) VALUES (?, ?, ?)",
+            [(int(backend_id), user, created) for user in added]
+        )
+
+    def repair(self, backends: Iterable[Tuple[BackendOut, str, Optional[str], Optional[int]]],
+               users: Dict[str, Set[str]]) -> Tuple[int, int]:
+        """
+        Bring the store in line with the backend and user files, e.g. after they were changed while FORC was down.
+        Backends are compared by id, file name and file mtime, users by their set per backend.
+        :param backends: All backends with their file name, upstream url and file mtime in nanoseconds.
+        :param users: Users by backend id.
+        :return: Number of repaired backends and of backends with repaired users.
+        """
+        backends = {int(backend.id): (backend, file_name, upstream_url, mtime)
+                    for backend, file_name, upstream_url, mtime in backends}
+        users = {int(backend_id): backend_users for backend_id, backend_users in users.items() if backend_id.isdigit()}
+        with self._connection() as connection:
+            stored = {row["id"]: (row["file_name"], row["mtime"])
+                      for row in connection.execute("SELECT id, file_name, mtime FROM backends")}
+            stored_users: Dict[int, Set[str]] = {}
+            for row in connection.execute("SELECT backend_id, user FROM users"):
+                stored_users.setdefault(row["backend_id"], set()).add(row["user"])
+
+            removed = set(stored).difference(backends)
+            for backend_id in removed:
+                connection.execute("DELETE FROM backends WHERE id = ?", (backend_id,))
+            changed = [entry for backend_id, entry in backends.items() if stored.get(backend_id) != entry[1::2]]
+            for backend, file_name, upstream_url, mtime in changed:
+                created = mtime / 1e9 if mtime is not None else time.time()
+                self._insert_backend(connection, backend, file_name, upstream_url, created, mtime)
+
+            now = time.time()
+            changed_users = 0
+            for backend_id in set(stored_users).union(users):
+                current, recorded = users.get(backend_id, set()), stored_users.get(backend_id, set())
+                if current != recorded:
+                    self._change_users(connection, backend_id, current - recorded, recorded - current, now)
+                    changed_users += 1
+        if removed or changed or changed_users:
+            logger.info(f"Repaired {len(removed) + len(changed)} backends and the users of {changed_users} backends "
+                        f"in {self.db_path}.")
+        return len(removed) + len(changed), changed_users
+
+    def count_backends(self, owner: str = None, template: str = None, template_version: str = None) -> int:
+        conditions, parameters = self._conditions(owner, template, template_version)
+        row = self._connection().execute(f"SELECT COUNT(*) FROM backends{conditions}", parameters).fetchone()
+        return row[0]
+
+    def __len__(self):
+        return self.count_backends()
+
+    @staticmethod
+    def _conditions(owner=None, template=None, template_version=None):
+        conditions, parameters = [], []
+        for column, value in (("owner", owner), ("template", template), ("template_version", template_version)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), parameters
+
+    @staticmethod
+    def _insert_backend(connection, backend: BackendOut, file_name: str, upstream_url: Optional[str], created: float,
+                        mtime: Optional[int] = None):
+        # A backend recorded by another worker process keeps its creation time
+        connection.execute(
+            "INSERT INTO backends (id, owner, location_url, user_key_url, template, template_version, "
+            "upstream_url, file_name, created, mtime) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE "
+            "SET owner = excluded.owner, location_url = excluded.location_url, user_key_url = excluded.user_key_url, "
+            "template = excluded.template, template_version = excluded.template_version, "
+            "upstream_url = excluded.upstream_url, file_name = excluded.file_name, mtime = excluded.mtime",
+            (
+                int(backend.id), backend.owner, backend.location_url, location_prefix(backend.location_url),
+                backend.template, backend.template_version, upstream_url, file_name, created, mtime
+            )
+        )
+
+    def import_path(self, backend_path: str, user_path: str) -> int:
+        """
+        Rebuild the store from the backend and user files. Creation times are taken from the file mtimes.
+        :return: Number of imported backends.
+        """
+        backends = []
+        for file_name in os.listdir(backend_path):
+            backend = parse_backend_file(file_name)
+            file_path = os.path.join(backend_path, file_name)
+            if backend is None or not os.path.isfile(file_path):
+                continue
+            try:
+                with open(file_path, 'r') as file:
+                    upstream_url = extract_proxy_pass(file.read())
+                mtime = os.stat(file_path).st_mtime_ns
+            except OSError as e:
+                logger.warning(f"Was not able to import backend file {file_name}: {e}")
+                continue
+            backends.append((backend, file_name, upstream_url, mtime))
+
+        users: Dict[int, Iterable[str]] = {}
+        if os.path.isdir(user_path):
+            for backend_id in os.listdir(user_path):
+                if backend_id.isdigit() and os.path.isdir(os.path.join(user_path, backend_id)):
+                    users[int(backend_id)] = os.listdir(os.path.join(user_path, backend_id))
+
+        with self._connection() as connection:
+            connection.execute("DELETE FROM backends")
+            connection.execute("DELETE FROM users")
+            for backend, file_name, upstream_url, mtime in backends:
+                self._insert_backend(connection, backend, file_name, upstream_url, mtime / 1e9, mtime)
+            now = time.time()
+            connection.executemany(
+                "INSERT INTO users (backend_id, user, created) VALUES (?, ?, ?)",
+                [(backend_id, user, now) for backend_id, backend_users in users.items() for user in backend_users]
+            )
+        logger.info(f"Imported {len(backends)} backends and the users of {len(users)} backends into {self.db_path}.")
+        return len(backends)
+
+
+metadata_store: Optional[MetadataStore] = \
+    MetadataStore(settings.FORC_METADATA_DB) if settings.FORC_METADATA_DB else None
+
+
+def init_metadata_store(users: Dict[str, Set[str]]):
+    """
+    Import the backend path into an empty metadata store, otherwise repair the differences to the backend registry
+    and the users, e.g. of changes made while FORC was down.
+    :param users: Users by backend id.
+    """
+    if metadata_store is None:
+        return
+    if len(metadata_store) == 0:
+        metadata_store.import_path(settings.FORC_BACKEND_PATH, settings.FORC_USER_PATH)
+        return
+    metadata_store.repair(
+        [
+            (backend, os.path.basename(backend.file_path), backend_registry.upstream_of(backend.id),
+             backend_registry.mtime_of(backend.id))
+            for backend in backend_registry.all()
+        ],
+        users
+    )
+
+
+def record_backend_changes(added: Iterable[Tuple[BackendOut, str, Optional[str]]] = (), removed: Iterable[int] = ()):
+    """
+    Mirror backend changes into the metadata store if it is enabled.
+    The backend files are already written at this point, so a failing store only logs, it is fixed by an import.
+    """
+    if metadata_store is None:
+        return
+    import sqlite3
+    try:
+        metadata_store.apply(added, removed)
+    except sqlite3.Error as e:
+        logger.error(f"Was not able to update metadata store, run import_metadata.py to rebuild it: {e}")
+
+
+def record_users(backend_id, users: Set[str]):
+    """
+    Mirror the users of a backend into the metadata store if it is enabled.
+    """
+    if metadata_store is None or not str(backend_id).isdigit():
+        return
+    import sqlite3
+    try:
+        metadata_store.set_users(backend_id, users)
+    except sqlite3.Error as e:
+        logger.error(f"Was not able to update metadata store, run import_metadata.py to rebuild it: {e}")
+
+
+def record_detected_users(backend_id, users: Set[str]):
+    """
+    Mirror users changed by others than FORC, only done by the reload leader, as the watchers of all worker processes
+    find them.
+    """
+    if reload_coordinator.leader.is_leader:
+        record_users(backend_id, users)
+
+
+def _record_detected_backends(added: List[BackendOut], removed: List[BackendOut]):
+    if metadata_store is None or not reload_coordinator.leader.is_leader:
+        return
+    record_backend_changes(
+        [(backend, os.path.basename(backend.file_path), backend_registry.upstream_of(backend.id)) for backend in added],
+        [backend.id for backend in removed]
+    )
+
+
+backend_registry.add_listener(_record_detected_backends)
@@ -1,17 +1,267 @@
 """
-Service to reload openresty by starting a process.
+Service to validate and reload openresty by starting a process.
+Reload requests are debounced, so a burst of backend changes results in a single reload. With several worker
+processes, only an elected leader process reloads, on behalf of all workers.
 """
-import os
+import asyncio
+import json
 import logging
+import os
+import shlex
+import time
+from collections import OrderedDict
+from typing import Optional, Set, Tuple
 
+from ..model.serializers import ReloadStats
+from ..service.transaction import write_atomic
+from ..util.executor import run_blocking
+from ..util.locking import LeaderLock, SharedCounter
+from ..util.metrics import openresty_reload_requests, openresty_reloads, openresty_validations
+from ..config import get_settings
 
 logger = logging.getLogger("service")
+settings = get_settings()
+
+
+class ReloadScheduler:
+    """
+    Collects reload requests within a window and runs at most one reload per window.
+    All requests of a window wait for and share the result of the same reload.
+    """
+
+    def __init__(self, command: str, window: float):
+        self.command = command
+        self.window = window
+        self._pending: Optional[asyncio.Future] = None
+        self._running: Optional[asyncio.Lock] = None
+        # Tasks of scheduled reloads, referenced until they are done so they are not garbage collected
+        self._tasks: Set[asyncio.Task] = set()
+        self.requests = 0
+        self.reloads = 0
+        self.failures = 0
+        self.last_latency: Optional[float] = None
+        self.total_latency = 0.0
+
+    async def request(self) -> bool:
+        """
+        Request a reload.
+        :return: True if the reload covering this request succeeded.
+        """
+        self.requests += 1
+        openresty_reload_requests.inc()
+        if self._pending is None or self._pending.done():
+            loop = asyncio.get_running_loop()
+            self._pending = loop.create_future()
+            task = loop.create_task(self._run(self._pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return await asyncio.shield(self._pending)
+
+    async def _run(self, future: asyncio.Future):
+        try:
+            await asyncio.sleep(self.window)
+            # Requests arriving from now on are collected for the next window.
+            if self._pending is future:
+                self._pending = None
+            if self._running is None:
+                self._running = asyncio.Lock()
+            async with self._running:
+                result = await self._reload()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception:
+            # Every request of the window waits for this future, so it has to be resolved in any case.
+            logger.exception("Was not able to reload OpenResty.")
+            self.failures += 1
+            result = False
+        if not future.done():
+            future.set_result(result)
+
+    async def _reload(self) -> bool:
+        logger.info("Reloading openresty config after backend change.")
+        started = time.perf_counter()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *shlex.split(self.command),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await process.communicate()
+            success = process.returncode == 0
+            if not success:
+                logger.error(f"Was not able to reload OpenResty (exit code {process.returncode}): "
+                             f"{stderr.decode(errors='replace').strip()}")
+        except OSError as e:
+            logger.exception(f"Was not able to reload OpenResty: {e}")
+            success = False
+        latency = time.perf_counter() - started
+        openresty_reloads.observe(latency, "success" if success else "failure")
+        self.reloads += 1
+        self.last_latency = latency
+        self.total_latency += latency
+        if success:
+            logger.info(f"Reload successful after {latency:.3f}s.")
+        else:
+            self.failures += 1
+        return success
+
+    def stats(self) -> ReloadStats:
+        return ReloadStats(
+            requests=self.requests,
+            reloads=self.reloads,
+            failures=self.failures,
+            last_latency=self.last_latency,
+            average_latency=self.total_latency / self.reloads if self.reloads else None
+        )
+
+
+class ConfigValidator:
+    """
+    Runs the OpenResty config test and caches its result by the content hash of the backend set.
+    """
+
+    def __init__(self, command: str, cache_size: int = 128):
+        self.command = command
+        self.cache_size = cache_size
+        self._results: "OrderedDict[str, Tuple[bool, str]]" = OrderedDict()
+
+    async def validate(self, content_hash: str) -> Tuple[bool, str]:
+        """
+        Validate the current OpenResty config.
+        :param content_hash: Hash of the backend set the config consists of.
+        :return: Whether the config is valid and the output of the config test.
+        """
+        if content_hash in self._results:
+            self._results.move_to_end(content_hash)
+            openresty_validations.inc("cached")
+            return self._results[content_hash]
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *shlex.split(self.command),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT
+            )
+            output, _ = await process.communicate()
+            result = (process.returncode == 0, output.decode(errors='replace').strip())
+        except (OSError, ValueError) as e:
+            logger.exception(f"Was not able to test OpenResty config: {e}")
+            # Do not cache, the next attempt may be able to run the test.
+            openresty_validations.inc("error")
+            return False, str(e)
+        openresty_validations.inc("valid" if result[0] else "invalid")
+        self._results[content_hash] = result
+        if len(self._results) > self.cache_size:
+            self._results.popitem(last=False)
+        return result
+
+
+class ReloadCoordinator:
+    """
+    Runs the reloads of all worker processes in a single leader process, so workers never reload concurrently.
+    Workers count their reload requests in a shared counter and wait until the leader recorded a reload covering
+    their request. The leader is elected by a file lock, which passes to another worker if the leader dies.
+    """
+
+    def __init__(self, scheduler: ReloadScheduler, state_path: str, timeout: float = 60.0,
+                 poll_interval: float = 0.05, election_interval: float = 1.0):
+        """
+        :param scheduler: Scheduler running the debounced reloads of the leader.
+        :param state_path: Directory of the shared counter, result and leader lock files.
+        :param timeout: Seconds a worker waits for the leader to reload.
+        :param poll_interval: Seconds between checks for new requests and results.
+        :param election_interval: Seconds between attempts of a worker to become leader.
+        """
+        self.scheduler = scheduler
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.election_interval = election_interval
+        self.requested = SharedCounter(os.path.join(state_path, "reload", "requested"))
+        self.completed_file = os.path.join(state_path, "reload", "completed.json")
+        self.leader = LeaderLock(os.path.join(state_path, "reload", "leader.lock"))
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """
+        Try to become leader and serve reload requests in the background.
+        """
+        self.leader.try_acquire()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.leader.resign()
+
+    async def request(self) -> bool:
+        """
+        Request a reload from the leader.
+        :return: True if the reload covering this request succeeded.
+        """
+        if self._task is None:
+            # Not started, e.g. outside of the application lifespan, reload in this process.
+            return await self.scheduler.request()
+        sequence = await run_blocking(self.requested.increment)
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            completed = await run_blocking(self._read_completed)
+            if completed["sequence"] >= sequence:
+                return completed["success"]
+            await asyncio.sleep(self.poll_interval)
+        logger.error(f"No OpenResty reload within {self.timeout}s, the reload leader may be stuck.")
+        return False
+
+    async def _run(self):
+        covered = (await run_blocking(self._read_completed))["sequence"]
+        next_election = time.monotonic() + self.election_interval
+        while True:
+            try:
+                if not self.leader.is_leader and time.monotonic() >= next_election:
+                    next_election = time.monotonic() + self.election_interval
+                    if await run_blocking(self.leader.try_acquire):
+                        # Requests of the previous leader are not covered yet, if it died while reloading.
+                        covered = (await run_blocking(self._read_completed))["sequence"]
+                if self.leader.is_leader:
+                    requested = await run_blocking(self.requested.value)
+                    if requested > covered:
+                        # Requests counted until now are covered, as the reload starts after them.
+                        success = await self.scheduler.request()
+                        await run_blocking(self._write_completed, requested, success)
+                        covered = requested
+            except OSError as e:
+                logger.error(f"Was not able to coordinate OpenResty reloads: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def _read_completed(self) -> dict:
+        try:
+            with open(self.completed_file, 'r') as completed_file:
+                completed = json.load(completed_file)
+            return {"sequence": int(completed["sequence"]), "success": bool(completed["success"])}
+        except (OSError, ValueError, KeyError, TypeError):
+            return {"sequence": 0, "success": False}
+
+    def _write_completed(self, sequence: int, success: bool):
+        write_atomic(self.completed_file, json.dumps({"sequence": sequence, "success": success}))
+
+    def stats(self) -> ReloadStats:
+        stats = self.scheduler.stats()
+        stats.leader = self.leader.is_leader
+        return stats
+
+
+reload_scheduler = ReloadScheduler(settings.FORC_RELOAD_COMMAND, settings.FORC_RELOAD_WINDOW)
+reload_coordinator = ReloadCoordinator(reload_scheduler, settings.FORC_STATE_PATH)
+config_validator = ConfigValidator(settings.FORC_VALIDATE_COMMAND)
+
+
+async def reload_openresty() -> bool:
+    return await reload_coordinator.request()
 
 
-async def reload_openresty():
-    logger.info("Reloading openresty config after backend change.")
-    try:
-        os.popen("sudo openresty -s reload")
-        logger.info("Reload succesful.")
-    except OSError as e:
-        logger.exception(f"Was not able to reload OpenResty: {e}")
+async def validate_openresty_config(content_hash: str) -> Tuple[bool, str]:
+    return await config_validator.validate(content_hash)
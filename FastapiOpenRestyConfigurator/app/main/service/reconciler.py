@@ -0,0 +1,357 @@
+"""
+Service to collect orphaned and malformed state in the backend and user path.
+Crashes and manual edits leave user directories without a backend, files which do not match the backend naming
+scheme, staged files of interrupted transactions and several backends with the same upstream url behind. Every entry
+of the backend and user path is checked once per sweep. A sweep is split into batches, and a run stops checking
+batches when its time budget is spent, so the next run continues the sweep where it stopped.
+Entries modified within the grace period are skipped, so changes in progress are not collected.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import stat
+import time
+from typing import Dict, List, Optional
+
+from werkzeug.exceptions import HTTPException
+
+from ..model.serializers import BackendOut, GcFinding, GcReport
+from ..service import backend as backend_service
+from ..service.openresty import reload_coordinator, reload_openresty
+from ..service.registry import backend_lock, backend_registry, file_regex
+from ..service.routing import apply_backend_changes, dynamic_routing
+from ..service.transaction import journal_path
+from ..service import user as user_service
+from ..service.user import user_acl
+from ..util.executor import run_blocking
+from ..util.metrics import metrics
+from ..config import get_settings
+
+logger = logging.getLogger("service")
+settings = get_settings()
+
+MODE_DRY_RUN = "dry-run"
+MODE_QUARANTINE = "quarantine"
+MODE_REMOVE = "remove"
+
+SCOPE_BACKENDS = "backends"
+SCOPE_USERS = "users"
+
+KIND_ORPHANED_USER_DIR = "orphaned_user_dir"
+KIND_MALFORMED_FILE = "malformed_file"
+KIND_STALE_TEMP_FILE = "stale_temp_file"
+KIND_DUPLICATE_UPSTREAM = "duplicate_upstream"
+
+ACTION_NONE = "none"
+ACTION_QUARANTINED = "quarantined"
+ACTION_REMOVED = "removed"
+ACTION_SKIPPED = "skipped"
+ACTION_FAILED = "failed"
+
+# Staged and backup files of transactions, see transaction.temp_file_name and transaction.backup_file_name
+temp_file_regex = r"\..+\.([0-9a-f]{32})\.(tmp|bak)"
+
+
+class Reconciler:
+    """
+    Finds garbage in batches and reports it, moves it to the quarantine path or removes it.
+    """
+
+    def __init__(self, backend_path: str, user_path: str, state_path: str, quarantine_path: str, mode: str,
+                 interval: float, batch_size: int, time_budget: float, grace_period: float):
+        """
+        :param backend_path: Directory of the backend files.
+        :param user_path: Directory of the user directories of all backends.
+        :param state_path: Directory of the report shared with the other worker processes.
+        :param quarantine_path: Directory garbage is moved to in quarantine mode.
+        :param mode: dry-run, quarantine or remove.
+        :param interval: Seconds between two runs in the background, 0 disables them.
+        :param batch_size: Number of entries checked at once.
+        :param time_budget: Seconds a run may spend checking batches.
+        :param grace_period: Seconds since the last modification before an entry is collected.
+        """
+        self.paths = {SCOPE_BACKENDS: str(backend_path), SCOPE_USERS: str(user_path)}
+        self.report_file = os.path.join(state_path, "gc.json")
+        self.quarantine_path = quarantine_path
+        self.mode = mode
+        self.interval = interval
+        self.batch_size = batch_size
+        self.time_budget = time_budget
+        self.grace_period = grace_period
+        # Entries of the current sweep which were not checked yet, in reverse order
+        self._pending: Dict[str, List[str]] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """
+        Run in the background, only in the reload leader.
+        """
+        if self.interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if not reload_coordinator.leader.is_leader:
+                continue
+            try:
+                await self.run()
+            except Exception:
+                logger.exception("Was not able to collect garbage.")
+
+    async def run(self, dry_run: Optional[bool] = None) -> GcReport:
+        """
+        Check batches of the current sweep until the time budget is spent and act on the findings.
+        :param dry_run: Only report findings even if the configured mode acts on them. A configured dry-run is never
+            overridden, destructive modes only come from the configuration.
+        :return: Report of this run, also saved for the other worker processes.
+        """
+        dry_run = bool(dry_run) or self.mode == MODE_DRY_RUN
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            started = time.time()
+            deadline = time.monotonic() + self.time_budget
+            for scope in self.paths:
+                if not self._pending.get(scope):
+                    self._pending[scope] = await run_blocking(self._list, scope)
+            scanned = 0
+            findings: List[GcFinding] = []
+            # Every scope is swept at most once per run, alternating between the scopes batch by batch. At least
+            # one batch is checked, so a sweep progresses with any budget.
+            scopes = [scope for scope in self.paths if self._pending[scope]]
+            while scopes:
+                for scope in list(scopes):
+                    checked, found = await run_blocking(self._check_batch, scope)
+                    scanned += checked
+                    findings.extend(found)
+                    if not self._pending[scope]:
+                        scopes.remove(scope)
+                if time.monotonic() >= deadline:
+                    break
+            findings.extend(self._find_duplicates())
+            if not dry_run:
+                await self._apply(findings)
+            for finding in findings:
+                gc_findings.inc(finding.kind, finding.action)
+            report = GcReport(
+                mode=self.mode,
+                dry_run=dry_run,
+                started=started,
+                duration=time.time() - started,
+                scanned=scanned,
+                pending=sum(len(pending) for pending in self._pending.values()),
+                findings=findings
+            )
+        if findings:
+            logger.info(f"Garbage collection found {len(findings)} entries in {scanned} checked entries"
+                        f"{' (dry-run)' if dry_run else ''}.")
+        await run_blocking(self._save_report, report)
+        return report
+
+    def _list(self, scope: str) -> List[str]:
+        try:
+            return sorted(os.listdir(self.paths[scope]), reverse=True)
+        except OSError as e:
+            logger.warning(f"Was not able to list {self.paths[scope]}: {e}")
+            return []
+
+    def _check_batch(self, scope: str):
+        pending = self._pending[scope]
+        batch = [pending.pop() for _ in range(min(self.batch_size, len(pending)))]
+        return len(batch), [finding for finding in map(lambda name: self._check(scope, name), batch) if finding]
+
+    def _check(self, scope: str, name: str) -> Optional[GcFinding]:
+        """
+        :return: Finding if the entry is garbage, otherwise None.
+        """
+        try:
+            entry_stat = os.lstat(os.path.join(self.paths[scope], name))
+        except OSError:
+            return None
+        if time.time() - entry_stat.st_mtime < self.grace_period:
+            return None
+        is_dir = stat.S_ISDIR(entry_stat.st_mode)
+        if scope == SCOPE_BACKENDS:
+            if name.startswith("."):
+                match = re.fullmatch(temp_file_regex, name)
+                # Files of transactions with a journal entry are completed or rolled back on the next startup.
+                if is_dir or not match or os.path.exists(os.path.join(journal_path(), f"{match.group(1)}.json")):
+                    return None
+                return self._finding(KIND_STALE_TEMP_FILE, scope, name)
+            if is_dir or re.fullmatch(file_regex, name):
+                return None
+            return self._finding(KIND_MALFORMED_FILE, scope, name)
+        if not is_dir:
+            return None if name.startswith(".") else self._finding(KIND_MALFORMED_FILE, scope, name)
+        if name.isdigit() and backend_registry.get(int(name)) is not None:
+            return None
+        return self._finding(KIND_ORPHANED_USER_DIR, scope, name)
+
+    def _find_duplicates(self) -> List[GcFinding]:
+        """
+        Backends sharing an upstream url with a newer backend.
+        """
+        findings = []
+        for backends in backend_registry.upstream_urls().values():
+            newest = self._newest(backends).id
+            for backend in backends:
+                if backend.id != newest:
+                    findings.append(self._finding(
+                        KIND_DUPLICATE_UPSTREAM, SCOPE_BACKENDS, os.path.basename(backend.file_path), backend.id
+                    ))
+        return findings
+
+    @staticmethod
+    def _newest(backends: List[BackendOut]) -> BackendOut:
+        """
+        Backend whose file was written last. Ids of backends created before ids were allocated in ascending order
+        are random, so they do not tell which backend is newer.
+        """
+        return max(backends, key=lambda backend: (backend_registry.mtime_of(backend.id) or 0, backend.id))
+
+    @staticmethod
+    def _finding(kind: str, scope: str, name: str, backend_id: Optional[int] = None) -> GcFinding:
+        return GcFinding(kind=kind, scope=scope, name=name, backend_id=backend_id, action=ACTION_NONE)
+
+    async def _apply(self, findings: List[GcFinding]):
+        """
+        Quarantine or remove the findings. Every finding is checked again while holding the backend lock, as
+        backends might have been created or deleted by another worker process since it was found.
+        """
+        included_file_moved = False
+        async with backend_lock.hold():
+            for finding in findings:
+                if finding.kind != KIND_DUPLICATE_UPSTREAM:
+                    await run_blocking(self._apply_entry, finding)
+                    if finding.action in (ACTION_QUARANTINED, ACTION_REMOVED):
+                        included_file_moved |= finding.scope == SCOPE_BACKENDS and finding.name.endswith(".conf")
+                        if finding.kind == KIND_ORPHANED_USER_DIR:
+                            user_acl.remove(finding.name)
+        removed_backends = []
+        for finding in findings:
+            if finding.kind == KIND_DUPLICATE_UPSTREAM:
+                backend = await self._apply_duplicate(finding)
+                if backend is not None:
+                    removed_backends.append(backend)
+        if removed_backends:
+            await apply_backend_changes(removed=removed_backends)
+        elif included_file_moved and not dynamic_routing():
+            # OpenResty includes every .conf file of the backend path, not only valid backend files.
+            await reload_openresty()
+
+    def _apply_entry(self, finding: GcFinding):
+        if self._check(finding.scope, finding.name) is None:
+            finding.action = ACTION_SKIPPED
+            finding.error = "Not garbage anymore."
+            return
+        path = os.path.join(self.paths[finding.scope], finding.name)
+        try:
+            if self.mode == MODE_REMOVE:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                finding.action = ACTION_REMOVED
+            else:
+                self._quarantine(finding.scope, path)
+                finding.action = ACTION_QUARANTINED
+        except OSError as e:
+            logger.warning(f"Was not able to collect {path}: {e}")
+            finding.action = ACTION_FAILED
+            finding.error = str(e)
+
+    async def _apply_duplicate(self, finding: GcFinding):
+        backend = backend_registry.get(finding.backend_id)
+        upstream_url = backend_registry.upstream_of(finding.backend_id) if backend is not None else None
+        if upstream_url is None or self._newest(backend_registry.by_upstream(upstream_url)).id == backend.id:
+            finding.action = ACTION_SKIPPED
+            finding.error = "Not a duplicate anymore."
+            return None
+        try:
+            if self.mode != MODE_REMOVE:
+                await run_blocking(self._quarantine, finding.scope, backend.file_path, True)
+            removed = await backend_service.delete_backend(backend.id, reload=False)
+            await user_service.delete_all(backend.id)
+        except OSError as e:
+            finding.action = ACTION_FAILED
+            finding.error = str(e)
+            return None
+        except HTTPException as e:
+            finding.action = ACTION_FAILED
+            finding.error = e.description
+            return None
+        finding.action = ACTION_REMOVED if self.mode == MODE_REMOVE else ACTION_QUARANTINED
+        logger.info(f"Collected backend {backend.id} with the same upstream url as a newer backend.")
+        return removed
+
+    def _quarantine(self, scope: str, path: str, copy: bool = False):
+        """
+        Move an entry to the quarantine path, a timestamp keeps entries of the same name apart.
+        :param copy: Copy a file instead, if it is removed by other means.
+        """
+        target_path = os.path.join(self.quarantine_path, scope)
+        os.makedirs(target_path, exist_ok=True)
+        target = os.path.join(target_path, f"{os.path.basename(path)}.{int(time.time())}")
+        if copy:
+            shutil.copy2(path, target)
+        else:
+            shutil.move(path, target)
+
+    def _save_report(self, report: GcReport):
+        try:
+            os.makedirs(os.path.dirname(self.report_file), exist_ok=True)
+            temp_file = f"{self.report_file}.{os.getpid()}.tmp"
+            with open(temp_file, 'w') as report_file:
+                report_file.write(report.model_dump_json())
+            os.replace(temp_file, self.report_file)
+        except OSError as e:
+            logger.warning(f"Was not able to save garbage collection report {self.report_file}: {e}")
+
+    def last_report(self) -> Optional[GcReport]:
+        """
+        :return: Report of the last run of any worker process, None if there was none.
+        """
+        try:
+            with open(self.report_file, 'r') as report_file:
+                return GcReport(**json.load(report_file))
+        except (OSError, ValueError):
+            return None
+
+
+reconciler = Reconciler(
+    settings.FORC_BACKEND_PATH,
+    settings.FORC_USER_PATH,
+    settings.FORC_STATE_PATH,
+    settings.FORC_GC_QUARANTINE_PATH,
+    mode=settings.FORC_GC_MODE,
+    interval=settings.FORC_GC_INTERVAL,
+    batch_size=settings.FORC_GC_BATCH_SIZE,
+    time_budget=settings.FORC_GC_TIME_BUDGET,
+    grace_period=settings.FORC_GC_GRACE_PERIOD
+)
+
+gc_findings = metrics.counter(
+    "forc_gc_findings_total", "Number of garbage entries found by kind and action.", ("kind", "action")
+)
+
+
+async def collect_garbage(dry_run: Optional[bool] = None) -> GcReport:
+    return await reconciler.run(dry_run)
+
+
+async def get_gc_report() -> Optional[GcReport]:
+    return await run_blocking(reconciler.last_report)
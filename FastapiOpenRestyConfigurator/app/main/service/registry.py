@@ -0,0 +1,569 @@
+"""
+Process-wide registry of backends.
+Built once from the backend path and kept in sync by a directory watcher, so lookups do not rescan the directory.
+"""
+import bisect
+import hashlib
+import heapq
+import json
+import logging
+import os
+import re
+import threading
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from ..model.serializers import BackendOut
+from ..util.executor import run_blocking
+from ..util.locking import FileLock, SharedCounter
+from ..util.metrics import directory_scans, metrics
+from ..util.watcher import DirectoryWatcher
+from ..config import get_settings
+
+logger = logging.getLogger("service")
+settings = get_settings()
+
+file_regex = r"(\d*)%([a-z0-9\-\@.]*?)%([^%]*)%([^%]*)%([^%]*)\.conf"
+
+# Lowest location url suffix handed out for a user key url
+FIRST_SUFFIX = 100
+
+
+def parse_backend_file(file_name: str) -> Optional[BackendOut]:
+    """
+    Parse a backend file name into a backend.
+    :param file_name: Name of the backend file.
+    :return: BackendOut or None if the file name does not match the backend naming scheme.
+    """
+    match = re.fullmatch(file_regex, file_name)
+    if not match:
+        return None
+    return BackendOut(
+        id=match.group(1),
+        owner=match.group(2),
+        location_url=match.group(3),
+        template=match.group(4),
+        template_version=match.group(5),
+        file_path=os.path.join(settings.FORC_BACKEND_PATH, file_name)
+    )
+
+
+def extract_proxy_pass(content: str) -> Optional[str]:
+    """
+    Get the upstream url from the proxy_pass directive of a backend config.
+    """
+    match = re.search(r'proxy_pass\s+(http[^\s;]+);', content)
+
+    if match:
+        return match.group(1)
+    else:
+        return None
+
+
+def content_digest(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def location_prefix(location_url: str) -> str:
+    """
+    Get the user key url prefix of a location url, e.g. myRstudio_101 -> myRstudio.
+    """
+    return location_url.rsplit("_", 1)[0]
+
+
+def location_suffix(location_url: str) -> Optional[int]:
+    """
+    Get the suffix of a location url, e.g. myRstudio_101 -> 101, None if it has no numeric suffix.
+    """
+    suffix = location_url.rsplit("_", 1)[-1]
+    return int(suffix) if "_" in location_url and suffix.isdigit() else None
+
+
+class LocationSuffixes:
+    """
+    Location url suffixes used by the backends of a user key url.
+    Unused suffixes below a watermark are kept in a free list, so the lowest free suffix is found without scanning
+    the used suffixes. Entries of the free list which got used in the meantime are dropped when they are met.
+    """
+
+    def __init__(self, first: int = FIRST_SUFFIX):
+        self.first = first
+        # suffix -> number of backends using it, backends created outside of FORC may share a suffix
+        self.used: Dict[int, int] = {}
+        # Every unused suffix from first to below the watermark is in the free list
+        self._watermark = first
+        self._free: List[int] = []
+
+    def add(self, suffix: int):
+        self.used[suffix] = self.used.get(suffix, 0) + 1
+
+    def remove(self, suffix: int):
+        count = self.used.pop(suffix, 0) - 1
+        if count > 0:
+            self.used[suffix] = count
+        elif self.first <= suffix < self._watermark:
+            heapq.heappush(self._free, suffix)
+
+    def lowest_free(self, reserved: Set[int]) -> int:
+        """
+        :param reserved: Suffixes reserved by creates in progress, they are skipped but stay in the free list.
+        :return: Lowest suffix which is neither used nor reserved.
+        """
+        kept = set()
+        suffix = None
+        while self._free:
+            candidate = heapq.heappop(self._free)
+            if candidate in self.used:
+                continue
+            kept.add(candidate)
+            if candidate not in reserved:
+                suffix = candidate
+                break
+        if suffix is None:
+            suffix = self._watermark
+            while suffix in self.used or suffix in reserved:
+                if suffix not in self.used:
+                    kept.add(suffix)
+                suffix += 1
+            # Stays in the free list until its backend is written, its create may still fail
+            kept.add(suffix)
+            self._watermark = suffix + 1
+        for candidate in kept:
+            heapq.heappush(self._free, candidate)
+        return suffix
+
+    def __len__(self):
+        return len(self.used)
+
+
+class BackendRegistry:
+    """
+    Holds all valid backends with secondary indexes by owner, template, location url prefix and upstream url.
+    Upstream url and content digest are read from the backend files once and cached together with the file mtime
+    in a state file, so a restart only reads files which changed in the meantime.
+    """
+
+    def __init__(self, backend_path, state_path=None):
+        self.backend_path = str(backend_path)
+        self.file_cache_file = os.path.join(state_path, "backend_files.json") if state_path else None
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._watcher: Optional[DirectoryWatcher] = None
+        self._by_id: Dict[int, BackendOut] = {}
+        self._id_by_file: Dict[str, int] = {}
+        self._by_owner: Dict[str, Dict[int, BackendOut]] = {}
+        self._by_template: Dict[str, Dict[int, BackendOut]] = {}
+        self._by_template_version: Dict[Tuple[str, str], Dict[int, BackendOut]] = {}
+        self._by_location_prefix: Dict[str, Dict[int, BackendOut]] = {}
+        self._suffixes: Dict[str, LocationSuffixes] = {}
+        self._by_upstream: Dict[str, Dict[int, BackendOut]] = {}
+        # file name -> (mtime_ns, upstream url, content digest)
+        self._file_meta: Dict[str, Tuple[int, Optional[str], str]] = {}
+        # XOR of the hashes of all (file name, content digest) pairs, identifies the current backend set
+        self._content_hash = 0
+        # All ids in ascending order for cursor based pages, built lazily after a rebuild
+        self._sorted_ids: Optional[List[int]] = None
+        self._listeners: List[Callable[[List[BackendOut], List[BackendOut]], None]] = []
+
+    def add_listener(self, listener: Callable[[List[BackendOut], List[BackendOut]], None]):
+        """
+        Register a callback for backends added or removed by others than this process, found by the watcher or a
+        sync. It is called with the added and the removed backends.
+        """
+        self._listeners.append(listener)
+
+    def start(self):
+        """
+        Load the registry and start watching the backend path.
+        """
+        with self._lock:
+            # Loaded before, e.g. in the parent process of a forked worker, only changes since then are applied.
+            preloaded = self._loaded and self._watcher is None
+            if not self._loaded:
+                self.rebuild()
+            if self._watcher is None:
+                self._watcher = DirectoryWatcher(
+                    self.backend_path,
+                    self.refresh,
+                    poll_interval=settings.FORC_WATCH_POLL_INTERVAL,
+                    use_inotify=settings.FORC_WATCH_USE_INOTIFY
+                )
+        self._watcher.start()
+        if preloaded:
+            self.sync()
+
+    def stop(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+        self.save_file_cache()
+
+    def ensure_loaded(self):
+        if not self._loaded or self._watcher is None:
+            self.start()
+
+    def rebuild(self):
+        """
+        Rebuild all indexes by scanning the backend path once.
+        """
+        with directory_scans.time("backends"):
+            if not os.path.exists(self.backend_path) or not os.access(self.backend_path, os.R_OK):
+                logger.error("Not able to access configured backend path.")
+                file_names = []
+            else:
+                file_names = os.listdir(self.backend_path)
+            with self._lock:
+                before = dict(self._by_id) if self._loaded else None
+                cached_file_meta = self._file_meta or self._load_file_cache()
+                self._clear()
+                for file_name in file_names:
+                    self._add_file(file_name, cached_meta=cached_file_meta.get(file_name))
+                self._loaded = True
+                after = dict(self._by_id)
+        logger.info(f"Loaded {len(self._by_id)} backends from {self.backend_path}.")
+        self.save_file_cache()
+        if before is not None:
+            self._notify(before, after)
+
+    def refresh(self, file_names: Optional[Set[str]] = None):
+        """
+        Apply changes of the backend path to the registry.
+        :param file_names: Names of changed files or None to rescan the whole directory.
+        """
+        if file_names is None:
+            self.rebuild()
+            return
+        with self._lock:
+            before = self._backends_of(file_names)
+            for file_name in file_names:
+                if not os.path.isfile(os.path.join(self.backend_path, file_name)):
+                    self._remove_file(file_name)
+                elif file_name in self._id_by_file:
+                    # Content of a known backend changed, re-read it if the mtime differs.
+                    cached_meta = self._file_meta.get(file_name)
+                    self._remove_file(file_name)
+                    self._add_file(file_name, cached_meta=cached_meta)
+                else:
+                    self._add_file(file_name)
+            after = self._backends_of(file_names)
+        self._notify(before, after)
+
+    def _backends_of(self, file_names: Set[str]) -> Dict[int, BackendOut]:
+        return {
+            self._id_by_file[file_name]: self._by_id[self._id_by_file[file_name]]
+            for file_name in file_names if file_name in self._id_by_file
+        }
+
+    def _notify(self, before: Dict[int, BackendOut], after: Dict[int, BackendOut]):
+        added = [backend for backend_id, backend in after.items() if backend_id not in before]
+        removed = [backend for backend_id, backend in before.items() if backend_id not in after]
+        if not added and not removed:
+            return
+        for listener in self._listeners:
+            try:
+                listener(added, removed)
+            except Exception:
+                logger.exception("Backend change listener failed.")
+
+    def sync(self):
+        """
+        Apply changes of the backend path which the watcher did not deliver yet, e.g. right after another worker
+        process changed backends. Only lists the directory, files are read only if they were added.
+        """
+        try:
+            file_names = {
+                file_name for file_name in os.listdir(self.backend_path) if re.fullmatch(file_regex, file_name)
+            }
+        except OSError as e:
+            logger.warning(f"Was not able to list backend path: {e}")
+            return
+        self.ensure_loaded()
+        with self._lock:
+            changed = file_names.symmetric_difference(self._id_by_file)
+        if changed:
+            self.refresh(changed)
+
+    def add_file(self, file_name: str, content: str = None) -> Optional[BackendOut]:
+        """
+        Add a backend file to the registry.
+        :param file_name: Name of the backend file.
+        :param content: Content of the backend file if known, otherwise it is read from the file.
+        """
+        with self._lock:
+            if content is not None:
+                self._remove_file(file_name)
+            return self._add_file(file_name, content=content)
+
+    def remove(self, backend_id: int) -> Optional[BackendOut]:
+        with self._lock:
+            backend = self._by_id.get(int(backend_id))
+            if backend is not None:
+                self._remove_file(os.path.basename(backend.file_path))
+            return backend
+
+    def all(self) -> List[BackendOut]:
+        self.ensure_loaded()
+        with self._lock:
+            return list(self._by_id.values())
+
+    def get(self, backend_id: int) -> Optional[BackendOut]:
+        self.ensure_loaded()
+        return self._by_id.get(int(backend_id))
+
+    def max_id(self) -> Optional[int]:
+        """
+        Highest id of all backends, None if there are no backends.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            return max(self._by_id) if self._by_id else None
+
+    def page(self, after: Optional[int] = None, limit: Optional[int] = None) -> List[BackendOut]:
+        """
+        Get backends ordered by id.
+        :param after: Only return backends with a higher id.
+        :param limit: Maximum number of backends to return.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            if self._sorted_ids is None:
+                self._sorted_ids = sorted(self._by_id)
+            start = bisect.bisect_right(self._sorted_ids, after) if after is not None else 0
+            end = start + limit if limit is not None else len(self._sorted_ids)
+            return [self._by_id[backend_id] for backend_id in self._sorted_ids[start:end]]
+
+    def by_owner(self, owner: str) -> List[BackendOut]:
+        self.ensure_loaded()
+        with self._lock:
+            return list(self._by_owner.get(owner, {}).values())
+
+    def by_template(self, template: str) -> List[BackendOut]:
+        self.ensure_loaded()
+        with self._lock:
+            return list(self._by_template.get(template, {}).values())
+
+    def by_template_version(self, template: str, template_version: str) -> List[BackendOut]:
+        self.ensure_loaded()
+        with self._lock:
+            return list(self._by_template_version.get((template, template_version), {}).values())
+
+    def by_location_prefix(self, prefix: str) -> List[BackendOut]:
+        self.ensure_loaded()
+        with self._lock:
+            return list(self._by_location_prefix.get(prefix, {}).values())
+
+    def free_suffix(self, prefix: str, reserved: Set[int]) -> int:
+        """
+        Lowest location url suffix of a user key url from FIRST_SUFFIX on, which is neither used by a backend nor
+        reserved.
+        :param prefix: User key url.
+        :param reserved: Suffixes reserved by creates in progress.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            suffixes = self._suffixes.get(prefix)
+            if suffixes is None:
+                suffixes = LocationSuffixes()
+            return suffixes.lowest_free(reserved)
+
+    def by_upstream(self, upstream_url: str) -> List[BackendOut]:
+        self.ensure_loaded()
+        with self._lock:
+            return list(self._by_upstream.get(upstream_url, {}).values())
+
+    def upstream_urls(self) -> Dict[str, List[BackendOut]]:
+        self.ensure_loaded()
+        with self._lock:
+            return {upstream_url: list(backends.values()) for upstream_url, backends in self._by_upstream.items()}
+
+    def upstream_of(self, backend_id: int) -> Optional[str]:
+        self.ensure_loaded()
+        backend = self._by_id.get(int(backend_id))
+        if backend is None:
+            return None
+        return self._file_meta.get(os.path.basename(backend.file_path), (None, None, None))[1]
+
+    def mtime_of(self, backend_id: int) -> Optional[int]:
+        """
+        Modification time of the backend file in nanoseconds, as of the last time it was read.
+        """
+        self.ensure_loaded()
+        backend = self._by_id.get(int(backend_id))
+        if backend is None:
+            return None
+        return self._file_meta.get(os.path.basename(backend.file_path), (None, None, None))[0]
+
+    def content_hash(self) -> str:
+        """
+        Hash identifying the names and contents of all current backend files.
+        """
+        self.ensure_loaded()
+        return f"{self._content_hash:016x}"
+
+    def save_file_cache(self):
+        """
+        Persist upstream url and content digest of all backend files together with their mtime.
+        """
+        if self.file_cache_file is None:
+            return
+        with self._lock:
+            content = json.dumps(self._file_meta)
+        try:
+            os.makedirs(os.path.dirname(self.file_cache_file), exist_ok=True)
+            temp_file = f"{self.file_cache_file}.tmp"
+            with open(temp_file, 'w') as cache_file:
+                cache_file.write(content)
+            os.replace(temp_file, self.file_cache_file)
+        except OSError as e:
+            logger.warning(f"Was not able to save backend file cache {self.file_cache_file}: {e}")
+
+    def __len__(self):
+        self.ensure_loaded()
+        return len(self._by_id)
+
+    def _clear(self):
+        self._by_id.clear()
+        self._id_by_file.clear()
+        self._by_owner.clear()
+        self._by_template.clear()
+        self._by_template_version.clear()
+        self._by_location_prefix.clear()
+        self._suffixes.clear()
+        self._by_upstream.clear()
+        self._file_meta.clear()
+        self._content_hash = 0
+        self._sorted_ids = None
+
+    def _load_file_cache(self) -> Dict[str, Tuple[int, Optional[str], str]]:
+        if self.file_cache_file is None or not os.path.isfile(self.file_cache_file):
+            return {}
+        try:
+            with open(self.file_cache_file, 'r') as cache_file:
+                return {file_name: tuple(entry) for file_name, entry in json.load(cache_file).items()}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Was not able to load backend file cache {self.file_cache_file}: {e}")
+            return {}
+
+    def _read_file_meta(self, file_name: str, cached_meta=None, content: str = None) -> Optional[Tuple]:
+        file_path = os.path.join(self.backend_path, file_name)
+        try:
+            mtime = os.stat(file_path).st_mtime_ns
+            if content is None and cached_meta is not None and len(cached_meta) == 3 and cached_meta[0] == mtime:
+                meta = tuple(cached_meta)
+            else:
+                if content is None:
+                    with open(file_path, 'r') as file:
+                        content = file.read()
+                meta = (mtime, extract_proxy_pass(content), content_digest(content))
+        except OSError as e:
+            logger.warning(f"Was not able to read backend file {file_name}: {e}")
+            return None
+        self._file_meta[file_name] = meta
+        self._content_hash ^= self._file_hash(file_name, meta[2])
+        return meta
+
+    @staticmethod
+    def _file_hash(file_name: str, digest: str) -> int:
+        return int(hashlib.sha256(f"{file_name}:{digest}".encode()).hexdigest()[:16], 16)
+
+    def _add_file(self, file_name: str, cached_meta=None, content: str = None) -> Optional[BackendOut]:
+        if file_name in self._id_by_file:
+            return self._by_id[self._id_by_file[file_name]]
+        if file_name.startswith(".") or os.path.isdir(os.path.join(self.backend_path, file_name)):
+            return None
+        backend = parse_backend_file(file_name)
+        if backend is None:
+            logger.warning(f"Found a backend file with wrong naming, skipping it: {file_name}")
+            return None
+        if backend.id in self._by_id:
+            self._remove_file(os.path.basename(self._by_id[backend.id].file_path))
+        self._by_id[backend.id] = backend
+        self._id_by_file[file_name] = backend.id
+        if self._sorted_ids is not None:
+            bisect.insort(self._sorted_ids, backend.id)
+        self._by_owner.setdefault(backend.owner, {})[backend.id] = backend
+        self._by_template.setdefault(backend.template, {})[backend.id] = backend
+        self._by_template_version.setdefault((backend.template, backend.template_version), {})[backend.id] = backend
+        self._by_location_prefix.setdefault(location_prefix(backend.location_url), {})[backend.id] = backend
+        suffix = location_suffix(backend.location_url)
+        if suffix is not None:
+            self._suffixes.setdefault(location_prefix(backend.location_url), LocationSuffixes()).add(suffix)
+        meta = self._read_file_meta(file_name, cached_meta, content)
+        if meta is not None and meta[1]:
+            self._by_upstream.setdefault(meta[1], {})[backend.id] = backend
+        return backend
+
+    def _remove_file(self, file_name: str) -> Optional[BackendOut]:
+        backend_id = self._id_by_file.pop(file_name, None)
+        if backend_id is None:
+            return None
+        backend = self._by_id.pop(backend_id)
+        if self._sorted_ids is not None:
+            del self._sorted_ids[bisect.bisect_left(self._sorted_ids, backend_id)]
+        self._discard(self._by_owner, backend.owner, backend_id)
+        self._discard(self._by_template, backend.template, backend_id)
+        self._discard(self._by_template_version, (backend.template, backend.template_version), backend_id)
+        self._discard(self._by_location_prefix, location_prefix(backend.location_url), backend_id)
+        suffix = location_suffix(backend.location_url)
+        suffixes = self._suffixes.get(location_prefix(backend.location_url))
+        if suffix is not None and suffixes is not None:
+            suffixes.remove(suffix)
+            if not suffixes:
+                del self._suffixes[location_prefix(backend.location_url)]
+        meta = self._file_meta.pop(file_name, None)
+        if meta is not None:
+            self._content_hash ^= self._file_hash(file_name, meta[2])
+            if meta[1]:
+                self._discard(self._by_upstream, meta[1], backend_id)
+        return backend
+
+    @staticmethod
+    def _discard(index: Dict, key, backend_id: int):
+        bucket = index.get(key)
+        if bucket is None:
+            return
+        bucket.pop(backend_id, None)
+        if not bucket:
+            del index[key]
+
+
+class BackendLock:
+    """
+    Serializes backend changes of all worker processes.
+    Every holder counts its change in a shared counter. If another process changed backends since this process last
+    held the lock, the registry is synced before the holder continues, so duplicate checks and suffixes see the
+    backends of all processes, even before the directory watcher caught up.
+    """
+
+    def __init__(self, registry: BackendRegistry, state_path: str):
+        self.registry = registry
+        self._lock = FileLock(os.path.join(state_path, "backends.lock"))
+        self._changes = SharedCounter(os.path.join(state_path, "backends.changes"))
+        self._seen: Optional[int] = None
+
+    @asynccontextmanager
+    async def hold(self):
+        async with self._lock.hold():
+            if await run_blocking(self._changes.value) != self._seen:
+                await run_blocking(self.registry.sync)
+            try:
+                yield
+            finally:
+                self._seen = await run_blocking(self._changes.increment)
+
+    def __enter__(self):
+        # Blocking variant for startup, before the registry is loaded.
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self._seen = self._changes.increment()
+        finally:
+            self._lock.release()
+
+
+backend_registry = BackendRegistry(settings.FORC_BACKEND_PATH, settings.FORC_STATE_PATH)
+backend_lock = BackendLock(backend_registry, settings.FORC_STATE_PATH)
+
+metrics.gauge("forc_backends", "Number of backends in the registry.", lambda: len(backend_registry._by_id))
@@ -0,0 +1,211 @@
+"""
+Service to publish backends as routes to OpenResty.
+In the default "files" routing mode every backend is a location file and changes need a reload. In the "dynamic"
+routing mode routes are pushed to a lua_shared_dict through the admin endpoint of examples/scripts/forc_router.lua
+and a single generic location routes requests, so backend changes take effect without a reload.
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Iterable, List, Optional
+
+from ..model.serializers import BackendOut, RoutingStats
+from ..service.openresty import reload_coordinator, reload_openresty
+from ..service.registry import backend_registry
+from ..util.executor import run_blocking
+from ..util.metrics import route_pushes
+from ..config import get_settings
+
+logger = logging.getLogger("service")
+settings = get_settings()
+
+ROUTING_MODE_FILES = "files"
+ROUTING_MODE_DYNAMIC = "dynamic"
+
+
+class RouteConflict(Exception):
+    """
+    Raised if OpenResty does not hold the route generation an incremental update was based on.
+    """
+
+
+class RoutePublisher:
+    """
+    Pushes route changes to the OpenResty admin endpoint.
+    A full sync starts a new generation. Incremental updates are only accepted by OpenResty for the current
+    generation, so routes lost by an OpenResty restart are detected and synced again.
+    """
+
+    def __init__(self, admin_url: str, sync_interval: float, timeout: float = 5.0):
+        self.admin_url = admin_url
+        self.sync_interval = sync_interval
+        self.timeout = timeout
+        self.generation: Optional[str] = None
+        self._published_hash: Optional[str] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self.pushes = 0
+        self.failures = 0
+        self.syncs = 0
+        self.last_sync: Optional[float] = None
+
+    def start(self):
+        """
+        Sync all routes and keep them in sync in the background.
+        """
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.check()
+            except Exception:
+                logger.exception("Was not able to check OpenResty routes.")
+            await asyncio.sleep(self.sync_interval)
+
+    async def check(self):
+        """
+        Sync all routes if OpenResty holds another generation or backend files were changed outside of this process.
+        Only the reload leader checks, so worker processes do not replace the generations of each other.
+        """
+        if not reload_coordinator.leader.is_leader:
+            return
+        try:
+            state = await run_blocking(self._request, "GET", None)
+        except OSError as e:
+            logger.warning(f"Was not able to reach OpenResty route admin endpoint: {e}")
+            return
+        if state.get("generation") != self.generation or backend_registry.content_hash() != self._published_hash:
+            await self.sync()
+
+    async def sync(self) -> bool:
+        """
+        Replace all routes in OpenResty with the routes of the current backends.
+        :return: True if the routes were published.
+        """
+        async with self._get_lock():
+            generation = uuid.uuid4().hex
+            content_hash = backend_registry.content_hash()
+            body = {"generation": generation, "routes": [route_of(backend) for backend in backend_registry.all()]}
+            try:
+                await run_blocking(self._request, "PUT", body)
+            except OSError as e:
+                logger.error(f"Was not able to sync routes to OpenResty: {e}")
+                self.failures += 1
+                route_pushes.inc("failure")
+                return False
+            self.generation = generation
+            self._published_hash = content_hash
+            self.syncs += 1
+            self.last_sync = time.time()
+            route_pushes.inc("sync")
+            logger.info(f"Synced {len(body['routes'])} routes to OpenResty.")
+            return True
+
+    async def publish(self, changed: Iterable[BackendOut] = (), removed: Iterable[BackendOut] = ()) -> bool:
+        """
+        Push changed and removed backends to OpenResty.
+        A worker process which does not know the current generation yet, or whose generation was replaced by the
+        sync of another worker, adopts the generation held by OpenResty and pushes against it. Routes of the
+        generation were synced from the backend files by a FORC process, so they only differ by the pushes of
+        other workers.
+        :param changed: Backends to add or update.
+        :param removed: Backends to remove.
+        :return: True if the routes were published.
+        """
+        self.pushes += 1
+        body = {
+            "routes": [route_of(backend) for backend in changed],
+            "removed": [backend.location_url for backend in removed],
+        }
+        async with self._get_lock():
+            for attempt in range(2):
+                try:
+                    if self.generation is None or attempt > 0:
+                        self.generation = (await run_blocking(self._request, "GET", None)).get("generation")
+                        if self.generation is None:
+                            break
+                    await run_blocking(self._request, "POST", {"generation": self.generation, **body})
+                    self._published_hash = backend_registry.content_hash()
+                    route_pushes.inc("success")
+                    return True
+                except RouteConflict:
+                    logger.warning("OpenResty holds another route generation, pushing against it.")
+                except OSError as e:
+                    logger.error(f"Was not able to push routes to OpenResty: {e}")
+                    self.failures += 1
+                    route_pushes.inc("failure")
+                    return False
+        return await self.sync()
+
+    def _request(self, method: str, body: Optional[dict]) -> dict:
+        # Imported on first use, only dynamic routing talks to OpenResty over HTTP.
+        import urllib.error
+        import urllib.request
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(
+            self.admin_url, data=data, method=method, headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            if e.code == 409:
+                raise RouteConflict() from e
+            raise
+        except ValueError as e:
+            raise OSError(f"Invalid response from route admin endpoint: {e}") from e
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def stats(self) -> RoutingStats:
+        return RoutingStats(
+            mode=settings.FORC_ROUTING_MODE,
+            generation=self.generation,
+            pushes=self.pushes,
+            syncs=self.syncs,
+            failures=self.failures,
+            last_sync=self.last_sync
+        )
+
+
+def route_of(backend: BackendOut) -> dict:
+    return {
+        "key_url": backend.location_url,
+        "id": int(backend.id),
+        "owner": backend.owner,
+        "upstream": backend_registry.upstream_of(backend.id),
+    }
+
+
+def dynamic_routing() -> bool:
+    return settings.FORC_ROUTING_MODE == ROUTING_MODE_DYNAMIC
+
+
+route_publisher = RoutePublisher(settings.FORC_ROUTING_ADMIN_URL, settings.FORC_ROUTING_SYNC_INTERVAL)
+
+
+async def apply_backend_changes(changed: List[BackendOut] = (), removed: List[BackendOut] = ()) -> bool:
+    """
+    Make backend changes visible in OpenResty, by pushing routes or by reloading OpenResty.
+    :param changed: Backends which were added.
+    :param removed: Backends which were removed.
+    :return: True if the changes were applied.
+    """
+    if dynamic_routing():
+        return await route_publisher.publish(changed, removed)
+    return await reload_openresty()
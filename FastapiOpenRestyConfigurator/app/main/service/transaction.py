@@ -0,0 +1,224 @@
+"""
+Atomic changes of backend files.
+New files are staged as temporary files and moved in place with os.replace, deleted files are kept as backups until
+the change set is finished, so it can be rolled back. Every change set is recorded in a write-ahead journal before it
+is applied, so an interrupted change set is completed or rolled back on the next startup. Only change sets which
+passed the OpenResty config test are completed, all others are rolled back.
+"""
+import json
+import logging
+import os
+import uuid
+from typing import List, Tuple
+
+from ..config import get_settings
+
+logger = logging.getLogger("service")
+settings = get_settings()
+
+STATE_APPLY = "apply"
+STATE_VALIDATED = "validated"
+STATE_ROLLBACK = "rollback"
+
+
+def journal_path() -> str:
+    return os.path.join(settings.FORC_STATE_PATH, "journal")
+
+
+def temp_file_name(file_name: str, transaction_id: str) -> str:
+    # Leading dot and missing .conf suffix keep staged files out of nginx includes and the backend registry.
+    return f".{file_name}.{transaction_id}.tmp"
+
+
+def backup_file_name(file_name: str, transaction_id: str) -> str:
+    return f".{file_name}.{transaction_id}.bak"
+
+
+def fsync_directory(path: str):
+    try:
+        directory_fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(directory_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(directory_fd)
+
+
+def write_atomic(file_path: str, contents: str):
+    """
+    Write a file by writing a temporary file first and replacing the target with it.
+    """
+    directory, file_name = os.path.split(file_path)
+    temp_file_path = os.path.join(directory, temp_file_name(file_name, uuid.uuid4().hex))
+    with open(temp_file_path, 'w') as temp_file:
+        temp_file.write(contents)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    os.replace(temp_file_path, file_path)
+
+
+class BackendTransaction:
+    """
+    Set of backend files to delete and create, applied as one unit.
+    After commit() the change set is visible to OpenResty and has to be finished with validated() and finalize(),
+    or with rollback().
+    """
+
+    def __init__(self, backend_path=None):
+        self.backend_path = str(backend_path or settings.FORC_BACKEND_PATH)
+        self.transaction_id = uuid.uuid4().hex
+        self.deletes: List[str] = []
+        self.creates: List[Tuple[str, str]] = []
+
+    def delete(self, file_name: str):
+        if file_name not in self.deletes:
+            self.deletes.append(file_name)
+
+    def create(self, file_name: str, contents: str):
+        self.creates.append((file_name, contents))
+
+    @property
+    def journal_file(self) -> str:
+        return os.path.join(journal_path(), f"{self.transaction_id}.json")
+
+    def commit(self):
+        """
+        Stage all new files, record the change set in the journal and apply it.
+        Blocking, run it in the io executor.
+        """
+        staged = []
+        try:
+            for file_name, contents in self.creates:
+                temp_file_path = os.path.join(self.backend_path, temp_file_name(file_name, self.transaction_id))
+                with open(temp_file_path, 'w') as temp_file:
+                    temp_file.write(contents)
+                    temp_file.flush()
+                    os.fsync(temp_file.fileno())
+                staged.append(temp_file_path)
+            fsync_directory(self.backend_path)
+            self._write_journal(STATE_APPLY)
+        except OSError:
+            # Nothing was applied yet, drop the staged files.
+            for temp_file_path in staged:
+                _remove_if_exists(temp_file_path)
+            raise
+        apply_journal_entry(self._journal_entry(STATE_APPLY))
+
+    def validated(self):
+        """
+        Record that the applied change set passed the config test, so it is completed if it is interrupted now.
+        """
+        self._write_journal(STATE_VALIDATED)
+
+    def finalize(self):
+        """
+        Drop the backups of deleted files and the journal entry.
+        """
+        finalize_journal_entry(self._journal_entry(STATE_VALIDATED))
+        _remove_if_exists(self.journal_file)
+
+    def rollback(self):
+        """
+        Restore deleted files and remove created files of an applied change set.
+        """
+        self._write_journal(STATE_ROLLBACK)
+        rollback_journal_entry(self._journal_entry(STATE_ROLLBACK))
+        _remove_if_exists(self.journal_file)
+
+    def _journal_entry(self, state: str) -> dict:
+        return {
+            "id": self.transaction_id,
+            "state": state,
+            "backend_path": self.backend_path,
+            "deletes": self.deletes,
+            "creates": [file_name for file_name, _ in self.creates],
+        }
+
+    def _write_journal(self, state: str):
+        os.makedirs(journal_path(), exist_ok=True)
+        write_atomic(self.journal_file, json.dumps(self._journal_entry(state)))
+        fsync_directory(journal_path())
+
+
+def apply_journal_entry(entry: dict):
+    """
+    Apply a journaled change set. Idempotent, so it can be repeated after a crash.
+    """
+    backend_path = entry["backend_path"]
+    for file_name in entry["deletes"]:
+        file_path = os.path.join(backend_path, file_name)
+        if os.path.exists(file_path):
+            os.replace(file_path, os.path.join(backend_path, backup_file_name(file_name, entry["id"])))
+    for file_name in entry["creates"]:
+        temp_file_path = os.path.join(backend_path, temp_file_name(file_name, entry["id"]))
+        if os.path.exists(temp_file_path):
+            os.replace(temp_file_path, os.path.join(backend_path, file_name))
+    fsync_directory(backend_path)
+
+
+def finalize_journal_entry(entry: dict):
+    backend_path = entry["backend_path"]
+    for file_name in entry["deletes"]:
+        _remove_if_exists(os.path.join(backend_path, backup_file_name(file_name, entry["id"])))
+
+
+def rollback_journal_entry(entry: dict):
+    """
+    Undo a journaled change set. Idempotent, so it can be repeated after a crash.
+    """
+    backend_path = entry["backend_path"]
+    for file_name in entry["creates"]:
+        _remove_if_exists(os.path.join(backend_path, temp_file_name(file_name, entry["id"])))
+        _remove_if_exists(os.path.join(backend_path, file_name))
+    for file_name in entry["deletes"]:
+        backup_file_path = os.path.join(backend_path, backup_file_name(file_name, entry["id"]))
+        if os.path.exists(backup_file_path):
+            os.replace(backup_file_path, os.path.join(backend_path, file_name))
+    fsync_directory(backend_path)
+
+
+def recover_transactions() -> int:
+    """
+    Complete validated change sets and roll back all other change sets which were journaled but not finished, and
+    remove orphaned staged files.
+    :return: Number of recovered change sets.
+    """
+    recovered = 0
+    if os.path.isdir(journal_path()):
+        for journal_file in sorted(os.listdir(journal_path())):
+            journal_file_path = os.path.join(journal_path(), journal_file)
+            if not journal_file.endswith(".json"):
+                _remove_if_exists(journal_file_path)
+                continue
+            try:
+                with open(journal_file_path, 'r') as file:
+                    entry = json.load(file)
+                if entry.get("state") == STATE_VALIDATED:
+                    logger.warning(f"Completing interrupted backend change set {entry['id']}.")
+                    apply_journal_entry(entry)
+                    finalize_journal_entry(entry)
+                else:
+                    # Applied but not validated yet, the config may not pass the config test
+                    logger.warning(f"Rolling back interrupted backend change set {entry['id']}.")
+                    rollback_journal_entry(entry)
+                recovered += 1
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Was not able to recover backend change set {journal_file}: {e}")
+                continue
+            _remove_if_exists(journal_file_path)
+    if os.path.isdir(settings.FORC_BACKEND_PATH):
+        for file_name in os.listdir(settings.FORC_BACKEND_PATH):
+            if file_name.startswith(".") and file_name.endswith(".tmp"):
+                logger.info(f"Removing orphaned staged backend file {file_name}.")
+                _remove_if_exists(os.path.join(settings.FORC_BACKEND_PATH, file_name))
+    return recovered
+
+
+def _remove_if_exists(file_path: str):
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
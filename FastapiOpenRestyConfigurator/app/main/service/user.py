@@ -1,105 +1,492 @@
 """
 Helper/service functions regarding users of backends.
+Filesystem access runs in the io executor, so a slow backend path does not block the event loop.
+The users of all backends are kept in memory as an ACL snapshot, which OpenResty pulls in bulk, so authorizing a
+request does not need to check the user files.
 """
+import hashlib
+import json
 import logging
 import os
 import shutil
+import threading
+from typing import Dict, List, Optional, Set, Tuple
 
 from ..config import get_settings
 from werkzeug.utils import secure_filename
 
-from ..model.serializers import User
+from ..model.serializers import User, UserMembership
+from ..service.events import publish, publish_detected, USERS_CHANGED
+from ..service.metadata import record_detected_users, record_users
+from ..util.executor import run_blocking
+from ..util.locking import SharedJournal
+from ..util.metrics import directory_scans, file_writes, metrics
+from ..util.watcher import DirectoryWatcher
 
 logger = logging.getLogger("service")
 settings = get_settings()
 
+# How a worker process learned about a change of users, decides whether it publishes the change.
+CHANGE_OWN = "own"
+CHANGE_ANNOUNCED = "announced"
+CHANGE_DETECTED = "detected"
 
-async def get_users(backend_id):
-    backend_id = secure_filename(str(backend_id))
-    user_id_path = f"{settings.FORC_USER_PATH}/{backend_id}"
-    if not os.path.exists(user_id_path) and not os.access(user_id_path, os.R_OK):
-        logger.exception(f"Not able to access configured user id path. Backend id: {backend_id}")
-        return []
-    users = os.listdir(user_id_path)
-    users_to_return = []
-    for user in users:
-        users_to_return.append(User(user=user))
-    return users_to_return
 
+class UserAcl:
+    """
+    Users of every backend, built once from the user path and updated on every change by FORC.
+    Every worker process announces the backends it changed in a journal in the state path, which the other worker
+    processes apply before they answer from the ACL. Backend directories added or removed by others are picked up by
+    a watcher. Changes inside an existing backend directory by others are not reported by the watcher, they are
+    picked up by an optional periodic rebuild. The snapshot is versioned by a hash of its content, which is equal in all worker processes
+    with the same users, its serialized form is built once per version.
+    """
 
-async def add_user(backend_id, user_id):
-    backend_id = secure_filename(str(backend_id))
+    def __init__(self, user_path, state_path, resync_interval: float):
+        """
+        :param user_path: Directory with a directory of user files per backend.
+        :param state_path: Directory of the journal shared with the other worker processes.
+        :param resync_interval: Seconds between two rebuilds, which pick up users changed by others inside existing
+            backend directories, 0 disables them.
+        """
+        self.user_path = str(user_path)
+        self.resync_interval = resync_interval
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._journal = SharedJournal(os.path.join(state_path, "users.changes"))
+        self._watcher: Optional[DirectoryWatcher] = None
+        self._resync_stop = threading.Event()
+        self._resync_thread: Optional[threading.Thread] = None
+        self._users: Dict[str, Set[str]] = {}
+        # XOR of the hashes of all (backend id, user) pairs, in total and per backend
+        self._content_hash = 0
+        self._backend_hashes: Dict[str, int] = {}
+        self._snapshot: Optional[Tuple[str, bytes]] = None
+
+    @property
+    def version(self) -> str:
+        return f"{self._content_hash:016x}"
+
+    def version_of(self, backend_id) -> str:
+        """
+        Version of the users of a single backend, so a change of one backend does not invalidate the others.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            return f"{self._backend_hashes.get(str(backend_id), 0):016x}"
+
+    def start(self):
+        """
+        Build the snapshot, watch the user path for added or removed backend directories and rebuild periodically
+        if configured.
+        """
+        self.rebuild()
+        if self._watcher is None:
+            self._watcher = DirectoryWatcher(
+                self.user_path,
+                self._on_change,
+                poll_interval=settings.FORC_WATCH_POLL_INTERVAL,
+                use_inotify=settings.FORC_WATCH_USE_INOTIFY
+            )
+        self._watcher.start()
+        if self._resync_thread is None and self.resync_interval > 0:
+            # inotify only reports changes of the user path itself, watching every backend directory or polling
+            # their modification times costs a watch or a stat per backend.
+            self._resync_stop.clear()
+            self._resync_thread = threading.Thread(target=self._run_resync, name="users:resync", daemon=True)
+            self._resync_thread.start()
+
+    def stop(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+        if self._resync_thread is not None:
+            self._resync_stop.set()
+            self._resync_thread.join(timeout=1)
+            self._resync_thread = None
+
+    def _run_resync(self):
+        while not self._resync_stop.wait(self.resync_interval):
+            try:
+                self.rebuild(CHANGE_DETECTED)
+            except Exception:
+                logger.exception(f"Was not able to rebuild the users of {self.user_path}.")
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            self.rebuild()
+
+    def rebuild(self, origin: str = CHANGE_ANNOUNCED):
+        """
+        Read the users of all backends.
+        :param origin: How the changes since the last build became known, only detected changes are published.
+        """
+        # Changes announced from now on are applied on top of the scan
+        self._journal.skip()
+        users: Dict[str, Set[str]] = {}
+        with directory_scans.time("users"):
+            try:
+                with os.scandir(self.user_path) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            users[entry.name] = self._read_backend(entry.name)
+            except OSError as e:
+                logger.warning(f"Not able to read user path {self.user_path}: {e}")
+        users = {backend_id: backend_users for backend_id, backend_users in users.items() if backend_users}
+        backend_hashes: Dict[str, int] = {}
+        content_hash = 0
+        for backend_id, backend_users in users.items():
+            backend_hash = 0
+            for user in backend_users:
+                backend_hash ^= self._user_hash(backend_id, user)
+            backend_hashes[backend_id] = backend_hash
+            content_hash ^= backend_hash
+        with self._lock:
+            previous = self._users if self._loaded else None
+            self._users = users
+            self._content_hash = content_hash
+            self._backend_hashes = backend_hashes
+            self._loaded = True
+            self._snapshot = None
+        if previous is not None and origin == CHANGE_DETECTED:
+            for backend_id in previous.keys() | users.keys():
+                if previous.get(backend_id) != users.get(backend_id):
+                    data = {"backend_id": backend_id, "users": sorted(users.get(backend_id, ()))}
+                    publish_detected(USERS_CHANGED, data)
+                    record_detected_users(backend_id, users.get(backend_id, set()))
+        logger.info(f"Loaded users of {len(self._users)} backends from {self.user_path}.")
+
+    def refresh(self, backend_ids, origin: str = CHANGE_OWN):
+        """
+        Re-read the users of single backends.
+        :param origin: How the changes became known.
+        """
+        for backend_id in backend_ids:
+            self.set(backend_id, self._read_backend(backend_id), origin)
+
+    def sync(self):
+        """
+        Apply the changes announced by other worker processes since the last sync.
+        """
+        if not self._loaded:
+            self.rebuild()
+            return
+        try:
+            changes = self._journal.read()
+        except OSError as e:
+            logger.warning(f"Not able to read user changes {self._journal.path}, reading all users again: {e}")
+            changes = None
+        if changes is None:
+            self.rebuild()
+        elif changes:
+            self.refresh(set(changes), CHANGE_ANNOUNCED)
+
+    def announce(self, backend_ids):
+        """
+        Tell the other worker processes that the users of backends changed on disk.
+        """
+        try:
+            self._journal.append([str(backend_id) for backend_id in backend_ids])
+        except OSError as e:
+            logger.warning(f"Not able to announce user changes in {self._journal.path}: {e}")
+
+    def _read_backend(self, backend_id: str) -> Set[str]:
+        try:
+            return set(os.listdir(os.path.join(self.user_path, backend_id)))
+        except OSError:
+            return set()
+
+    def _on_change(self, names):
+        if names is None:
+            self.rebuild(CHANGE_DETECTED)
+        else:
+            self.refresh(names, CHANGE_DETECTED)
+
+    @staticmethod
+    def _user_hash(backend_id: str, user: str) -> int:
+        return int(hashlib.sha256(f"{backend_id}/{user}".encode()).hexdigest()[:16], 16)
+
+    def get(self, backend_id) -> Set[str]:
+        self.ensure_loaded()
+        with self._lock:
+            return set(self._users.get(str(backend_id), ()))
+
+    def all(self) -> Dict[str, Set[str]]:
+        """
+        :return: Users by backend id.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            return {backend_id: set(users) for backend_id, users in self._users.items()}
+
+    def set(self, backend_id, users: Set[str], origin: str = CHANGE_OWN):
+        """
+        :param origin: How the change became known. Changes of this process are published and recorded in the
+            metadata store, changes announced by other worker processes were published and recorded by them, and
+            detected changes are published and recorded by the reload leader.
+        """
+        with self._lock:
+            current = self._users.get(str(backend_id), set())
+            if current == users:
+                return
+            backend_hash = self._backend_hashes.get(str(backend_id), 0)
+            for user in current ^ users:
+                backend_hash ^= self._user_hash(str(backend_id), user)
+            self._content_hash ^= self._backend_hashes.get(str(backend_id), 0) ^ backend_hash
+            if users:
+                self._users[str(backend_id)] = set(users)
+                self._backend_hashes[str(backend_id)] = backend_hash
+            else:
+                self._users.pop(str(backend_id), None)
+                self._backend_hashes.pop(str(backend_id), None)
+            self._snapshot = None
+        data = {"backend_id": str(backend_id), "users": sorted(users)}
+        if origin == CHANGE_OWN:
+            publish(USERS_CHANGED, data)
+            record_users(backend_id, users)
+        elif origin == CHANGE_DETECTED:
+            publish_detected(USERS_CHANGED, data)
+            record_detected_users(backend_id, users)
+
+    def add(self, backend_id, user_id: str):
+        """
+        Add a user file written by this process and announce it to the other worker processes.
+        """
+        with self._lock:
+            self.set(backend_id, self._users.get(str(backend_id), set()) | {user_id})
+        self.announce([backend_id])
+
+    def remove(self, backend_id, user_id: Optional[str] = None):
+        """
+        Remove a user of a backend, or all users of a backend if no user is given, after this process removed the
+        user files, and announce it to the other worker processes.
+        """
+        with self._lock:
+            if user_id is None:
+                self.set(backend_id, set())
+            else:
+                self.set(backend_id, self._users.get(str(backend_id), set()) - {user_id})
+        self.announce([backend_id])
+
+    def snapshot(self) -> Tuple[str, bytes]:
+        """
+        :return: Version and JSON serialized snapshot of all users by backend id.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            if self._snapshot is None:
+                body = {
+                    "version": self.version,
+                    "acls": {backend_id: sorted(users) for backend_id, users in self._users.items()}
+                }
+                self._snapshot = (self.version, json.dumps(body, separators=(",", ":")).encode())
+            return self._snapshot
+
+    def __len__(self):
+        return len(self._users)
+
+
+user_acl = UserAcl(settings.FORC_USER_PATH, settings.FORC_STATE_PATH, settings.FORC_USER_RESYNC_INTERVAL)
+
+metrics.gauge("forc_acl_backends", "Number of backends with users in the ACL snapshot.", lambda: len(user_acl))
+
+
+def secure_user_id(user_id):
     if "@" in user_id:
         user_id_parts = user_id.split("@")
         user_id_part1 = secure_filename(user_id_parts[0])
         user_id_part2 = secure_filename(user_id_parts[1])
-        user_id = f"{user_id_part1}@{user_id_part2}"
-    else:
-        user_id = secure_filename(str(user_id))
+        return f"{user_id_part1}@{user_id_part2}"
+    return secure_filename(str(user_id))
+
+
+async def sync_users():
+    """
+    Apply the user changes of other worker processes, needed before answering from the ACL.
+    """
+    await run_blocking(user_acl.sync)
+
+
+async def get_users(backend_id):
+    backend_id = secure_filename(str(backend_id))
+    await sync_users()
+    return [User(user=user) for user in sorted(user_acl.get(backend_id))]
+
+
+async def get_acl_snapshot() -> Tuple[str, bytes]:
+    await sync_users()
+    return user_acl.snapshot()
+
+
+async def add_user(backend_id, user_id):
+    backend_id = secure_filename(str(backend_id))
+    user_id = secure_user_id(user_id)
+    return await run_blocking(_add_user, backend_id, user_id)
+
+
+def _add_user(backend_id, user_id):
     user_id_path = f"{settings.FORC_USER_PATH}/{backend_id}"
-    user_file_name = f"{user_id}"
+    result = _prepare_user_path(user_id_path, backend_id)
+    if result != 0:
+        return result
+    try:
+        created = _create_user_file(user_id_path, user_id)
+    except OSError:
+        logger.exception(f"Not able to add user {user_id} to backend {backend_id}.")
+        return 2
+    user_acl.add(backend_id, user_id)
+    if not created:
+        logger.debug(f"User {user_id} already added to backend {backend_id}.")
+        return 3
+    return 0
+
+
+def _prepare_user_path(user_id_path, backend_id):
     if not os.path.exists(user_id_path):
         try:
             os.mkdir(user_id_path)
+        except FileExistsError:
+            pass
         except OSError:
             logger.exception(f"Not able to create backend directory with id {backend_id}.")
             return 1
     if not os.access(user_id_path, os.W_OK):
         logger.exception(f"Not able to access user id path {user_id_path}.")
         return 2
-    existing_users = os.listdir(user_id_path)
-    for file in existing_users:
-        if file == user_file_name:
-            logger.info(f"User {user_id} already added to backend {backend_id}.")
-            return 3
-    with open(f"{user_id_path}/{user_file_name}", 'w') as userFile:
-        userFile.write("")
-
     return 0
 
 
+def _create_user_file(user_id_path, user_id) -> bool:
+    """
+    Create a user file, the exclusive create doubles as duplicate check.
+    :return: False if the user file already exists.
+    """
+    try:
+        with file_writes.time("user"):
+            os.close(os.open(f"{user_id_path}/{user_id}", os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+        return True
+    except FileExistsError:
+        return False
+
+
+def _remove_user_path_if_empty(user_id_path):
+    try:
+        os.rmdir(user_id_path)
+    except OSError:
+        # Not empty anymore or already removed
+        pass
+
+
 async def delete_user(backend_id, user_id):
     backend_id = secure_filename(str(backend_id))
-    if "@" in user_id:
-        user_id_parts = user_id.split("@")
-        user_id_part1 = secure_filename(user_id_parts[0])
-        user_id_part2 = secure_filename(user_id_parts[1])
-        user_id = f"{user_id_part1}@{user_id_part2}"
-    else:
-        user_id = secure_filename(str(user_id))
+    user_id = secure_user_id(user_id)
+    return await run_blocking(_delete_user, backend_id, user_id)
+
+
+def _delete_user(backend_id, user_id):
     user_id_path = f"{settings.FORC_USER_PATH}/{backend_id}"
     user_file_name = f"{user_id}"
     user_file_path = f"{user_id_path}/{user_file_name}"
     if not os.path.exists(user_id_path):
         logger.exception(f"No user folder found for backend: {backend_id}.")
         return 1
-    if not os.path.exists(user_file_path):
+    logger.info(f"Deleting user {user_file_name} from backend {backend_id}.")
+    try:
+        os.remove(user_file_path)
+    except FileNotFoundError:
         logger.exception(f"No user file {user_file_name} found for backend: {backend_id}.")
         return 1
-    if not os.access(user_file_path, os.W_OK):
+    except PermissionError:
         logger.exception(f"Not able to access user id path {user_file_path}.")
         return 2
-    logger.info(f"Deleting user {user_file_name} from backend {backend_id}.")
-    try:
-        existing_users = os.listdir(user_id_path)
-        if len(existing_users) != 1:
-            os.remove(user_file_path)
-        else:
-            await delete_all(backend_id)
-        return 0
     except OSError:
         logger.exception(f"Not able to delete user {user_file_name} from backend {backend_id}.")
         return 3
+    user_acl.remove(backend_id, user_id)
+    _remove_user_path_if_empty(user_id_path)
+    return 0
+
+
+async def add_users(backend_id, user_ids: List[str]) -> UserMembership:
+    backend_id = secure_filename(str(backend_id))
+    user_ids = [secure_user_id(user_id) for user_id in user_ids]
+    return await run_blocking(_change_users, backend_id, add=user_ids)
+
+
+async def delete_users(backend_id, user_ids: List[str]) -> UserMembership:
+    backend_id = secure_filename(str(backend_id))
+    user_ids = [secure_user_id(user_id) for user_id in user_ids]
+    return await run_blocking(_change_users, backend_id, remove=user_ids)
+
+
+async def set_users(backend_id, user_ids: List[str]) -> UserMembership:
+    """
+    Set the full membership of a backend, only the difference to the current members is written.
+    """
+    backend_id = secure_filename(str(backend_id))
+    user_ids = {secure_user_id(user_id) for user_id in user_ids}
+    return await run_blocking(_set_users, backend_id, user_ids)
+
+
+def _set_users(backend_id, user_ids: Set[str]) -> UserMembership:
+    user_id_path = f"{settings.FORC_USER_PATH}/{backend_id}"
+    try:
+        existing_users = set(os.listdir(user_id_path))
+    except FileNotFoundError:
+        existing_users = set()
+    except OSError:
+        logger.exception(f"Not able to access user id path {user_id_path}.")
+        return UserMembership(failed=sorted(user_ids))
+    return _change_users(
+        backend_id, add=sorted(user_ids - existing_users), remove=sorted(existing_users - user_ids)
+    )
+
+
+def _change_users(backend_id, add: List[str] = (), remove: List[str] = ()) -> UserMembership:
+    user_id_path = f"{settings.FORC_USER_PATH}/{backend_id}"
+    membership = UserMembership()
+    if add and _prepare_user_path(user_id_path, backend_id) != 0:
+        membership.failed.extend(add)
+        add = ()
+    for user_id in add:
+        try:
+            if _create_user_file(user_id_path, user_id):
+                membership.added.append(user_id)
+        except OSError:
+            logger.exception(f"Not able to add user {user_id} to backend {backend_id}.")
+            membership.failed.append(user_id)
+    for user_id in remove:
+        try:
+            os.remove(f"{user_id_path}/{user_id}")
+            membership.removed.append(user_id)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.exception(f"Not able to delete user {user_id} from backend {backend_id}.")
+            membership.failed.append(user_id)
+    if membership.added or membership.removed:
+        logger.info(f"Added {len(membership.added)} and removed {len(membership.removed)} users of backend "
+                    f"{backend_id}.")
+    if remove:
+        _remove_user_path_if_empty(user_id_path)
+    # Read back once, so the ACL also reflects users which already existed.
+    user_acl.refresh([backend_id])
+    user_acl.announce([backend_id])
+    return membership
 
 
 async def delete_all(backend_id):
     backend_id = secure_filename(str(backend_id))
+    return await run_blocking(_delete_all, backend_id)
+
+
+def _delete_all(backend_id):
     user_id_path = f"{settings.FORC_USER_PATH}/{backend_id}"
     if not os.path.exists(user_id_path):
         logger.info(f"No user folder found for backend: {backend_id}.")
         return 1
     try:
         shutil.rmtree(user_id_path, ignore_errors=True)
+        user_acl.remove(backend_id)
         return 0
     except OSError:
         logger.exception(f"Not able to delete users for backend {backend_id}.")
@@ -1,24 +1,199 @@
 """
 Util functions regarding authentication.
+API keys are loaded once by the warm-up or the startup of a worker and only their SHA-256 digests are kept. Every
+key has scopes, reading or also changing backends and users, and a token bucket per scope, so a key polling too fast
+is limited without starving its own or other keys' changes. Buckets are kept per worker process, so a key may make
+up to the number of workers times its rate limit.
 """
+import hashlib
+import hmac
+import json
+import logging
+import time
+from functools import lru_cache
+from typing import Dict, Iterable, Optional
+
 from fastapi import Security, HTTPException
 from fastapi.security.api_key import APIKeyHeader
-from starlette.status import HTTP_403_FORBIDDEN
+from starlette.status import HTTP_403_FORBIDDEN, HTTP_429_TOO_MANY_REQUESTS
 
+from .metrics import metrics
 from ..config import get_settings
 
 API_KEY_NAME = "X-API-KEY"
 
+SCOPE_READ = "read"
+SCOPE_WRITE = "write"
+SCOPES = (SCOPE_READ, SCOPE_WRITE)
+
 api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
+logger = logging.getLogger("util")
 settings = get_settings()
 
 
+def digest_of(api_key: str) -> bytes:
+    return hashlib.sha256(api_key.encode()).digest()
+
+
+class TokenBucket:
+    """
+    Allows bursts of up to capacity requests and rate requests per second on average.
+    Only used from the event loop, so it needs no lock.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Take a token.
+        :return: 0 if a token was taken, otherwise seconds until the next token is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Principal:
+    """
+    Authenticated API key with its scopes and rate limits.
+    """
+
+    def __init__(self, name: str, digest: bytes, scopes: Iterable[str], rate: float, burst: float):
+        """
+        :param name: Name of the key, used in logs and metrics instead of the key itself.
+        :param digest: SHA-256 digest of the key.
+        :param scopes: Granted scopes, the write scope includes reading.
+        :param rate: Requests per second per scope, 0 disables rate limiting.
+        :param burst: Requests per scope allowed at once.
+        """
+        if len(digest) != hashlib.sha256().digest_size:
+            raise ValueError(f"API key {name} is not configured as SHA-256 digest.")
+        self.name = name
+        self.digest = digest
+        self.scopes = set(scopes)
+        if SCOPE_WRITE in self.scopes:
+            self.scopes.add(SCOPE_READ)
+        unknown = self.scopes.difference(SCOPES)
+        if unknown:
+            raise ValueError(f"Unknown scopes of API key {name}: {', '.join(sorted(unknown))}")
+        self.buckets: Dict[str, TokenBucket] = {
+            scope: TokenBucket(rate, max(burst, 1)) for scope in self.scopes
+        } if rate > 0 else {}
+
+    def __str__(self):
+        return self.name
+
+
+class ApiKeyStore:
+    """
+    Principals by key digest.
+    """
+
+    def __init__(self):
+        self._by_digest: Dict[bytes, Principal] = {}
+
+    def add(self, principal: Principal):
+        if principal.digest in self._by_digest:
+            raise ValueError(f"API key {principal.name} is configured twice.")
+        self._by_digest[principal.digest] = principal
+
+    def load_file(self, path: str):
+        """
+        Load keys from a JSON file like
+        {"keys": [{"name": "portal", "sha256": "<hex digest of the key>", "scopes": ["read", "write"],
+                   "rate": 50, "burst": 100}]}
+        """
+        with open(path, 'r') as keys_file:
+            keys = json.load(keys_file)["keys"]
+        for key in keys:
+            self.add(Principal(
+                name=key["name"],
+                digest=bytes.fromhex(key["sha256"]),
+                scopes=key.get("scopes", [SCOPE_READ]),
+                rate=float(key.get("rate", settings.FORC_RATE_LIMIT)),
+                burst=float(key.get("burst", settings.FORC_RATE_BURST))
+            ))
+
+    def authenticate(self, api_key: Optional[str]) -> Optional[Principal]:
+        if not api_key:
+            return None
+        digest = digest_of(api_key)
+        principal = self._by_digest.get(digest)
+        # The lookup is by digest, the final comparison does not leak how much of a digest matched either.
+        if principal is None or not hmac.compare_digest(principal.digest, digest):
+            return None
+        return principal
+
+    def __len__(self):
+        return len(self._by_digest)
+
+
+@lru_cache()
+def load_api_keys() -> ApiKeyStore:
+    """
+    Load the API keys on first use, an invalid keys file fails the startup of the worker.
+    """
+    store = ApiKeyStore()
+    store.add(Principal(
+        name="default",
+        digest=digest_of(settings.FORC_API_KEY.get_secret_value()),
+        scopes=SCOPES,
+        # Existing deployments use the key for all their calls, it is only limited if configured explicitly.
+        rate=settings.FORC_API_KEY_RATE_LIMIT,
+        burst=settings.FORC_RATE_BURST
+    ))
+    if settings.FORC_API_KEYS_FILE:
+        store.load_file(settings.FORC_API_KEYS_FILE)
+    logger.info(f"Loaded {len(store)} API keys.")
+    return store
+
+
+auth_requests = metrics.counter(
+    "forc_auth_requests_total", "Number of authenticated requests by key, scope and result.", ("key", "scope", "result")
+)
+
+
+def authorize(api_key: Optional[str], scope: str) -> Principal:
+    """
+    Authenticate an API key and check its scope and rate limit.
+    :raises HTTPException: 403 for unknown keys or missing scopes, 429 if the rate limit of the scope is exceeded.
+    """
+    principal = load_api_keys().authenticate(api_key)
+    if principal is None:
+        auth_requests.inc("unknown", scope, "forbidden")
+        raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Could not validate credentials")
+    if scope not in principal.scopes:
+        auth_requests.inc(principal.name, scope, "forbidden")
+        raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail=f"API key is not allowed to {scope}.")
+    bucket = principal.buckets.get(scope)
+    if bucket is not None:
+        retry_after = bucket.take()
+        if retry_after:
+            auth_requests.inc(principal.name, scope, "rate_limited")
+            raise HTTPException(
+                status_code=HTTP_429_TOO_MANY_REQUESTS,
+                detail="Rate limit exceeded.",
+                headers={"Retry-After": str(max(1, round(retry_after)))}
+            )
+    auth_requests.inc(principal.name, scope, "ok")
+    return principal
+
+
 async def get_api_key(
     api_key_header_in: str = Security(api_key_header),
 ):
-    if api_key_header_in == settings.FORC_API_KEY.get_secret_value():
-        return api_key_header_in
-    else:
-        raise HTTPException(
-            status_code=HTTP_403_FORBIDDEN, detail="Could not validate credentials"
-        )
+    return authorize(api_key_header_in, SCOPE_READ)
+
+
+async def get_write_api_key(
+    api_key_header_in: str = Security(api_key_header),
+):
+    return authorize(api_key_header_in, SCOPE_WRITE)
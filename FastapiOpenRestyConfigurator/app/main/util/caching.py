@@ -0,0 +1,82 @@
+"""
+Util functions for conditional GET requests.
+Collections are versioned by a hash of their content, which is exposed as ETag. The hash is equal in all worker
+processes with the same content, so a client may poll any worker. Serialized responses are cached per version, so
+repeated polls of an unchanged collection neither rebuild nor reserialize the response.
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+from .metrics import metrics
+
+
+def etag_of(generation) -> str:
+    return f'"{generation}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check an If-None-Match header against an ETag, weak comparison as required for GET.
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    """
+    Serialized JSON responses by request path and query, each valid for a single version of a collection.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[str, bytes, Optional[Dict[str, str]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def respond(self, request: Request, generation,
+                      build: Callable[[], Awaitable[Tuple[Any, Optional[Dict[str, str]]]]]) -> Response:
+        """
+        Answer a GET request with 304, a cached body or a freshly built body.
+        :param request: The request to answer.
+        :param generation: Version of the collection the response is built from.
+        :param build: Coroutine function returning the JSON content and additional headers of the response.
+        """
+        generation = str(generation)
+        etag = etag_of(generation)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            conditional_requests.inc("not_modified")
+            return Response(status_code=304, headers={"ETag": etag})
+
+        key = f"{request.url.path}?{request.url.query}"
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end(key)
+        if entry is not None and entry[0] == generation:
+            conditional_requests.inc("cached")
+            _, body, headers = entry
+        else:
+            conditional_requests.inc("built")
+            content, headers = await build()
+            body = json.dumps(content, separators=(",", ":")).encode()
+            with self._lock:
+                self._entries[key] = (generation, body, headers)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return Response(content=body, media_type="application/json", headers={**(headers or {}), "ETag": etag})
+
+
+conditional_requests = metrics.counter(
+    "forc_conditional_requests_total", "Number of cacheable GET requests by how they were answered.", ("result",)
+)
+
+response_cache = ResponseCache()
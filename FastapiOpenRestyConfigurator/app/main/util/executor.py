@@ -0,0 +1,79 @@
+"""
+Util functions to run blocking filesystem work outside of the event loop.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ..model.serializers import ExecutorStats
+from .metrics import metrics
+from ..config import get_settings
+
+settings = get_settings()
+
+
+class BlockingExecutor:
+    """
+    Bounded thread pool for blocking calls, which keeps track of its queue depth.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="forc-io")
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.pending = 0
+        self.active = 0
+        self.max_queued = 0
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run a blocking function in the pool and wait for its result.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.submitted += 1
+            self.pending += 1
+            self.max_queued = max(self.max_queued, self.pending - self.active)
+        try:
+            return await loop.run_in_executor(self._executor, functools.partial(self._call, func, *args, **kwargs))
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def _call(self, func, *args, **kwargs):
+        with self._lock:
+            self.active += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def stats(self) -> ExecutorStats:
+        with self._lock:
+            return ExecutorStats(
+                max_workers=self.max_workers,
+                submitted=self.submitted,
+                active=self.active,
+                queued=self.pending - self.active,
+                max_queued=self.max_queued
+            )
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+io_executor = BlockingExecutor(settings.FORC_IO_WORKERS)
+
+metrics.gauge("forc_io_executor_active", "Number of blocking calls currently running.", lambda: io_executor.active)
+metrics.gauge(
+    "forc_io_executor_queued",
+    "Number of blocking calls waiting for a worker.",
+    lambda: io_executor.pending - io_executor.active
+)
+
+
+async def run_blocking(func, *args, **kwargs):
+    return await io_executor.run(func, *args, **kwargs)
@@ -0,0 +1,245 @@
+"""
+Util functions to coordinate the worker processes of a FORC deployment.
+Locks are fcntl locks on files in the state path, so they are released by the kernel when a process dies.
+"""
+import asyncio
+import fcntl
+import logging
+import os
+import threading
+import uuid
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from .executor import run_blocking
+
+logger = logging.getLogger("util")
+
+
+class FileLock:
+    """
+    Exclusive lock shared by all threads and processes using the same lock file.
+    Threads of one process are serialized by a thread lock first, as fcntl locks are held per process.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._async_lock: Optional[asyncio.Lock] = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """
+        :param blocking: Wait for the lock, otherwise return False if it is held by another thread or process.
+        :return: True if the lock was acquired.
+        """
+        if not self._thread_lock.acquire(blocking):
+            return False
+        fd = None
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BaseException as e:
+            if fd is not None:
+                os.close(fd)
+            self._thread_lock.release()
+            if isinstance(e, BlockingIOError):
+                return False
+            raise
+        self._fd = fd
+        return True
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+            self._thread_lock.release()
+
+    @property
+    def locked(self) -> bool:
+        return self._fd is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    @asynccontextmanager
+    async def hold(self):
+        """
+        Hold the lock from the event loop. Coroutines of this process queue on an asyncio lock, so at most one
+        executor thread blocks on the file lock.
+        """
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            acquiring = asyncio.ensure_future(run_blocking(self.acquire))
+            try:
+                await asyncio.shield(acquiring)
+            except asyncio.CancelledError:
+                # The executor thread gets the lock anyway, release it as soon as it has it.
+                acquiring.add_done_callback(self._release_acquired)
+                raise
+            try:
+                yield self
+            finally:
+                self.release()
+
+    def _release_acquired(self, acquiring: asyncio.Future):
+        if not acquiring.cancelled() and acquiring.exception() is None:
+            self.release()
+
+
+class SharedCounter:
+    """
+    Integer in a file, incremented under a file lock by any process.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = FileLock(f"{path}.lock")
+
+    def value(self) -> int:
+        try:
+            with open(self.path, 'r') as counter_file:
+                return int(counter_file.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def increment(self) -> int:
+        """
+        :return: The incremented value.
+        """
+        with self._lock:
+            value = self.value() + 1
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as counter_file:
+                counter_file.write(str(value))
+            os.replace(temp_path, self.path)
+            return value
+
+
+class SharedJournal:
+    """
+    Append-only file of lines written by any process, every process reads the lines appended since its last read.
+    Once the file exceeds its maximum size it is replaced by an empty file, readers which have not read all lines of
+    the replaced file are told to start over. Every file starts with a random epoch, so positions in a replaced file
+    can be told apart from positions in the current file.
+    """
+
+    def __init__(self, path: str, max_size: int = 1024 * 1024):
+        """
+        :param path: Path of the journal file.
+        :param max_size: Size in bytes after which the journal file is replaced.
+        """
+        self.path = path
+        self.max_size = max_size
+        # Epoch of the file read last, None if it was not read yet
+        self.epoch: Optional[str] = None
+        self._lock = FileLock(f"{path}.lock")
+        self._read_lock = threading.Lock()
+        self._inode: Optional[int] = None
+        self._offset = 0
+
+    def append(self, lines: List[str]):
+        """
+        Append lines, the journal file is created if it does not exist yet.
+        """
+        data = "".join(f"{line}\n" for line in lines).encode()
+        with self._lock:
+            try:
+                size = os.stat(self.path).st_size
+            except FileNotFoundError:
+                size = 0
+            if size == 0 or size + len(data) > self.max_size:
+                temp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(temp_path, 'wb') as journal:
+                    journal.write(f"#{uuid.uuid4().hex[:8]}\n".encode())
+                os.replace(temp_path, self.path)
+            if data:
+                with open(self.path, 'ab') as journal:
+                    journal.write(data)
+
+    def skip(self):
+        """
+        Continue reading after the lines appended so far.
+        """
+        with self._read_lock:
+            try:
+                with open(self.path, 'rb') as journal:
+                    stat = os.fstat(journal.fileno())
+                    self._inode, self._offset = stat.st_ino, stat.st_size
+                    self.epoch = self._read_epoch(journal.readline())
+            except FileNotFoundError:
+                self._inode, self._offset = None, 0
+
+    def read(self) -> Optional[List[str]]:
+        """
+        :return: Lines appended since the last read, None if lines were missed because the file was replaced. The
+            next read starts at the beginning of the new file.
+        """
+        with self._read_lock:
+            try:
+                stat = os.stat(self.path)
+                if stat.st_ino == self._inode and stat.st_size == self._offset:
+                    return []
+                with open(self.path, 'rb') as journal:
+                    stat = os.fstat(journal.fileno())
+                    if stat.st_ino != self._inode or stat.st_size < self._offset:
+                        missed = self._inode is not None
+                        self._inode, self._offset = stat.st_ino, 0
+                        if missed:
+                            return None
+                    journal.seek(self._offset)
+                    data = journal.read(stat.st_size - self._offset)
+            except FileNotFoundError:
+                missed = self._inode is not None
+                self._inode, self._offset = None, 0
+                return None if missed else []
+            # A line which is still being appended is read next time
+            complete = data.rfind(b"\n") + 1
+            lines = data[:complete].decode().splitlines()
+            if self._offset == 0 and lines:
+                self.epoch = self._read_epoch(lines[0].encode())
+                if self.epoch is not None:
+                    lines = lines[1:]
+            self._offset += complete
+            return lines
+
+    @staticmethod
+    def _read_epoch(line: bytes) -> Optional[str]:
+        return line.strip()[1:].decode() if line.startswith(b"#") else None
+
+
+class LeaderLock:
+    """
+    Elects a single leader among all processes: the first process which gets the lock keeps it until it exits.
+    """
+
+    def __init__(self, path: str):
+        self._lock = FileLock(path)
+
+    @property
+    def is_leader(self) -> bool:
+        return self._lock.locked
+
+    def try_acquire(self) -> bool:
+        """
+        Try to become leader without waiting.
+        :return: True if this process is the leader.
+        """
+        if self._lock.locked:
+            return True
+        if self._lock.acquire(blocking=False):
+            logger.info(f"Process {os.getpid()} was elected leader for {self._lock.path}.")
+            return True
+        return False
+
+    def resign(self):
+        if self._lock.locked:
+            self._lock.release()
@@ -1,39 +1,205 @@
 """
 File containing logging configuration.
+All FORC loggers only put their records on a bounded queue, a listener thread writes them to stderr and the log file,
+so log I/O never blocks a request. If the queue is full records are dropped and counted instead of waiting, and
+debug records, logged per request or per backend, are sampled.
 """
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import List, Optional
+
+from .metrics import metrics
 from ..config import get_settings
 
 settings = get_settings()
 
+TEXT_FORMAT = "[%(levelprefix)s %(asctime)s - %(name)s - %(funcName)s:%(lineno)d]: %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+log_records_dropped = metrics.counter(
+    "forc_log_records_dropped_total", "Number of log records not written by logger and reason.", ("logger", "reason")
+)
+
+_exception_formatter = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a single line JSON object.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+                    + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "function": record.funcName,
+            "line": record.lineno,
+            "pid": record.process,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes every record of level INFO and above, but only a share of the debug records.
+    """
+
+    def __init__(self, rate: float):
+        """
+        :param rate: Share of debug records which are passed, between 0 and 1.
+        """
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.INFO or self.rate >= 1 or random.random() < self.rate:
+            return True
+        log_records_dropped.inc(record.name, "sampled")
+        return False
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Puts records on a bounded queue without waiting, records which do not fit are dropped.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments while they are unchanged, but keep the traceback apart from the message,
+        # so the formatters of the listener can place it.
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc(record.name, "queue_full")
+
+
+class LogPipeline:
+    """
+    Queue handler shared by all FORC loggers and the listener thread writing their records.
+    """
+
+    def __init__(self, queue_size: int, sample_rate: float, log_format: str, log_file: Optional[str]):
+        """
+        :param queue_size: Number of records which may wait for the listener.
+        :param sample_rate: Share of debug records which are logged.
+        :param log_format: text or json.
+        :param log_file: Path of the rotating log file, no file is written if empty.
+        """
+        self.queue_size = queue_size
+        self.handler = DroppingQueueHandler(queue.Queue(queue_size))
+        self.handler.addFilter(SamplingFilter(sample_rate))
+        self.handlers = self._build_handlers(log_format, log_file)
+        self._listener: Optional[QueueListener] = None
+        self._restart = False
+
+    @staticmethod
+    def _build_handlers(log_format: str, log_file: Optional[str]) -> List[logging.Handler]:
+        if log_format == "json":
+            formatter = JsonFormatter()
+        else:
+            from uvicorn.logging import DefaultFormatter
+            formatter = DefaultFormatter(fmt=TEXT_FORMAT, datefmt=DATE_FORMAT)
+        handlers: List[logging.Handler] = [logging.StreamHandler(sys.stderr)]
+        if log_file:
+            # Open the log file on the first record instead of on import
+            handlers.append(RotatingFileHandler(
+                log_file, maxBytes=25 * 1024 * 1024, backupCount=4, delay=True  # 25 megabytes
+            ))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        return handlers
+
+    def start(self):
+        if self._listener is None:
+            self._listener = QueueListener(self.handler.queue, *self.handlers, respect_handler_level=True)
+            self._listener.start()
+
+    def stop(self):
+        """
+        Stop the listener after it wrote all queued records.
+        """
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.stop()
+
+    def pending(self) -> int:
+        return self.handler.queue.qsize()
+
+    def _before_fork(self):
+        # Fork without the listener thread, which might hold the lock of a stream
+        self._restart = self._listener is not None
+        self.stop()
+
+    def _after_fork_in_parent(self):
+        if self._restart:
+            self.start()
+
+    def _after_fork_in_child(self):
+        # Records queued by other threads since stopping are written by the parent only
+        self.handler.queue = queue.Queue(self.queue_size)
+        self._after_fork_in_parent()
+
+
+log_pipeline = LogPipeline(
+    queue_size=settings.FORC_LOG_QUEUE_SIZE,
+    sample_rate=settings.FORC_LOG_SAMPLE_RATE,
+    log_format=settings.FORC_LOG_FORMAT,
+    log_file=settings.FORC_LOG_FILE
+)
+os.register_at_fork(
+    before=log_pipeline._before_fork,
+    after_in_parent=log_pipeline._after_fork_in_parent,
+    after_in_child=log_pipeline._after_fork_in_child
+)
+atexit.register(log_pipeline.stop)
+
+metrics.gauge("forc_log_queue_records", "Number of log records waiting to be written.", log_pipeline.pending)
+
+
+def queue_handler() -> logging.Handler:
+    """
+    Handler factory for the logging config, starts the listener once the loggers are configured.
+    """
+    log_pipeline.start()
+    return log_pipeline.handler
+
+
 log_config = {
     "version": 1,
     "disable_existing_loggers": False,
-    "formatters": {
-        "default": {
-            "()": "uvicorn.logging.DefaultFormatter",
-            "fmt": "[%(levelprefix)s %(asctime)s - %(name)s - %(funcName)s:%(lineno)d]: %(message)s",
-            "datefmt": "%Y-%m-%d %H:%M:%S",
-        },
-    },
     "handlers": {
-        "default": {
-            "formatter": "default",
-            "class": "logging.StreamHandler",
-            "stream": "ext://sys.stderr",
-        },
-        "file": {
-            "formatter": "default",
-            "class": "logging.handlers.RotatingFileHandler",
-            "filename": "/var/log/all_forc_logs.log",
-            "maxBytes": 25 * 1024 * 1024, # 25 megabytes
-            "backupCount": 4
+        "queue": {
+            "()": queue_handler,
         },
     },
     "loggers": {
-        "internal": {"handlers": ["default", "file"], "level": settings.LOG_LEVEL},
-        "view": {"handlers": ["default", "file"], "level": settings.LOG_LEVEL},
-        "service": {"handlers": ["default", "file"], "level": settings.LOG_LEVEL},
-        "validation": {"handlers": ["default", "file"], "level": settings.LOG_LEVEL},
-        "util": {"handlers": ["default", "file"], "level": settings.LOG_LEVEL}
+        "internal": {"handlers": ["queue"], "level": settings.LOG_LEVEL},
+        "view": {"handlers": ["queue"], "level": settings.LOG_LEVEL},
+        "service": {"handlers": ["queue"], "level": settings.LOG_LEVEL},
+        "validation": {"handlers": ["queue"], "level": settings.LOG_LEVEL},
+        "util": {"handlers": ["queue"], "level": settings.LOG_LEVEL}
     },
 }
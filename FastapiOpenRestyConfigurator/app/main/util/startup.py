@@ -0,0 +1,78 @@
+"""
+Util functions to track the startup of a worker process.
+The startup is split into timed phases. A worker is ready once all indexes and caches are built, which a load
+balancer can check on the readiness endpoint before sending requests to a new worker.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from ..model.serializers import Readiness
+from .metrics import metrics
+from ..config import get_settings
+
+logger = logging.getLogger("util")
+settings = get_settings()
+
+
+class Startup:
+    """
+    Durations of the startup phases and readiness of this process.
+    """
+
+    def __init__(self):
+        self.ready = False
+        # Whether the indexes were built before forking, in the parent process
+        self.preloaded = False
+        self.import_time = None
+        self.phases: Dict[str, float] = {}
+
+    def record_import(self, started: float):
+        """
+        Record the import time of the application and warn if it exceeds the budget.
+        :param started: time.perf_counter() before the application modules were imported.
+        """
+        self.import_time = time.perf_counter() - started
+        if self.import_time > settings.FORC_IMPORT_TIME_BUDGET:
+            logger.warning(f"Importing the application took {self.import_time:.3f}s, "
+                           f"more than the budget of {settings.FORC_IMPORT_TIME_BUDGET}s.")
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+            startup_phases.observe(self.phases[name], name)
+
+    def mark_ready(self):
+        self.ready = True
+        warm_up = sum(duration for name, duration in self.phases.items() if not name.startswith("preload_"))
+        logger.info(f"Worker {os.getpid()} is ready after {warm_up:.3f}s of warm-up.")
+
+    def after_fork(self):
+        """
+        Reset the state in a forked worker, the phases of the parent process are kept with a preload_ prefix.
+        """
+        self.ready = False
+        self.preloaded = bool(self.phases)
+        self.phases = {f"preload_{name}": duration for name, duration in self.phases.items()}
+
+    def readiness(self) -> Readiness:
+        return Readiness(
+            ready=self.ready,
+            preloaded=self.preloaded,
+            import_time=self.import_time,
+            phases=self.phases
+        )
+
+
+startup_phases = metrics.histogram(
+    "forc_startup_phase_duration_seconds", "Duration of the startup phases of a worker process.", ("phase",)
+)
+
+startup = Startup()
+os.register_at_fork(after_in_child=startup.after_fork)
@@ -1,40 +1,211 @@
 """
 Helper/service functions to generate backends out of templates.
+Templates are compiled once into a cache keyed by name%version and recompiled when the template path changes.
+Jinja is imported with the first compile, which the warm-up runs before workers are forked.
 """
-import jinja2
+import hashlib
+import json
 import logging
 import os
+import re
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
 
 from ..model.serializers import BackendTemp
+from .metrics import directory_scans, template_renders
+from .watcher import DirectoryWatcher
 from ..config import get_settings
 
+if TYPE_CHECKING:
+    import jinja2
+
 logger = logging.getLogger("util")
 settings = get_settings()
 
-logger.info("Loading the templating engine.")
+template_file_regex = r"(.*)%(.*)\.conf"
+
+
+class TemplateCache:
+    """
+    Compiled templates of the template path, keyed by name%version.
+    Compiled bytecode is additionally cached on disk, so new worker processes start warm. Workers forked after the
+    warm-up keep the compiled templates of the parent and only recompile templates changed since then.
+    """
+
+    def __init__(self, template_path, bytecode_cache_path: Optional[str] = None):
+        self.template_path = str(template_path)
+        self.bytecode_cache_path = bytecode_cache_path
+        self._environment: Optional["jinja2.Environment"] = None
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._watcher: Optional[DirectoryWatcher] = None
+        self._templates: Dict[str, "jinja2.Template"] = {}
+        self._versions: Dict[str, Dict[str, str]] = {}
+        # file name -> mtime of the template file when it was compiled
+        self._mtimes: Dict[str, int] = {}
+
+    @property
+    def environment(self) -> "jinja2.Environment":
+        if self._environment is None:
+            import jinja2
+            self._environment = jinja2.Environment(
+                loader=jinja2.FileSystemLoader(searchpath=self.template_path),
+                autoescape=True,
+                auto_reload=False,
+                bytecode_cache=jinja2.FileSystemBytecodeCache(self.bytecode_cache_path)
+            )
+        return self._environment
+
+    def start(self):
+        """
+        Compile all templates and start watching the template path.
+        """
+        with self._lock:
+            # Compiled before, e.g. in the parent process of a forked worker, only changes since then are compiled.
+            preloaded = self._loaded and self._watcher is None
+            if not self._loaded:
+                self.rebuild()
+            if self._watcher is None:
+                self._watcher = DirectoryWatcher(
+                    self.template_path,
+                    self.refresh,
+                    poll_interval=settings.FORC_WATCH_POLL_INTERVAL,
+                    use_inotify=settings.FORC_WATCH_USE_INOTIFY,
+                    track_files=True
+                )
+        self._watcher.start()
+        if preloaded:
+            changed = self._changed_since_compile()
+            if changed:
+                self.refresh(changed)
+
+    def stop(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+    def ensure_loaded(self):
+        if not self._loaded or self._watcher is None:
+            self.start()
+
+    def rebuild(self):
+        with directory_scans.time("templates"):
+            if not os.path.exists(self.template_path) or not os.access(self.template_path, os.R_OK):
+                logger.error("Was not able to load templates. Adjust the templates_path in the config.")
+                file_names = []
+            else:
+                file_names = os.listdir(self.template_path)
+            with self._lock:
+                self._templates.clear()
+                self._versions.clear()
+                self._mtimes.clear()
+                for file_name in file_names:
+                    self._compile(file_name)
+                self._loaded = True
+        logger.info(f"Compiled {len(self._templates)} templates from {self.template_path}.")
+
+    def refresh(self, file_names: Optional[Set[str]] = None):
+        """
+        Recompile changed templates.
+        :param file_names: Names of changed files or None to recompile all templates.
+        """
+        if file_names is None:
+            self.rebuild()
+            return
+        with self._lock:
+            for file_name in file_names:
+                self._drop(file_name)
+                self._compile(file_name)
 
-try:
-    templateLoader = jinja2.FileSystemLoader(searchpath=settings.FORC_TEMPLATE_PATH)
-    templateEnv = jinja2.Environment(loader=templateLoader, autoescape=True)
-except jinja2.exceptions.TemplatesNotFound:
-    logger.error("Was not able to load template engine. Adjust the templates_path in the config.")
+    def get(self, name: str, version: str) -> Optional["jinja2.Template"]:
+        self.ensure_loaded()
+        return self._templates.get(f"{name}%{version}")
+
+    def available(self, name: str = None, version: str = None) -> List[Tuple[str, str]]:
+        """
+        List cached templates, optionally filtered by name and version.
+        :return: List of (name, version) tuples.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            if name is None:
+                return [(n, v) for n, versions in self._versions.items() for v in versions]
+            versions = self._versions.get(name, {})
+            if version is None:
+                return [(name, v) for v in versions]
+            return [(name, version)] if version in versions else []
+
+    def content_hash(self) -> str:
+        """
+        Hash identifying the available templates, equal in all worker processes with the same templates.
+        """
+        return hashlib.sha256(json.dumps(sorted(self.available())).encode()).hexdigest()[:16]
+
+    def _changed_since_compile(self) -> Set[str]:
+        """
+        :return: Names of template files which were added, removed or modified since they were compiled.
+        """
+        mtimes = {}
+        try:
+            with os.scandir(self.template_path) as entries:
+                for entry in entries:
+                    if re.fullmatch(template_file_regex, entry.name) and entry.is_file():
+                        mtimes[entry.name] = entry.stat().st_mtime_ns
+        except OSError as e:
+            logger.warning(f"Was not able to check templates in {self.template_path}: {e}")
+            return set()
+        with self._lock:
+            return {name for name in mtimes.keys() | self._mtimes.keys() if mtimes.get(name) != self._mtimes.get(name)}
+
+    def _compile(self, file_name: str):
+        match = re.fullmatch(template_file_regex, file_name)
+        file_path = os.path.join(self.template_path, file_name)
+        if not match or not os.path.isfile(file_path):
+            return
+        try:
+            mtime = os.stat(file_path).st_mtime_ns
+        except OSError:
+            return
+        from jinja2 import TemplateError
+        try:
+            # Load through the loader to bypass the environment cache but use the bytecode cache.
+            template = self.environment.loader.load(self.environment, file_name)
+        except TemplateError as e:
+            logger.error(f"Was not able to compile template {file_name}: {e}")
+            return
+        self._templates[file_name[:-len(".conf")]] = template
+        self._mtimes[file_name] = mtime
+        self._versions.setdefault(match.group(1), {})[match.group(2)] = file_name
+
+    def _drop(self, file_name: str):
+        match = re.fullmatch(template_file_regex, file_name)
+        if not match:
+            return
+        self._templates.pop(file_name[:-len(".conf")], None)
+        self._mtimes.pop(file_name, None)
+        versions = self._versions.get(match.group(1))
+        if versions is not None:
+            versions.pop(match.group(2), None)
+            if not versions:
+                del self._versions[match.group(1)]
+
+
+template_cache = TemplateCache(settings.FORC_TEMPLATE_PATH, settings.FORC_TEMPLATE_CACHE_PATH)
 
 
 async def generate_backend_by_template(backend_temp: BackendTemp, suffix_number):
-    if not templateLoader or not templateEnv:
-        logger.error("The template engine is not loaded. Can't generate backend.")
+    template = template_cache.get(backend_temp.template, backend_temp.template_version)
+    if template is None:
+        logger.error(f"Not able to find {settings.FORC_TEMPLATE_PATH}/"
+                     f"{backend_temp.template}%{backend_temp.template_version}.conf")
         return None
-    assembled_template_file_name = f"{backend_temp.template}%{backend_temp.template_version}.conf"
-    if not os.path.isfile(f"{settings.FORC_TEMPLATE_PATH}/{assembled_template_file_name}"):
-        logger.error(f"Not able to find {settings.FORC_TEMPLATE_PATH}/{assembled_template_file_name}")
-        return None
-    template = templateEnv.get_template(assembled_template_file_name)
-
-    rendered_backend = template.render(
-        key_url=f"{backend_temp.user_key_url}_{suffix_number}",
-        owner=backend_temp.owner,
-        backend_id=backend_temp.id,
-        forc_backend_path=settings.FORC_BACKEND_PATH,
-        location_url=backend_temp.upstream_url
-    )
+
+    with template_renders.time(backend_temp.template):
+        rendered_backend = template.render(
+            key_url=f"{backend_temp.user_key_url}_{suffix_number}",
+            owner=backend_temp.owner,
+            backend_id=backend_temp.id,
+            forc_backend_path=settings.FORC_BACKEND_PATH,
+            location_url=backend_temp.upstream_url
+        )
     return rendered_backend
@@ -0,0 +1,174 @@
+"""
+Util functions to watch a directory for changes.
+Uses inotify when available and falls back to polling the directory modification time.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+from typing import Callable, Dict, Optional, Set
+
+logger = logging.getLogger("util")
+
+# inotify event masks, see inotify(7).
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE \
+    | IN_DELETE_SELF | IN_MOVE_SELF
+
+EVENT_HEADER = struct.Struct("iIII")
+
+# Callback receives the changed file names, or None if the whole directory has to be rescanned.
+ChangeCallback = Callable[[Optional[Set[str]]], None]
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if hasattr(libc, "inotify_init1") and hasattr(libc, "inotify_add_watch"):
+            return libc
+    except OSError:
+        pass
+    return None
+
+
+class DirectoryWatcher:
+    """
+    Watches a single directory in a daemon thread and reports changes to a callback.
+    """
+
+    def __init__(self, path: str, on_change: ChangeCallback, poll_interval: float = 2.0, use_inotify: bool = True,
+                 track_files: bool = False):
+        """
+        :param path: Directory to watch.
+        :param on_change: Callback for changes.
+        :param poll_interval: Seconds between two checks when polling.
+        :param use_inotify: Use inotify if available.
+        :param track_files: When polling, also detect modified files by their mtime instead of only added and
+            removed files. Costs one stat per file and interval, so only use it for small directories.
+        """
+        self.path = str(path)
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.track_files = track_files
+        self.mode: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        inotify_fd = self._init_inotify() if self.use_inotify else None
+        if inotify_fd is not None:
+            self.mode = "inotify"
+            target, args = self._run_inotify, (inotify_fd,)
+        else:
+            self.mode = "poll"
+            target, args = self._run_poll, ()
+        logger.info(f"Watching {self.path} for changes using {self.mode}.")
+        self._thread = threading.Thread(target=target, args=args, name=f"watcher:{self.path}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
+        self._thread = None
+
+    def _notify(self, names: Optional[Set[str]]):
+        try:
+            self.on_change(names)
+        except Exception:
+            logger.exception(f"Change callback for {self.path} failed.")
+
+    def _init_inotify(self) -> Optional[int]:
+        libc = _load_libc()
+        if libc is None:
+            return None
+        fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if fd < 0:
+            logger.warning(f"inotify_init1 failed with errno {ctypes.get_errno()}, falling back to polling.")
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(self.path), WATCH_MASK) < 0:
+            logger.warning(f"inotify_add_watch on {self.path} failed with errno {ctypes.get_errno()}, "
+                           f"falling back to polling.")
+            os.close(fd)
+            return None
+        return fd
+
+    def _run_inotify(self, fd: int):
+        try:
+            while not self._stop.is_set():
+                readable, _, _ = select.select([fd], [], [], self.poll_interval)
+                if not readable:
+                    continue
+                try:
+                    data = os.read(fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                names: Optional[Set[str]] = set()
+                offset = 0
+                while offset < len(data):
+                    _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                    offset += EVENT_HEADER.size
+                    name = data[offset:offset + length].rstrip(b"\0")
+                    offset += length
+                    if mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF) or names is None:
+                        names = None
+                    elif name:
+                        names.add(os.fsdecode(name))
+                if names is None or names:
+                    self._notify(names)
+        finally:
+            os.close(fd)
+
+    def _run_poll(self):
+        last_mtime = self._dir_mtime()
+        last_files = self._file_mtimes() if self.track_files else {}
+        while not self._stop.wait(self.poll_interval):
+            mtime = self._dir_mtime()
+            if self.track_files:
+                files = self._file_mtimes()
+                changed = {name for name in files.keys() | last_files.keys() if files.get(name) != last_files.get(name)}
+                last_files = files
+                if changed:
+                    self._notify(changed)
+            elif mtime != last_mtime:
+                self._notify(None)
+            last_mtime = mtime
+
+    def _file_mtimes(self) -> Dict[str, int]:
+        mtimes = {}
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    try:
+                        mtimes[entry.name] = entry.stat().st_mtime_ns
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        return mtimes
+
+    def _dir_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
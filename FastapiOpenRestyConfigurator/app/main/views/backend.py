@@ -1,51 +1,159 @@
 """
 Backend view.
 """
+import json
 import logging
-from typing import List
+from typing import List, Optional, Set
 
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.openapi.models import APIKey
 from werkzeug.exceptions import NotFound, InternalServerError
 from werkzeug.utils import secure_filename
 
-from ..model.serializers import BackendIn, BackendOut
+from ..model.serializers import BackendIn, BackendOut, BackendBatchIn, BackendBatchDelete, BackendBatchResult, \
+    BackendCount, BackendHealth
 from ..service import backend as backend_service
 from ..service import user as user_service
-from ..util.auth import get_api_key
+from ..util.auth import get_api_key, get_write_api_key
+from ..util.caching import response_cache
 
 router = APIRouter()
 logger = logging.getLogger("view")
 
+MAX_PAGE_SIZE = 10000
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Set[str]]:
+    """
+    Parse a comma separated list of backend fields.
+    :return: Set of fields or None for all fields.
+    """
+    if not fields:
+        return None
+    include = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = include - set(BackendOut.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown backend fields: {', '.join(sorted(unknown))}.")
+    return include
+
+
+async def backends_as_ndjson(cursor: Optional[int], limit: Optional[int], include: Optional[Set[str]]):
+    async for backends in backend_service.iter_backends(cursor, limit):
+        yield "".join(json.dumps(backend.model_dump(include=include)) + "\n" for backend in backends)
+
 
 @router.get(
     "/backends",
     response_model=List[BackendOut],
     tags=["Backends"],
-    summary="List all created backends."
+    summary="List all created backends.",
+    description="Backends are ordered by id. With `limit`, the cursor of the next page is returned in the "
+                "`X-Next-Cursor` header. `format=ndjson` streams one backend per line.",
+    responses={
+        200: {"content": {"application/x-ndjson": {}}},
+        304: {"description": "Backends did not change since the ETag in If-None-Match."},
+        400: {"description": "Unknown field requested."}
+    }
 )
-async def list_backends(api_key: APIKey = Depends(get_api_key)):
-    backends = await backend_service.get_backends()
-    if not backends:
-        return []
-    return backends
+async def list_backends(
+        request: Request,
+        cursor: Optional[int] = Query(None, description="Id of the last backend of the previous page."),
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of backends."),
+        fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. id,location_url."),
+        format: str = Query("json", pattern="^(json|ndjson)$", description="Response format."),
+        api_key: APIKey = Depends(get_api_key)
+):
+    include = parse_fields(fields)
+    if format == "ndjson":
+        return StreamingResponse(backends_as_ndjson(cursor, limit, include), media_type="application/x-ndjson")
+
+    async def build():
+        backends, next_cursor = await backend_service.get_backends_page(cursor, limit)
+        headers = {"X-Next-Cursor": str(next_cursor)} if next_cursor is not None else None
+        # Backends are validated already, serialize them directly instead of validating them again.
+        return [backend.model_dump(include=include) for backend in backends], headers
+
+    return await response_cache.respond(request, backend_service.generation(), build)
+
+
+@router.get(
+    "/backends/count",
+    response_model=BackendCount,
+    tags=["Backends"],
+    summary="Count backends, optionally filtered by owner, template and template version."
+)
+async def count_backends(
+        owner: Optional[str] = Query(None, description="Only count backends of this owner."),
+        template: Optional[str] = Query(None, description="Only count backends of this template."),
+        template_version: Optional[str] = Query(None, description="Only count backends of this template version."),
+        api_key: APIKey = Depends(get_api_key)
+):
+    return BackendCount(count=await backend_service.count_backends(owner, template, template_version))
+
+
+@router.get(
+    "/backends/health",
+    response_model=List[BackendHealth],
+    tags=["Backends"],
+    summary="Get the cached health of the upstreams of many backends.",
+    description="Upstreams without a result within the cache TTL are reported as unknown, unless `probe` is set."
+)
+async def get_backends_health(
+        ids: Optional[List[int]] = Query(None, description="Only return these backends, all backends if empty."),
+        probe: bool = Query(False, description="Probe upstreams without a cached result."),
+        api_key: APIKey = Depends(get_api_key)
+):
+    # Imported with the startup of the worker, not with the application
+    from ..service import health as health_service
+    return await health_service.get_backends_health(ids, probe)
 
 
 @router.post(
     "/backends",
     response_model=BackendOut,
     tags=["Backends"],
-    summary="Create a new backend."
+    summary="Create a new backend.",
+    responses={
+        500: {"description": "Backend could not be written or did not pass the OpenResty config test."}
+    }
 )
-async def create_backend(backend_in: BackendIn, api_key: APIKey = Depends(get_api_key)):
+async def create_backend(backend_in: BackendIn, api_key: APIKey = Depends(get_write_api_key)):
     if backend_in:
-        backend = await backend_service.create_backend(backend_in)
+        try:
+            backend = await backend_service.create_backend(backend_in)
+        except InternalServerError as e:
+            logger.error(e.description)
+            return JSONResponse(status_code=500, content={"error": e.description})
         return backend
     else:
         raise HTTPException(status_code=400)
 
 
+@router.post(
+    "/backends:batch",
+    response_model=List[BackendBatchResult],
+    tags=["Backends"],
+    summary="Create multiple backends with a single reload."
+)
+async def create_backends(batch: BackendBatchIn, api_key: APIKey = Depends(get_write_api_key)):
+    return await backend_service.create_backends(batch.backends)
+
+
+@router.delete(
+    "/backends:batch",
+    response_model=List[BackendBatchResult],
+    tags=["Backends"],
+    summary="Delete multiple backends with a single reload."
+)
+async def delete_backends(batch: BackendBatchDelete, api_key: APIKey = Depends(get_write_api_key)):
+    results = await backend_service.delete_backends(batch.ids)
+    for result in results:
+        if result.error is None:
+            await user_service.delete_all(result.id)
+    return results
+
+
 @router.get(
     "/backends/{backend_id}",
     response_model=BackendOut,
@@ -54,13 +162,30 @@ async def create_backend(backend_in: BackendIn, api_key: APIKey = Depends(get_ap
 )
 async def get_backend(backend_id: int, api_key: APIKey = Depends(get_api_key)):
     backend_id = int(secure_filename(str(backend_id)))
-    backends = await backend_service.get_backends()
-    if not backends:
-        raise HTTPException(status_code=404, detail="No backends found.")
-    for backend in backends:
-        if int(backend.id) == int(backend_id):
-            return backend
-    raise HTTPException(status_code=404, detail="No backend found.")
+    backend = await backend_service.get_backend(backend_id)
+    if backend is None:
+        raise HTTPException(status_code=404, detail="No backend found.")
+    return backend
+
+
+@router.get(
+    "/backends/{backend_id}/health",
+    response_model=BackendHealth,
+    tags=["Backends"],
+    summary="Get the health of the upstream of a backend.",
+    description="The upstream is probed if it was not checked within the cache TTL or `refresh` is set.",
+    responses={404: {"description": "Backend was not found."}}
+)
+async def get_backend_health(
+        backend_id: int,
+        refresh: bool = Query(False, description="Probe the upstream even if a cached result exists."),
+        api_key: APIKey = Depends(get_api_key)
+):
+    from ..service import health as health_service
+    health = await health_service.get_backend_health(backend_id, refresh)
+    if health is None:
+        raise HTTPException(status_code=404, detail="No backend found.")
+    return health
 
 
 @router.delete(
@@ -72,7 +197,7 @@ async def get_backend(backend_id: int, api_key: APIKey = Depends(get_api_key)):
         500: {"description": "Internal server error."}
     }
 )
-async def delete_backend(backend_id: int, api_key: APIKey = Depends(get_api_key)):
+async def delete_backend(backend_id: int, api_key: APIKey = Depends(get_write_api_key)):
     try:
         backend_id = int(secure_filename(str(backend_id)))
         await backend_service.delete_backend(backend_id)
@@ -92,13 +217,7 @@ async def delete_backend(backend_id: int, api_key: APIKey = Depends(get_api_key)
     summary="Get all backends by an owner."
 )
 async def get_backends_by_owner(owner: str, api_key: APIKey = Depends(get_api_key)):
-    backends = await backend_service.get_backends() # noqa
-    if not backends:
-        raise HTTPException(status_code=404, detail="No Backends found.")
-    backends_by_owner = []
-    for backend in backends:
-        if backend.owner == owner:
-            backends_by_owner.append(backend)
+    backends_by_owner = await backend_service.get_backends_by_owner(owner)
     if backends_by_owner:
         return backends_by_owner
     else:
@@ -112,14 +231,22 @@ async def get_backends_by_owner(owner: str, api_key: APIKey = Depends(get_api_ke
     summary="Get all backends by template."
 )
 async def get_backends_by_template(template: str, api_key: APIKey = Depends(get_api_key)):
-    backends = await backend_service.get_backends() # noqa
-    if not backends:
-        raise HTTPException(status_code=404, detail="No Backends found.")
-    backends_by_template = []
-    for backend in backends:
-        if backend.template == template:
-            backends_by_template.append(backend)
+    backends_by_template = await backend_service.get_backends_by_template(template)
     if backends_by_template:
         return backends_by_template
     else:
         raise HTTPException(status_code=404, detail=f"No Backends found for template {template}.")
+
+
+@router.get(
+    "/backends/byTemplate/{template}/{template_version}",
+    response_model=List[BackendOut],
+    tags=["Backends"],
+    summary="Get all backends by template and template version."
+)
+async def get_backends_by_template_version(template: str, template_version: str, api_key: APIKey = Depends(get_api_key)):
+    backends_by_template = await backend_service.get_backends_by_template(template, template_version)
+    if backends_by_template:
+        return backends_by_template
+    else:
+        raise HTTPException(status_code=404, detail=f"No Backends found for template {template} {template_version}.")
@@ -0,0 +1,66 @@
+"""
+Events view.
+"""
+import json
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, Query, Request
+from fastapi.openapi.models import APIKey
+from fastapi.responses import StreamingResponse
+
+from ..model.serializers import EventBatch
+from ..service.events import event_feed
+from ..util.auth import get_api_key
+
+router = APIRouter()
+logger = logging.getLogger("view")
+
+# Comment line sent to idle SSE connections, so proxies do not close them.
+HEARTBEAT_INTERVAL = 15.0
+
+
+async def event_stream(request: Request, last_event_id: Optional[str]):
+    if last_event_id is None:
+        last_event_id = await event_feed.current_id()
+    yield "retry: 3000\n\n"
+    while not await request.is_disconnected():
+        events = await event_feed.wait(last_event_id, HEARTBEAT_INTERVAL)
+        if not events:
+            yield ": heartbeat\n\n"
+            continue
+        for event in events:
+            yield f"id: {event.id}\nevent: {event.type}\ndata: {json.dumps(event.data)}\n\n"
+        last_event_id = events[-1].id
+
+
+@router.get(
+    "/events",
+    response_model=EventBatch,
+    tags=["Events"],
+    summary="Subscribe to backend and user changes.",
+    description="Served as Server-Sent Events if the client accepts text/event-stream, otherwise as long-poll "
+                "which answers as soon as there are events after `since` or after `timeout` seconds. "
+                "Resume with the Last-Event-ID header or `since`. A `reset` event means events were missed and "
+                "all backends and users have to be listed again.",
+    responses={200: {"content": {"text/event-stream": {}}}}
+)
+async def get_events(
+        request: Request,
+        since: Optional[str] = Query(None, description="Id of the last seen event."),
+        timeout: float = Query(30.0, ge=0, le=120, description="Seconds to wait for events when long-polling."),
+        last_event_id: Optional[str] = Header(None),
+        accept: Optional[str] = Header(None),
+        api_key: APIKey = Depends(get_api_key)
+):
+    last_event_id = last_event_id or since
+    if accept and "text/event-stream" in accept:
+        return StreamingResponse(
+            event_stream(request, last_event_id),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    if last_event_id is None:
+        last_event_id = await event_feed.current_id()
+    events = await event_feed.wait(last_event_id, timeout)
+    return EventBatch(events=events, last_id=events[-1].id if events else last_event_id)
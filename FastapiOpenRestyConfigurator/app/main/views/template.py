@@ -4,23 +4,30 @@ Template view.
 import logging
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.openapi.models import APIKey
 
 from ..model.serializers import Template
 from ..service import template as template_service
 from ..util.auth import get_api_key
+from ..util.caching import response_cache
 
 router = APIRouter()
 logger = logging.getLogger("view")
 
 
-@router.get("/templates", response_model=List[Template], tags=["Templates"])
-async def get_templates(api_key: APIKey = Depends(get_api_key)):
-    templates = await template_service.get_templates()
-    if not templates:
-        return []
-    return templates
+@router.get(
+    "/templates",
+    response_model=List[Template],
+    tags=["Templates"],
+    responses={304: {"description": "Templates did not change since the ETag in If-None-Match."}}
+)
+async def get_templates(request: Request, api_key: APIKey = Depends(get_api_key)):
+    async def build():
+        templates = await template_service.get_templates()
+        return [template.model_dump() for template in templates], None
+
+    return await response_cache.respond(request, template_service.generation(), build)
 
 
 @router.get("/templates/{template_name}", response_model=List[Template], tags=["Templates"])
@@ -3,29 +3,88 @@ User view.
 """
 import logging
 import urllib.parse
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header, Request, Response
 from fastapi.openapi.models import APIKey
 
-from ..model.serializers import User
+from ..model.serializers import User, UserList, UserMembership
 from ..service import user as user_service
-from ..util.auth import get_api_key
+from ..util.auth import get_api_key, get_write_api_key
+from ..util.caching import etag_matches, etag_of, response_cache
 
 router = APIRouter()
 logger = logging.getLogger("view")
 
 
-@router.get("/users/{backend_id}", response_model=List[User], tags=["Users"])
-async def get_users_for_backend(backend_id: str, api_key: APIKey = Depends(get_api_key)):
-    users = await user_service.get_users(backend_id)
-    if not users:
-        return []
-    return users
+@router.get(
+    "/acls",
+    tags=["Users"],
+    summary="Get the users of all backends.",
+    description="Bulk ACL snapshot for OpenResty, see examples/scripts/user_service.lua. Answers 304 if the "
+                "If-None-Match header matches the current version.",
+    responses={
+        200: {"description": "Users of all backends by backend id.", "content": {"application/json": {}}},
+        304: {"description": "Snapshot did not change."}
+    }
+)
+async def get_acls(if_none_match: Optional[str] = Header(None), api_key: APIKey = Depends(get_api_key)):
+    version, body = await user_service.get_acl_snapshot()
+    etag = etag_of(version)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
+@router.post(
+    "/users/{backend_id}:batch",
+    response_model=UserMembership,
+    tags=["Users"],
+    summary="Add multiple users to a backend."
+)
+async def add_users_to_backend(backend_id: str, users: UserList, api_key: APIKey = Depends(get_write_api_key)):
+    return await user_service.add_users(backend_id, users.users)
+
+
+@router.delete(
+    "/users/{backend_id}:batch",
+    response_model=UserMembership,
+    tags=["Users"],
+    summary="Delete multiple users from a backend."
+)
+async def delete_users_from_backend(backend_id: str, users: UserList, api_key: APIKey = Depends(get_write_api_key)):
+    return await user_service.delete_users(backend_id, [urllib.parse.unquote(user) for user in users.users])
+
+
+@router.put(
+    "/users/{backend_id}",
+    response_model=UserMembership,
+    tags=["Users"],
+    summary="Set all users of a backend.",
+    description="Adds missing and deletes surplus users, so the backend has exactly the given users afterwards."
+)
+async def set_users_of_backend(backend_id: str, users: UserList, api_key: APIKey = Depends(get_write_api_key)):
+    return await user_service.set_users(backend_id, users.users)
+
+
+@router.get(
+    "/users/{backend_id}",
+    response_model=List[User],
+    tags=["Users"],
+    responses={304: {"description": "Users did not change since the ETag in If-None-Match."}}
+)
+async def get_users_for_backend(request: Request, backend_id: str, api_key: APIKey = Depends(get_api_key)):
+    async def build():
+        users = await user_service.get_users(backend_id)
+        return [user.model_dump() for user in users], None
+
+    # The ETag has to include the changes of other worker processes
+    await user_service.sync_users()
+    return await response_cache.respond(request, user_service.user_acl.version_of(backend_id), build)
 
 
 @router.post("/users/{backend_id}", response_model=User, tags=["Users"])
-async def add_user_to_backend(backend_id: str, new_user: User, api_key: APIKey = Depends(get_api_key)):
+async def add_user_to_backend(backend_id: str, new_user: User, api_key: APIKey = Depends(get_write_api_key)):
     res = await user_service.add_user(backend_id, new_user.user)
     if res != 0:
         raise HTTPException(status_code=500, detail=f"Could not add {new_user} to {backend_id}.")
@@ -34,7 +93,7 @@ async def add_user_to_backend(backend_id: str, new_user: User, api_key: APIKey =
 
 
 @router.delete("/users/{backend_id}", tags=["Users"])
-async def delete_user_from_backend(backend_id: str, user: User, api_key: APIKey = Depends(get_api_key)):
+async def delete_user_from_backend(backend_id: str, user: User, api_key: APIKey = Depends(get_write_api_key)):
     user.user = urllib.parse.unquote(user.user)
     await user_service.delete_user(backend_id, user.user)
     return {"message": f"User {user} deleted from {backend_id}."}
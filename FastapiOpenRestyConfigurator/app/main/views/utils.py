@@ -3,9 +3,19 @@ Util view.
 """
 import logging
 
-from fastapi import APIRouter
+from typing import Optional
 
-from ..model.serializers import Util
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.openapi.models import APIKey
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from ..model.serializers import Util, ReloadStats, ExecutorStats, RoutingStats, Readiness, GcReport
+from ..service.openresty import reload_coordinator
+from ..service.routing import route_publisher
+from ..util.auth import get_api_key, get_write_api_key
+from ..util.executor import io_executor
+from ..util.metrics import metrics
+from ..util.startup import startup
 from ..config import get_settings
 
 router = APIRouter()
@@ -16,3 +26,67 @@ settings = get_settings()
 @router.get("/utils", response_model=Util, tags=["Miscellanous"])
 async def get_version():
     return Util(version=settings.FORC_VERSION)
+
+
+@router.get(
+    "/utils/ready",
+    response_model=Readiness,
+    tags=["Miscellanous"],
+    summary="Check whether this worker has built its indexes and caches.",
+    responses={503: {"model": Readiness, "description": "Worker is starting or shutting down."}}
+)
+async def get_readiness():
+    readiness = startup.readiness()
+    return JSONResponse(status_code=200 if readiness.ready else 503, content=readiness.model_dump())
+
+
+@router.get("/utils/reload", response_model=ReloadStats, tags=["Miscellanous"])
+async def get_reload_stats(api_key: APIKey = Depends(get_api_key)):
+    return reload_coordinator.stats()
+
+
+@router.get("/utils/routing", response_model=RoutingStats, tags=["Miscellanous"])
+async def get_routing_stats(api_key: APIKey = Depends(get_api_key)):
+    return route_publisher.stats()
+
+
+@router.get("/utils/executor", response_model=ExecutorStats, tags=["Miscellanous"])
+async def get_executor_stats(api_key: APIKey = Depends(get_api_key)):
+    return io_executor.stats()
+
+
+@router.get(
+    "/utils/gc",
+    response_model=GcReport,
+    tags=["Miscellanous"],
+    summary="Get the report of the last garbage collection run.",
+    responses={404: {"description": "Garbage collection did not run yet."}}
+)
+async def get_gc_report(api_key: APIKey = Depends(get_api_key)):
+    # Imported with the startup of the worker, not with the application
+    from ..service import reconciler as reconciler_service
+    report = await reconciler_service.get_gc_report()
+    if report is None:
+        raise HTTPException(status_code=404, detail="Garbage collection did not run yet.")
+    return report
+
+
+@router.post(
+    "/utils/gc",
+    response_model=GcReport,
+    tags=["Miscellanous"],
+    summary="Run garbage collection now.",
+    description="Checks the next batches of the current sweep within the time budget. The configured mode decides "
+                "whether findings are quarantined or removed, `dry_run` can only make a run report them instead."
+)
+async def run_gc(
+        dry_run: Optional[bool] = Query(None, description="Only report findings, whatever the mode."),
+        api_key: APIKey = Depends(get_write_api_key)
+):
+    from ..service import reconciler as reconciler_service
+    return await reconciler_service.collect_garbage(dry_run)
+
+
+@router.get("/metrics", response_class=PlainTextResponse, tags=["Miscellanous"])
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,254 @@
+"""
+Benchmark for the backend, user and template endpoints on synthetic backend paths.
+
+Generates a backend path with the requested number of backend files and user directories, rendered from the
+templates in examples/templates, and drives the FastAPI app in-process. OpenResty is never reloaded or tested, the
+reload and config test commands are replaced by `true`.
+Every size runs in its own process, because the settings are read once on import.
+
+Usage (from FastapiOpenRestyConfigurator):
+    python benchmarks/bench_api.py --sizes 10000,50000,100000 --iterations 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_DIR = os.path.join(os.path.dirname(BASE_DIR), "examples", "templates")
+API_KEY = "benchmark"
+OWNER_COUNT = 1000
+BACKENDS_PER_KEY_URL = 900
+USERS_PER_BACKEND = 3
+
+
+def owner_name(number: int) -> str:
+    return f"{number:030d}@elixir-europe.org"
+
+
+def generate_tree(root: str, size: int, user_ratio: float):
+    """
+    Generate backend and template paths with `size` backends, a share of them having user directories.
+    """
+    import jinja2
+
+    backend_path = os.path.join(root, "backends")
+    template_path = os.path.join(root, "templates")
+    user_path = os.path.join(backend_path, "users")
+    os.makedirs(user_path)
+    shutil.copytree(TEMPLATE_DIR, template_path)
+
+    environment = jinja2.Environment(loader=jinja2.FileSystemLoader(template_path), autoescape=True)
+    templates = sorted(file_name[:-len(".conf")] for file_name in os.listdir(template_path))
+    compiled = {name: environment.get_template(f"{name}.conf") for name in templates}
+    random_generator = random.Random(size)
+
+    for index in range(size):
+        backend_id = 1000000000 + index
+        owner = owner_name(index % OWNER_COUNT)
+        key_url = f"bench{index // BACKENDS_PER_KEY_URL}_{100 + index % BACKENDS_PER_KEY_URL}"
+        template = templates[index % len(templates)]
+        upstream_url = f"http://10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}:8787"
+        content = compiled[template].render(
+            key_url=key_url,
+            owner=owner,
+            backend_id=backend_id,
+            forc_backend_path=backend_path,
+            location_url=upstream_url
+        )
+        with open(os.path.join(backend_path, f"{backend_id}%{owner}%{key_url}%{template}.conf"), 'w') as file:
+            file.write(content)
+        if random_generator.random() < user_ratio:
+            os.mkdir(os.path.join(user_path, str(backend_id)))
+            for user in range(USERS_PER_BACKEND):
+                open(os.path.join(user_path, str(backend_id), f"user{user}@elixir-europe.org"), 'w').close()
+    return backend_path, template_path
+
+
+async def call(app, method: str, path: str, body=None):
+    """
+    Send a single request to an ASGI app and return status and body.
+    """
+    path, _, query_string = path.partition("?")
+    payload = json.dumps(body).encode() if body is not None else b""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query_string.encode(),
+        "root_path": "",
+        "headers": [
+            (b"host", b"benchmark"),
+            (b"x-api-key", API_KEY.encode()),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode()),
+        ],
+        "client": ("127.0.0.1", 1),
+        "server": ("benchmark", 80),
+    }
+    messages = [{"type": "http.request", "body": payload, "more_body": False}]
+    response = {"status": None, "body": b""}
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response["status"], response["body"]
+
+
+async def measure(name: str, app, requests, results: dict):
+    """
+    Send the given (method, path, body) requests sequentially and record their latencies.
+    """
+    latencies = []
+    started = time.perf_counter()
+    for method, path, body in requests:
+        request_started = time.perf_counter()
+        status, content = await call(app, method, path, body)
+        latencies.append(time.perf_counter() - request_started)
+        if status >= 500:
+            raise RuntimeError(f"{name}: {method} {path} failed with {status}: {content[:200]}")
+    duration = time.perf_counter() - started
+    latencies.sort()
+    results[name] = {
+        "requests": len(latencies),
+        "throughput": len(latencies) / duration if duration else 0.0,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+
+async def run_benchmark(size: int, iterations: int, backend_path: str) -> dict:
+    sys.path.insert(0, BASE_DIR)
+    from main import app
+    from app.main.service import backend as backend_service
+
+    results = {}
+    random_generator = random.Random(iterations)
+    backend_ids = [1000000000 + index for index in range(size)]
+    list_iterations = max(3, iterations // 20)
+
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        results["startup"] = {"requests": 1, "throughput": 0.0, "p50_ms": (time.perf_counter() - started) * 1000,
+                              "p99_ms": (time.perf_counter() - started) * 1000}
+        await measure("list", app, [("GET", "/backends", None)] * list_iterations, results)
+        await measure("get_by_id", app, [
+            ("GET", f"/backends/{random_generator.choice(backend_ids)}", None) for _ in range(iterations)
+        ], results)
+        await measure("by_owner", app, [
+            ("GET", f"/backends/byOwner/{owner_name(random_generator.randrange(OWNER_COUNT))}", None)
+            for _ in range(iterations)
+        ], results)
+        await measure("templates", app, [("GET", "/templates", None)] * iterations, results)
+
+        created = []
+        create_requests = [
+            ("POST", "/backends", {
+                "owner": owner_name(random_generator.randrange(OWNER_COUNT)),
+                "template": "rstudio",
+                "template_version": "v04",
+                "user_key_url": f"created{index % 50}",
+                "upstream_url": f"http://192.168.{index // 256 % 256}.{index % 256}:8787",
+            }) for index in range(iterations)
+        ]
+        await measure("create", app, create_requests, results)
+        for backend in await backend_service.get_backends():
+            if backend.location_url.startswith("created"):
+                created.append(backend.id)
+
+        user_ids = [(random_generator.choice(created), f"member{index}@elixir-europe.org") for index in range(iterations)]
+        await measure("user_add", app, [
+            ("POST", f"/users/{backend_id}", {"user": user}) for backend_id, user in user_ids
+        ], results)
+        await measure("user_remove", app, [
+            ("DELETE", f"/users/{backend_id}", {"user": user}) for backend_id, user in user_ids
+        ], results)
+        await measure("delete", app, [("DELETE", f"/backends/{backend_id}", None) for backend_id in created], results)
+    return results
+
+
+def run_single(size: int, iterations: int, user_ratio: float, keep: bool) -> dict:
+    root = tempfile.mkdtemp(prefix=f"forc_bench_{size}_")
+    try:
+        generated = time.perf_counter()
+        backend_path, template_path = generate_tree(root, size, user_ratio)
+        print(f"Generated {size} backends in {time.perf_counter() - generated:.1f}s at {root}", file=sys.stderr)
+        os.environ.update({
+            "FORC_API_KEY": API_KEY,
+            # Measure the endpoints, not the rate limiter
+            "FORC_API_KEY_RATE_LIMIT": "0",
+            # Never reload or test a real OpenResty, only measure FORC and the overhead of running the commands
+            "FORC_RELOAD_COMMAND": "true",
+            "FORC_VALIDATE_COMMAND": "true",
+            "FORC_BACKEND_PATH": backend_path,
+            "FORC_TEMPLATE_PATH": template_path,
+            "FORC_TEMPLATE_CACHE_PATH": os.path.join(root, "template_cache"),
+            "LOG_LEVEL": "WARNING",
+        })
+        os.makedirs(os.environ["FORC_TEMPLATE_CACHE_PATH"])
+        os.chdir(BASE_DIR)
+        return asyncio.run(run_benchmark(size, iterations, backend_path))
+    finally:
+        if not keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def print_table(all_results: dict):
+    print(f"{'size':>8} {'operation':<12} {'requests':>8} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for size, results in all_results.items():
+        for operation, result in results.items():
+            print(f"{size:>8} {operation:<12} {result['requests']:>8} {result['throughput']:>10.1f} "
+                  f"{result['p50_ms']:>10.2f} {result['p99_ms']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,50000,100000", help="Comma separated numbers of backends.")
+    parser.add_argument("--iterations", type=int, default=200, help="Requests per operation.")
+    parser.add_argument("--user-ratio", type=float, default=0.1, help="Share of backends with user directories.")
+    parser.add_argument("--json", dest="json_file", help="Also write the results as JSON to this file.")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated directories.")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        print(json.dumps(run_single(args.single, args.iterations, args.user_ratio, args.keep)))
+        return
+
+    all_results = {}
+    for size in (int(size) for size in args.sizes.split(",")):
+        command = [sys.executable, os.path.abspath(__file__), "--single", str(size),
+                   "--iterations", str(args.iterations), "--user-ratio", str(args.user_ratio)]
+        if args.keep:
+            command.append("--keep")
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+        all_results[size] = json.loads(output.strip().splitlines()[-1])
+
+    print_table(all_results)
+    if args.json_file:
+        with open(args.json_file, 'w') as json_file:
+            json.dump(all_results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Measures the import time of the application in fresh interpreters and checks it against a budget.
+
+Every run imports main in a new process, like a new worker without preloading. The slowest modules of the last run
+are listed from python -X importtime. Exits with 1 if the median exceeds the budget, so it can be used in CI.
+
+Usage (from FastapiOpenRestyConfigurator, with the FORC_* environment of the application):
+    python benchmarks/import_time.py --runs 5 --budget 1.5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure() -> (float, str):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main; print(main.startup.import_time)"],
+        cwd=BASE_DIR, capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_modules(importtime_output: str, count: int):
+    modules = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((int(cumulative), name.strip(), len(name) - len(name.lstrip())))
+    # Only the direct imports of main, their cumulative times do not overlap. They are listed right before main.
+    main_index = max(index for index, module in enumerate(modules) if module[1] == "main")
+    main_indent = modules[main_index][2]
+    direct = []
+    for module in reversed(modules[:main_index]):
+        if module[2] <= main_indent:
+            break
+        if module[2] == main_indent + 2:
+            direct.append(module)
+    return sorted(direct, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=float(os.environ.get("FORC_IMPORT_TIME_BUDGET", 1.5)))
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest modules to list.")
+    args = parser.parse_args()
+
+    times = []
+    output = ""
+    for _ in range(args.runs):
+        import_time, output = measure()
+        times.append(import_time)
+    median = statistics.median(times)
+    print(f"import main: median {median:.3f}s, min {min(times):.3f}s, max {max(times):.3f}s, budget {args.budget}s")
+    for cumulative, name, _ in slowest_modules(output, args.top):
+        print(f"  {cumulative / 1e6:.3f}s  {name}")
+    return 0 if median <= args.budget else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
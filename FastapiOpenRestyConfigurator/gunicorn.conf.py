@@ -0,0 +1,27 @@
+"""
+Gunicorn config to run FORC with several worker processes:
+    gunicorn -c gunicorn.conf.py main:app
+
+FORC_BIND, FORC_WORKERS, FORC_ERROR_LOG and FORC_SOCKET_MODE set the address, the number of worker processes, the
+log file of gunicorn and the permissions of a unix socket. A unix socket is removed by gunicorn on shutdown.
+
+The application is imported and warmed up once in the master process. Workers are forked from it and share the
+imported modules and the backend registry copy-on-write, so a new or recycled worker only applies backend changes
+since the warm-up and is ready quickly, see GET /utils/ready.
+"""
+import os
+
+bind = os.environ.get("FORC_BIND", "127.0.0.1:5000")
+workers = int(os.environ.get("FORC_WORKERS", "4"))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+errorlog = os.environ.get("FORC_ERROR_LOG", "-")
+# Permissions of a unix socket in FORC_BIND, so OpenResty workers of another user may connect
+socket_mode = int(os.environ.get("FORC_SOCKET_MODE", "776"), 8)
+
+
+def when_ready(server):
+    if bind.startswith("unix:"):
+        os.chmod(bind[len("unix:"):], socket_mode)
+    from main import warm_up
+    warm_up()
@@ -0,0 +1,30 @@
+"""
+Rebuild the metadata store from the backend and user files.
+
+Reads the settings like the application, FORC_METADATA_DB has to be set. Safe to run while FORC is running,
+the store is replaced in a single transaction.
+
+Usage (from FastapiOpenRestyConfigurator):
+    python import_metadata.py
+"""
+import sys
+from logging.config import dictConfig
+
+from app.main.config import get_settings
+from app.main.service.metadata import metadata_store
+from app.main.util.logging import log_config
+
+
+def main() -> int:
+    dictConfig(log_config)
+    settings = get_settings()
+    if metadata_store is None:
+        print("FORC_METADATA_DB is not set, there is no metadata store to import into.", file=sys.stderr)
+        return 1
+    count = metadata_store.import_path(settings.FORC_BACKEND_PATH, settings.FORC_USER_PATH)
+    print(f"Imported {count} backends into {metadata_store.db_path}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,122 @@
+import time
+
+# Measured before any other import, so the import time budget covers the whole application.
+IMPORT_STARTED = time.perf_counter()
+
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from logging.config import dictConfig
 
 from app.main.model.serializers import tags_metadata
+from app.main.service.events import event_feed
+from app.main.service.metadata import init_metadata_store
+from app.main.service.openresty import reload_coordinator
+from app.main.service.registry import backend_lock, backend_registry
+from app.main.service.routing import dynamic_routing, route_publisher
+from app.main.service.transaction import recover_transactions
+from app.main.service.user import user_acl
+from app.main.util.auth import load_api_keys
+from app.main.util.executor import io_executor
 from app.main.util.logging import log_config
+from app.main.util.metrics import MetricsMiddleware
+from app.main.util.startup import startup
+from app.main.util.templating import template_cache
 from app.main.views.backend import router as backend_router
+from app.main.views.events import router as events_router
 from app.main.views.template import router as template_router
 from app.main.views.user import router as user_router
 from app.main.views.utils import router as util_router
 
 # Apply logging config
 dictConfig(log_config)
+startup.record_import(IMPORT_STARTED)
+
+
+def import_deferred():
+    """
+    Import the modules which are only needed once the worker starts, they are left out of the import of main, so
+    tools importing the application do not pay for them.
+    """
+    from app.main.service import health, reconciler
+    return health.health_checker, reconciler.reconciler
+
+
+def warm_up():
+    """
+    Build the backend registry and the template bytecode cache before workers are forked, so every worker inherits
+    them copy-on-write instead of building them again. Called in the gunicorn master process with preload_app,
+    so it must not start threads.
+    """
+    with startup.phase("imports"):
+        import_deferred()
+        load_api_keys()
+    with startup.phase("recover"):
+        with backend_lock:
+            recover_transactions()
+    with startup.phase("backends"):
+        backend_registry.rebuild()
+    with startup.phase("templates"):
+        template_cache.rebuild()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Already done by the warm-up if preloaded
+    with startup.phase("imports"):
+        health_checker, reconciler = import_deferred()
+        load_api_keys()
+    # Complete backend changes which were interrupted by a crash, not the changes of a running worker process
+    with startup.phase("recover"):
+        with backend_lock:
+            recover_transactions()
+    # Build the backend registry once and keep it in sync with the backend path, only changes if preloaded
+    with startup.phase("backends"):
+        backend_registry.start()
+    # Load the users of all backends, which OpenResty pulls as ACL snapshot
+    with startup.phase("users"):
+        user_acl.start()
+    # Fill an empty metadata store from the backend and user files, or repair changes made while FORC was down
+    with startup.phase("metadata"):
+        init_metadata_store(user_acl.all())
+    # Compile all templates, so the first backend creation does not pay for it
+    with startup.phase("templates"):
+        template_cache.start()
+    # Elect the worker process which runs the OpenResty reloads of all workers
+    reload_coordinator.start()
+    # Read the change events of all workers for subscribers
+    event_feed.start()
+    # Push all routes to OpenResty and keep them in sync with dynamic routing
+    if dynamic_routing():
+        route_publisher.start()
+    # Probe the upstreams of all backends, only in the reload leader
+    health_checker.start()
+    # Collect orphaned and malformed files in the backend and user path, only in the reload leader
+    reconciler.start()
+    startup.mark_ready()
+    yield
+    # Report not ready while shutting down, so no new requests are sent to this worker
+    startup.ready = False
+    await reconciler.stop()
+    await health_checker.stop()
+    await route_publisher.stop()
+    await event_feed.stop()
+    await reload_coordinator.stop()
+    template_cache.stop()
+    user_acl.stop()
+    backend_registry.stop()
+    io_executor.shutdown()
 
 
 # Apply tags metadata for openapi and create app
-app = FastAPI(openapi_tags=tags_metadata)
+app = FastAPI(openapi_tags=tags_metadata, lifespan=lifespan)
+
+# Record request durations per route
+app.add_middleware(MetricsMiddleware)
 
 # Apply routes
 app.include_router(backend_router)
 app.include_router(template_router)
 app.include_router(user_router)
+app.include_router(events_router)
 app.include_router(util_router)
@@ -0,0 +1,82 @@
+"""
+Shared setup of the tests.
+Settings are read once on import, so the environment points to temporary paths and a stub of the openresty binary
+before the application is imported, and all tests share one application instance.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_DIR = os.path.join(os.path.dirname(BASE_DIR), "examples", "templates")
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "openresty_stub.sh")
+API_KEY = "test"
+OWNER = "0123456789abcdef0123456789abcd@elixir-europe.org"
+
+ROOT = tempfile.mkdtemp(prefix="forc_test_")
+STUB_DIR = os.path.join(ROOT, "stub")
+os.makedirs(os.path.join(ROOT, "backends", "users"))
+os.makedirs(STUB_DIR)
+os.makedirs(os.path.join(ROOT, "template_cache"))
+shutil.copytree(TEMPLATE_DIR, os.path.join(ROOT, "templates"))
+os.environ.update({
+    "FORC_API_KEY": API_KEY,
+    "FORC_BACKEND_PATH": os.path.join(ROOT, "backends"),
+    "FORC_TEMPLATE_PATH": os.path.join(ROOT, "templates"),
+    "FORC_TEMPLATE_CACHE_PATH": os.path.join(ROOT, "template_cache"),
+    "FORC_RELOAD_COMMAND": f"sh {STUB} -s reload",
+    "FORC_RELOAD_WINDOW": "0.01",
+    "FORC_VALIDATE_COMMAND": f"sh {STUB} -t",
+    "FORC_TEST_STUB_DIR": STUB_DIR,
+    "FORC_LOG_FILE": "",
+    "FORC_HEALTH_CHECK_INTERVAL": "0",
+    "FORC_GC_INTERVAL": "0",
+})
+sys.path.insert(0, BASE_DIR)
+
+
+class OpenRestyStub:
+    """
+    Controls the exit code of the stubbed openresty binary and reads its calls.
+    """
+
+    def set_exit_code(self, exit_code: int):
+        with open(os.path.join(STUB_DIR, "exit_code"), 'w') as exit_code_file:
+            exit_code_file.write(str(exit_code))
+
+    def calls(self, argument: str) -> int:
+        try:
+            with open(os.path.join(STUB_DIR, "calls"), 'r') as calls_file:
+                return sum(1 for line in calls_file if line.split() == argument.split())
+        except FileNotFoundError:
+            return 0
+
+
+@pytest.fixture
+def openresty():
+    stub = OpenRestyStub()
+    stub.set_exit_code(0)
+    yield stub
+    stub.set_exit_code(0)
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from main import app
+    with TestClient(app, headers={"X-API-KEY": API_KEY}) as test_client:
+        yield test_client
+    shutil.rmtree(ROOT, ignore_errors=True)
+
+
+def backend_payload(user_key_url: str, upstream_url: str, template: str = "rstudio", version: str = "v04") -> dict:
+    return {
+        "owner": OWNER,
+        "template": template,
+        "template_version": version,
+        "user_key_url": user_key_url,
+        "upstream_url": upstream_url,
+    }
@@ -0,0 +1,7 @@
+#!/bin/sh
+# Stub of the openresty binary for the tests: records the call and exits with the code configured by the test.
+echo "$*" >> "$FORC_TEST_STUB_DIR/calls"
+if [ -f "$FORC_TEST_STUB_DIR/exit_code" ]; then
+    exit "$(cat "$FORC_TEST_STUB_DIR/exit_code")"
+fi
+exit 0
@@ -0,0 +1,30 @@
+from conftest import backend_payload
+from app.main.service.registry import LocationSuffixes
+
+
+def test_lowest_free_suffix_skips_used_and_reserved():
+    suffixes = LocationSuffixes(first=100)
+    for suffix in (100, 101, 102, 104):
+        suffixes.add(suffix)
+    assert suffixes.lowest_free(set()) == 103
+    assert suffixes.lowest_free({103}) == 105
+    suffixes.add(103)
+    suffixes.remove(101)
+    assert suffixes.lowest_free({105}) == 101
+    # A released reservation is handed out again
+    assert suffixes.lowest_free(set()) == 101
+    suffixes.add(101)
+    assert suffixes.lowest_free(set()) == 105
+
+
+def test_suffixes_of_deleted_backends_are_reused(client, openresty):
+    ids = [client.post("/backends", json=backend_payload("suffixes", f"http://10.0.6.{i}:8787")).json()["id"]
+           for i in range(1, 4)]
+    assert client.get(f"/backends/{ids[0]}").json()["location_url"] == "suffixes_100"
+    assert client.get(f"/backends/{ids[2]}").json()["location_url"] == "suffixes_102"
+
+    assert client.delete(f"/backends/{ids[1]}").status_code == 200
+    created = client.post("/backends", json=backend_payload("suffixes", "http://10.0.6.4:8787")).json()
+    assert created["location_url"] == "suffixes_101"
+    created = client.post("/backends", json=backend_payload("suffixes", "http://10.0.6.5:8787")).json()
+    assert created["location_url"] == "suffixes_103"
@@ -0,0 +1,14 @@
+from conftest import API_KEY
+from app.main.util.auth import Principal, SCOPE_READ, digest_of
+
+
+def test_default_key_is_not_rate_limited(client):
+    # More requests at once than the default burst of keys with a rate limit
+    statuses = {client.get("/templates").status_code for _ in range(150)}
+    assert statuses == {200}
+
+
+def test_keys_with_a_rate_are_limited():
+    principal = Principal("monitoring", digest_of(API_KEY), [SCOPE_READ], rate=1, burst=2)
+    bucket = principal.buckets[SCOPE_READ]
+    assert [bucket.take() == 0 for _ in range(3)] == [True, True, False]
@@ -0,0 +1,60 @@
+import json
+
+from conftest import backend_payload
+
+
+def test_cursor_pages_continue_without_gaps(client, openresty):
+    for i in range(1, 6):
+        assert client.post("/backends", json=backend_payload("paging", f"http://10.0.8.{i}:8787")).status_code == 200
+    all_ids = [backend["id"] for backend in client.get("/backends").json()]
+    assert all_ids == sorted(all_ids)
+
+    ids, cursor = [], None
+    while True:
+        params = {"limit": 2}
+        if cursor is not None:
+            params["cursor"] = cursor
+        page = client.get("/backends", params=params)
+        assert len(page.json()) <= 2
+        ids.extend(backend["id"] for backend in page.json())
+        cursor = page.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        assert int(cursor) == ids[-1]
+    assert ids == all_ids
+
+
+def test_fields_and_ndjson(client, openresty):
+    assert client.post("/backends", json=backend_payload("fields", "http://10.0.8.10:8787")).status_code == 200
+    backends = client.get("/backends", params={"fields": "id,location_url"}).json()
+    assert backends and all(set(backend) == {"id", "location_url"} for backend in backends)
+
+    response = client.get("/backends", params={"fields": "id,password"})
+    assert response.status_code == 400
+    assert "password" in response.json()["detail"]
+
+    response = client.get("/backends", params={"format": "ndjson", "fields": "id"})
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [{"id": backend["id"]} for backend in backends]
+
+
+def test_batch_reports_duplicate_upstreams_per_item(client, openresty):
+    reloads = openresty.calls("-s reload")
+    results = client.post("/backends:batch", json={"backends": [
+        backend_payload("batchone", "http://10.0.9.1:8787"),
+        backend_payload("batchtwo", "http://10.0.9.1:8787"),
+        backend_payload("batchthree", "http://10.0.9.2:8787"),
+    ]}).json()
+    assert [result["index"] for result in results] == [0, 1, 2]
+    assert results[0]["error"] is None and results[2]["error"] is None
+    assert "item 0" in results[1]["error"]
+    assert results[1]["id"] is None
+    assert openresty.calls("-s reload") == reloads + 1
+
+    ids = [results[0]["id"], results[2]["id"]]
+    reloads = openresty.calls("-s reload")
+    results = client.request("DELETE", "/backends:batch", json={"ids": ids + [1]}).json()
+    assert [result["error"] is None for result in results] == [True, True, False]
+    assert openresty.calls("-s reload") == reloads + 1
+    assert all(client.get(f"/backends/{backend_id}").status_code == 404 for backend_id in ids)
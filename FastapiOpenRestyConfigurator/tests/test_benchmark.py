@@ -0,0 +1,19 @@
+import json
+import os
+import subprocess
+import sys
+
+from conftest import BASE_DIR
+
+
+def test_benchmark_runs_on_a_small_backend_path(tmp_path):
+    json_file = tmp_path / "bench.json"
+    environment = {key: value for key, value in os.environ.items() if not key.startswith("FORC_")}
+    subprocess.run(
+        [sys.executable, os.path.join("benchmarks", "bench_api.py"), "--sizes", "100", "--iterations", "5",
+         "--json", str(json_file)],
+        cwd=BASE_DIR, env=environment, check=True, timeout=300, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    results = json.loads(json_file.read_text())["100"]
+    for operation in ("list", "get_by_id", "by_owner", "templates", "create", "user_add", "user_remove", "delete"):
+        assert results[operation]["requests"] > 0
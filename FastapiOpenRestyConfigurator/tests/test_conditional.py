@@ -0,0 +1,44 @@
+import os
+
+from conftest import ROOT, backend_payload
+from app.main.service.registry import BackendRegistry
+from app.main.service.user import UserAcl
+
+BACKEND_PATH = os.path.join(ROOT, "backends")
+STATE_PATH = os.path.join(BACKEND_PATH, ".forc")
+
+
+def test_etags_are_equal_in_all_workers(client, openresty):
+    assert client.post("/backends", json=backend_payload("etag", "http://10.0.3.1:8787")).status_code == 200
+    assert client.post("/users/7101", json={"user": "alice"}).status_code == 200
+
+    # Fresh instances on the same paths stand in for other worker processes.
+    other_registry = BackendRegistry(BACKEND_PATH, STATE_PATH)
+    try:
+        content_hash = other_registry.content_hash()
+    finally:
+        other_registry.stop()
+    backends = client.get("/backends")
+    assert backends.headers["ETag"] == f'"{content_hash}"'
+    assert client.get("/backends", headers={"If-None-Match": backends.headers["ETag"]}).status_code == 304
+
+    other_acl = UserAcl(os.path.join(BACKEND_PATH, "users"), STATE_PATH, resync_interval=0)
+    other_acl.rebuild()
+    acls = client.get("/acls")
+    assert acls.headers["ETag"] == f'"{other_acl.version}"'
+    assert client.get("/users/7101").headers["ETag"] == f'"{other_acl.version_of(7101)}"'
+    assert client.get("/acls", headers={"If-None-Match": acls.headers["ETag"]}).status_code == 304
+
+
+def test_user_etags_are_per_backend(client, openresty):
+    assert client.post("/users/7201", json={"user": "alice"}).status_code == 200
+    etag = client.get("/users/7201").headers["ETag"]
+
+    # Changes of other backends keep the response of this backend valid
+    assert client.post("/users/7202", json={"user": "bob"}).status_code == 200
+    assert client.get("/users/7201", headers={"If-None-Match": etag}).status_code == 304
+
+    assert client.post("/users/7201", json={"user": "bob"}).status_code == 200
+    response = client.get("/users/7201", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert sorted(user["user"] for user in response.json()) == ["alice", "bob"]
@@ -0,0 +1,42 @@
+import os
+import time
+
+from conftest import ROOT, backend_payload
+from app.main.service.events import BACKEND_CREATED, RESET, USERS_CHANGED, EventFeed
+
+STATE_PATH = os.path.join(ROOT, "backends", ".forc")
+
+
+def test_events_of_other_workers_are_delivered(client, openresty):
+    # A second feed on the same journal stands in for another worker process.
+    other_worker = EventFeed(STATE_PATH, size=100, poll_interval=0.05)
+    since = client.get("/events", params={"timeout": 0}).json()["last_id"]
+    other_worker.publish([(USERS_CHANGED, {"backend_id": "7201", "users": ["alice"]})])
+
+    batch = client.get("/events", params={"since": since, "timeout": 1}).json()
+    assert [(event["type"], event["data"]["backend_id"]) for event in batch["events"]] == [(USERS_CHANGED, "7201")]
+    # Ids are positions in the shared journal, so a subscriber may resume from any worker.
+    other_worker.sync()
+    assert other_worker.last_id == batch["last_id"]
+
+    assert client.post("/backends", json=backend_payload("events", "http://10.0.4.1:8787")).status_code == 200
+    other_worker.sync()
+    assert [event.type for event in other_worker.since(batch["last_id"])] == [BACKEND_CREATED]
+    assert [event.type for event in other_worker.since("0-1")] == [RESET]
+
+
+def test_detected_changes_are_published_once(tmp_path):
+    leader = EventFeed(str(tmp_path), size=100, poll_interval=0.05, detection_grace=0.05)
+    other_worker = EventFeed(str(tmp_path), size=100, poll_interval=0.05)
+    published = {"backend_id": "1", "users": ["alice"]}
+    external = {"backend_id": "2", "users": ["bob"]}
+    leader.detected(USERS_CHANGED, published)
+    leader.detected(USERS_CHANGED, external)
+    other_worker.publish([(USERS_CHANGED, published)])
+    time.sleep(0.1)
+    leader.sync()
+    leader.publish_due()
+
+    other_worker.sync()
+    epoch = other_worker.last_id.rpartition("-")[0]
+    assert [event.data for event in other_worker.since(f"{epoch}-0")] == [published, external]
@@ -0,0 +1,74 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.main.service.health import STATUS_DOWN, STATUS_UP, HealthChecker
+
+
+def upstream(status: int, delay: float = 0.0):
+    class Handler(BaseHTTPRequestHandler):
+        def do_HEAD(self):
+            time.sleep(delay)
+            self.send_response(status)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def checker(tmp_path):
+    return HealthChecker(str(tmp_path), interval=0, timeout=0.5, concurrency=4, ttl=60)
+
+
+def probe(checker: HealthChecker, server: ThreadingHTTPServer):
+    return asyncio.run(checker.probe(f"http://127.0.0.1:{server.server_address[1]}"))
+
+
+def test_upstream_answering_is_up(checker):
+    server = upstream(302)
+    try:
+        check = probe(checker, server)
+    finally:
+        server.shutdown()
+    assert (check.status, check.status_code, check.error) == (STATUS_UP, 302, None)
+
+
+def test_upstream_failing_is_down(checker):
+    server = upstream(503)
+    try:
+        check = probe(checker, server)
+    finally:
+        server.shutdown()
+    assert (check.status, check.status_code, check.error) == (STATUS_DOWN, 503, "HTTP status 503")
+
+
+def test_upstream_not_answering_in_time_is_down(checker):
+    server = upstream(200, delay=2)
+    try:
+        check = probe(checker, server)
+    finally:
+        server.shutdown()
+    assert (check.status, check.status_code) == (STATUS_DOWN, None)
+    assert check.latency < 1.5
+
+
+def test_results_expire_after_the_ttl(tmp_path):
+    checker = HealthChecker(str(tmp_path), interval=0, timeout=0.5, concurrency=4, ttl=0.2)
+    server = upstream(200)
+    upstream_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        probe(checker, server)
+        assert checker.cached(upstream_url).status == STATUS_UP
+        time.sleep(0.3)
+        assert checker.cached(upstream_url) is None
+    finally:
+        server.shutdown()
@@ -0,0 +1,60 @@
+import asyncio
+
+from app.main.util.locking import FileLock, SharedCounter, SharedJournal
+
+
+def test_cancelled_waiter_does_not_keep_the_lock(tmp_path):
+    path = str(tmp_path / "test.lock")
+    holder = FileLock(path)
+    waiter = FileLock(path)
+    holder.acquire()
+
+    async def cancel_waiting_holder():
+        async def hold():
+            async with waiter.hold():
+                pass
+
+        task = asyncio.ensure_future(hold())
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        holder.release()
+        # The executor thread acquires the lock now and the lock is released again right after.
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if not waiter.locked:
+                break
+
+    asyncio.run(cancel_waiting_holder())
+    assert not waiter.locked
+    assert holder.acquire(blocking=False)
+    holder.release()
+
+
+def test_shared_counter_increments_across_instances(tmp_path):
+    path = str(tmp_path / "counter")
+    assert SharedCounter(path).increment() == 1
+    assert SharedCounter(path).increment() == 2
+    assert SharedCounter(path).value() == 2
+
+
+def test_shared_journal_reads_lines_of_other_instances(tmp_path):
+    path = str(tmp_path / "journal")
+    reader = SharedJournal(path)
+    reader.skip()
+    SharedJournal(path).append(["1", "2"])
+    assert reader.read() == ["1", "2"]
+    assert reader.read() == []
+
+
+def test_shared_journal_reports_missed_lines_after_replacement(tmp_path):
+    path = str(tmp_path / "journal")
+    writer = SharedJournal(path, max_size=64)
+    reader = SharedJournal(path)
+    writer.append(["1", "2"])
+    reader.skip()
+    epoch = reader.epoch
+    writer.append(["3" * 60])
+    assert reader.read() is None
+    assert reader.read() == ["3" * 60]
+    assert reader.epoch != epoch
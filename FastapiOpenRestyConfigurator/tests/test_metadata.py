@@ -0,0 +1,65 @@
+import os
+import shutil
+
+from conftest import backend_payload
+from app.main.service.metadata import MetadataStore, _record_detected_backends
+from app.main.service import metadata
+from app.main.service.registry import backend_registry
+
+
+def test_backends_changed_by_others_are_recorded(client, openresty, tmp_path, monkeypatch):
+    store = MetadataStore(str(tmp_path / "metadata.db"))
+    monkeypatch.setattr(metadata, "metadata_store", store)
+    backend = client.post("/backends", json=backend_payload("metadata", "http://10.0.6.1:8787")).json()
+    file_path = backend_registry.get(backend["id"]).file_path
+    copy_name = os.path.basename(file_path).replace(str(backend["id"]), str(backend["id"] + 100000), 1)
+
+    assert store.count_backends() == 1
+
+    # A backend file copied by hand, the registry finds it as the watcher would.
+    shutil.copyfile(file_path, os.path.join(os.path.dirname(file_path), copy_name))
+    backend_registry.refresh({copy_name})
+    assert store.count_backends() == 2
+    os.remove(os.path.join(os.path.dirname(file_path), copy_name))
+    backend_registry.refresh({copy_name})
+    assert store.count_backends() == 1
+
+    # Recording a backend again, e.g. found by the watcher after another worker created it, keeps its creation time.
+    created = store._connection().execute("SELECT created FROM backends").fetchone()[0]
+    _record_detected_backends([backend_registry.get(backend["id"])], [])
+    assert store._connection().execute("SELECT created FROM backends").fetchone()[0] == created
+
+
+def test_changes_while_down_are_repaired_on_startup(client, openresty, tmp_path, monkeypatch):
+    store = MetadataStore(str(tmp_path / "metadata.db"))
+    monkeypatch.setattr(metadata, "metadata_store", store)
+    kept = client.post("/backends", json=backend_payload("repairkept", "http://10.0.7.1:8787")).json()
+    changed = client.post("/backends", json=backend_payload("repairchanged", "http://10.0.7.2:8787")).json()
+    assert client.post(f"/users/{kept['id']}", json={"user": "alice"}).status_code == 200
+
+    def registry_backends():
+        return [(backend, os.path.basename(backend.file_path), backend_registry.upstream_of(backend.id),
+                 backend_registry.mtime_of(backend.id)) for backend in backend_registry.all()]
+
+    users = {str(kept["id"]): {"alice"}}
+    # Backends of the other tests were not recorded in this store
+    store.repair(registry_backends(), users)
+    assert store.repair(registry_backends(), users) == (0, 0)
+    recorded = store.count_backends()
+
+    # Changes which the store missed, e.g. made while FORC was down
+    connection = store._connection()
+    with connection:
+        connection.execute("DELETE FROM backends WHERE id = ?", (kept["id"],))
+        connection.execute("DELETE FROM users WHERE backend_id = ?", (kept["id"],))
+        connection.execute("UPDATE backends SET mtime = 0 WHERE id = ?", (changed["id"],))
+        connection.execute(
+            "INSERT INTO backends (id, owner, location_url, user_key_url, template, template_version, file_name, "
+            "created) VALUES (1, 'gone', 'gone_100', 'gone', 'rstudio', 'v04', 'gone.conf', 0)"
+        )
+
+    assert store.repair(registry_backends(), users) == (3, 1)
+    assert store.count_backends() == recorded
+    assert [row[0] for row in connection.execute("SELECT user FROM users WHERE backend_id = ?", (kept["id"],))] \
+        == ["alice"]
+    assert store.repair(registry_backends(), users) == (0, 0)
@@ -0,0 +1,37 @@
+import os
+import shutil
+import time
+
+from conftest import backend_payload
+from app.main.service.reconciler import MODE_DRY_RUN, MODE_QUARANTINE, reconciler
+from app.main.service.registry import backend_registry
+
+
+def test_duplicate_with_older_file_is_collected_with_its_users(client, openresty, monkeypatch):
+    kept = client.post("/backends", json=backend_payload("gckept", "http://10.0.5.1:8787")).json()
+    duplicate = client.post("/backends", json=backend_payload("gcdup", "http://10.0.5.2:8787")).json()
+    assert client.post(f"/users/{duplicate['id']}", json={"user": "alice"}).status_code == 200
+    kept_path = backend_registry.get(kept["id"]).file_path
+    duplicate_path = backend_registry.get(duplicate["id"]).file_path
+
+    # The backend with the lower id gets the same upstream url and the newer file, like a legacy backend with a
+    # random id which was created after the other one.
+    shutil.copyfile(duplicate_path, kept_path)
+    past = time.time() - 3600
+    os.utime(duplicate_path, (past, past))
+    backend_registry.refresh({os.path.basename(kept_path), os.path.basename(duplicate_path)})
+
+    # A write key can not make a run destructive, only the configuration can
+    monkeypatch.setattr(reconciler, "mode", MODE_DRY_RUN)
+    report = client.post("/utils/gc", params={"dry_run": False}).json()
+    assert report["dry_run"]
+    assert backend_registry.get(duplicate["id"]) is not None
+    monkeypatch.setattr(reconciler, "mode", MODE_QUARANTINE)
+
+    report = client.post("/utils/gc").json()
+    findings = [finding for finding in report["findings"] if finding["kind"] == "duplicate_upstream"]
+    assert [(finding["backend_id"], finding["action"]) for finding in findings] == [(duplicate["id"], "quarantined")]
+    assert backend_registry.get(kept["id"]) is not None
+    assert backend_registry.get(duplicate["id"]) is None
+    assert client.get(f"/users/{duplicate['id']}").json() == []
+    assert not os.path.exists(os.path.join(os.path.dirname(kept_path), "users", str(duplicate["id"])))
@@ -0,0 +1,33 @@
+import asyncio
+
+from conftest import STUB
+
+from app.main.service.openresty import ReloadScheduler
+
+
+def request_concurrently(scheduler: ReloadScheduler, count: int):
+    async def requests():
+        return await asyncio.wait_for(asyncio.gather(*(scheduler.request() for _ in range(count))), timeout=10)
+
+    return asyncio.run(requests())
+
+
+def test_requests_within_a_window_share_one_reload(openresty):
+    scheduler = ReloadScheduler(f"sh {STUB} -s reload", window=0.05)
+    reloads = openresty.calls("-s reload")
+    assert request_concurrently(scheduler, 5) == [True] * 5
+    assert openresty.calls("-s reload") == reloads + 1
+    assert scheduler.stats().requests == 5 and scheduler.stats().reloads == 1
+
+
+def test_failed_reload_resolves_all_requests(openresty):
+    openresty.set_exit_code(1)
+    scheduler = ReloadScheduler(f"sh {STUB} -s reload", window=0.01)
+    assert request_concurrently(scheduler, 3) == [False] * 3
+    assert scheduler.stats().failures == 1
+
+
+def test_malformed_reload_command_does_not_hang_requests():
+    scheduler = ReloadScheduler('openresty -s "reload', window=0.01)
+    assert request_concurrently(scheduler, 3) == [False] * 3
+    assert scheduler.stats().failures == 1
@@ -0,0 +1,25 @@
+import os
+
+from app.main.util.templating import TemplateCache
+
+
+def test_preloaded_templates_are_kept_and_only_changes_recompiled(tmp_path):
+    (tmp_path / "rstudio%v01.conf").write_text("location /{{ key_url }} {}")
+    (tmp_path / "jupyter%v01.conf").write_text("old")
+    cache = TemplateCache(tmp_path, str(tmp_path / ".cache"))
+    os.mkdir(tmp_path / ".cache")
+    # Compiled in the parent process before workers are forked
+    cache.rebuild()
+    rstudio = cache._templates["rstudio%v01"]
+
+    past = os.stat(tmp_path / "jupyter%v01.conf").st_mtime_ns - 10 ** 9
+    (tmp_path / "jupyter%v01.conf").write_text("new")
+    os.utime(tmp_path / "jupyter%v01.conf", ns=(past, past))
+    (tmp_path / "theia%v01.conf").write_text("theia")
+    cache.start()
+    try:
+        assert cache._templates["rstudio%v01"] is rstudio
+        assert cache._templates["jupyter%v01"].render() == "new"
+        assert sorted(cache.available()) == [("jupyter", "v01"), ("rstudio", "v01"), ("theia", "v01")]
+    finally:
+        cache.stop()
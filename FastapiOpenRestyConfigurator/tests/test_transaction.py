@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from app.main.service import transaction as transaction_module
+from app.main.service.transaction import BackendTransaction, recover_transactions
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.fixture
+def backend_path(tmp_path):
+    (tmp_path / "old.conf").write_text("old")
+    return tmp_path
+
+
+def new_transaction(backend_path) -> BackendTransaction:
+    transaction = BackendTransaction(backend_path)
+    transaction.delete("old.conf")
+    transaction.create("new.conf", "new")
+    return transaction
+
+
+def files_of(backend_path):
+    return sorted(os.listdir(backend_path))
+
+
+def test_crash_before_apply_is_rolled_back(backend_path, monkeypatch):
+    transaction = new_transaction(backend_path)
+
+    def crash(entry):
+        raise Crash()
+
+    monkeypatch.setattr(transaction_module, "apply_journal_entry", crash)
+    with pytest.raises(Crash):
+        transaction.commit()
+    monkeypatch.undo()
+
+    assert recover_transactions() == 1
+    assert files_of(backend_path) == ["old.conf"]
+    assert not os.path.exists(transaction.journal_file)
+
+
+def test_crash_after_commit_is_rolled_back(backend_path):
+    # Interrupted before the config test passed, the new config must not become permanent
+    transaction = new_transaction(backend_path)
+    transaction.commit()
+    assert files_of(backend_path) == sorted(["new.conf", f".old.conf.{transaction.transaction_id}.bak"])
+
+    assert recover_transactions() == 1
+    assert files_of(backend_path) == ["old.conf"]
+    assert (backend_path / "old.conf").read_text() == "old"
+
+
+def test_crash_after_validation_is_completed(backend_path):
+    transaction = new_transaction(backend_path)
+    transaction.commit()
+    transaction.validated()
+
+    assert recover_transactions() == 1
+    assert files_of(backend_path) == ["new.conf"]
+    assert not os.path.exists(transaction.journal_file)
+
+
+def test_crash_during_rollback_is_rolled_back(backend_path, monkeypatch):
+    transaction = new_transaction(backend_path)
+    transaction.commit()
+
+    def crash(entry):
+        raise Crash()
+
+    monkeypatch.setattr(transaction_module, "rollback_journal_entry", crash)
+    with pytest.raises(Crash):
+        transaction.rollback()
+    monkeypatch.undo()
+
+    assert recover_transactions() == 1
+    assert files_of(backend_path) == ["old.conf"]
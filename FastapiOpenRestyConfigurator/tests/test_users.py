@@ -0,0 +1,51 @@
+import os
+import time
+
+from conftest import ROOT
+from app.main.service.user import UserAcl
+
+USER_PATH = os.path.join(ROOT, "backends", "users")
+STATE_PATH = os.path.join(ROOT, "backends", ".forc")
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_changes_of_other_workers_are_applied(client):
+    # A second ACL on the same paths stands in for another worker process.
+    other_worker = UserAcl(USER_PATH, STATE_PATH, resync_interval=0)
+    other_worker.rebuild()
+    user_dir = os.path.join(USER_PATH, "7001")
+    os.makedirs(user_dir)
+    open(os.path.join(user_dir, "alice"), 'w').close()
+    other_worker.add("7001", "alice")
+    assert client.get("/users/7001").json() == [{"user": "alice"}]
+    etag = client.get("/acls").headers["ETag"]
+
+    os.remove(os.path.join(user_dir, "alice"))
+    other_worker.remove("7001", "alice")
+    assert client.get("/users/7001").json() == []
+    assert "7001" not in client.get("/acls").json()["acls"]
+    assert client.get("/acls", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_users_changed_by_others_are_picked_up(tmp_path):
+    user_path = tmp_path / "users"
+    (user_path / "42").mkdir(parents=True)
+    (user_path / "42" / "alice").touch()
+    (user_path / "42" / "bob").touch()
+    acl = UserAcl(user_path, tmp_path / "state", resync_interval=0.05)
+    acl.start()
+    try:
+        assert acl.get("42") == {"alice", "bob"}
+        time.sleep(0.01)
+        (user_path / "42" / "bob").unlink()
+        assert wait_for(lambda: acl.get("42") == {"alice"})
+    finally:
+        acl.stop()
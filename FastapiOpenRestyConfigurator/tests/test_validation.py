@@ -0,0 +1,58 @@
+import asyncio
+import os
+
+from conftest import STUB, backend_payload
+
+from app.main.service.openresty import ConfigValidator
+from app.main.service.registry import backend_registry
+
+
+def test_failed_config_test_rolls_back_new_backend(client, openresty):
+    openresty.set_exit_code(1)
+    response = client.post("/backends", json=backend_payload("rollback", "http://10.11.0.1:8787"))
+    assert response.status_code == 500
+    assert "config test" in response.json()["error"]
+    assert not any("rollback" in file_name for file_name in os.listdir(os.environ["FORC_BACKEND_PATH"]))
+    assert backend_registry.by_upstream("http://10.11.0.1:8787") == []
+
+
+def test_failed_config_test_restores_replaced_backend(client, openresty):
+    existing = client.post("/backends", json=backend_payload("replaced", "http://10.11.0.2:8787")).json()
+    openresty.set_exit_code(1)
+    response = client.post("/backends", json=backend_payload("replacing", "http://10.11.0.2:8787"))
+    assert response.status_code == 500
+    restored = backend_registry.get(existing["id"])
+    assert restored is not None and os.path.isfile(restored.file_path)
+    assert [backend.id for backend in backend_registry.by_upstream("http://10.11.0.2:8787")] == [existing["id"]]
+
+
+def test_passed_config_test_reloads(client, openresty):
+    reloads = openresty.calls("-s reload")
+    response = client.post("/backends", json=backend_payload("validated", "http://10.11.0.3:8787"))
+    assert response.status_code == 200
+    assert openresty.calls("-s reload") == reloads + 1
+
+
+def test_config_test_result_is_cached_by_content_hash(openresty):
+    validator = ConfigValidator(f"sh {STUB} -t")
+    calls = openresty.calls("-t")
+
+    async def validate_twice():
+        return await validator.validate("known"), await validator.validate("known")
+
+    first, second = asyncio.run(validate_twice())
+    assert first == second == (True, "")
+    assert openresty.calls("-t") == calls + 1
+    asyncio.run(validator.validate("other"))
+    assert openresty.calls("-t") == calls + 2
+
+
+def test_config_test_errors_are_not_cached(openresty):
+    validator = ConfigValidator("/nonexistent/openresty -t")
+
+    async def validate_twice():
+        return await validator.validate("known"), await validator.validate("known")
+
+    first, second = asyncio.run(validate_twice())
+    assert not first[0] and not second[0]
+    assert "known" not in validator._results
@@ -1,4 +1,4 @@
 #!/bin/bash
 
 /usr/local/openresty/nginx/sbin/nginx -g 'daemon on; master_process on;'
-uwsgi --ini uwsgi.ini
\ No newline at end of file
+gunicorn -c gunicorn.conf.py main:app
@@ -0,0 +1,120 @@
+-- Routes requests to FORC backends from a lua_shared_dict, see examples/dynamic_routing.md.
+-- FORC pushes the routes through the admin endpoint, so adding or removing a backend needs no reload.
+local cjson = require "cjson.safe"
+local user_service = require "user_service"
+
+local forc_router = {}
+
+local ROUTE_PREFIX = "route:"
+local GENERATION_KEY = "generation"
+
+local function routes()
+  return ngx.shared.forc_routes
+end
+
+local function respond(status, body)
+  ngx.status = status
+  ngx.header["Content-Type"] = "application/json"
+  ngx.say(cjson.encode(body))
+  return ngx.exit(status)
+end
+
+local function set_routes(dict, entries)
+  for _, route in ipairs(entries or {}) do
+    local ok, err = dict:safe_set(ROUTE_PREFIX .. route.key_url, cjson.encode(route))
+    if not ok then
+      return false, err
+    end
+  end
+  return true
+end
+
+-- Admin endpoint for FORC, only expose it on a local listener.
+-- GET returns the current generation, PUT replaces all routes and starts a new generation,
+-- POST applies added and removed routes if they are based on the current generation.
+function forc_router.admin()
+  local dict = routes()
+  local method = ngx.req.get_method()
+  if method == "GET" then
+    return respond(200, { generation = dict:get(GENERATION_KEY) or cjson.null })
+  end
+
+  ngx.req.read_body()
+  local body = cjson.decode(ngx.req.get_body_data() or "")
+  if not body or not body.generation then
+    return respond(400, { error = "invalid body" })
+  end
+
+  if method == "PUT" then
+    local keep = {}
+    for _, route in ipairs(body.routes or {}) do
+      keep[ROUTE_PREFIX .. route.key_url] = true
+    end
+    local ok, err = set_routes(dict, body.routes)
+    if not ok then
+      return respond(507, { error = err })
+    end
+    for _, key in ipairs(dict:get_keys(0)) do
+      if key:sub(1, #ROUTE_PREFIX) == ROUTE_PREFIX and not keep[key] then
+        dict:delete(key)
+      end
+    end
+    dict:set(GENERATION_KEY, body.generation)
+    return respond(200, { generation = body.generation })
+  end
+
+  if method == "POST" then
+    if dict:get(GENERATION_KEY) ~= body.generation then
+      return respond(409, { error = "generation mismatch" })
+    end
+    for _, key_url in ipairs(body.removed or {}) do
+      dict:delete(ROUTE_PREFIX .. key_url)
+    end
+    local ok, err = set_routes(dict, body.routes)
+    if not ok then
+      -- Routes are incomplete now, force a full sync.
+      dict:delete(GENERATION_KEY)
+      return respond(507, { error = err })
+    end
+    return respond(200, { generation = body.generation })
+  end
+
+  return respond(405, { error = "method not allowed" })
+end
+
+-- Access handler of the generic backend location.
+-- Expects $forc_key_url from the location and sets $forc_upstream for proxy_pass.
+function forc_router.route(opts)
+  local route = cjson.decode(routes():get(ROUTE_PREFIX .. ngx.var.forc_key_url) or "")
+  if not route then
+    return ngx.exit(ngx.HTTP_NOT_FOUND)
+  end
+
+  -- Start actual openid authentication procedure
+  local res, err = require("resty.openidc").authenticate(opts)
+  -- If it fails for some reason, escape via HTTP 500
+  if err then
+    ngx.status = 500
+    ngx.say(err)
+    return ngx.exit(ngx.HTTP_INTERNAL_SERVER_ERROR)
+  end
+
+  -- Allow only the owner and the users added to the backend
+  local user_path = ngx.var.forc_user_path .. route.id .. "/"
+  if (res.id_token.sub ~= route.owner and not user_service.is_allowed(route.id, res.id_token.sub, user_path)) then
+    return ngx.exit(ngx.HTTP_FORBIDDEN)
+  end
+
+  ngx.req.set_header("X-Auth-Audience", res.id_token.aud)
+  ngx.req.set_header("X-Auth-Email", res.id_token.email)
+  ngx.req.set_header("X-Auth-ExpiresIn", res.id_token.exp)
+  ngx.req.set_header("X-Auth-Name", res.id_token.name)
+  ngx.req.set_header("X-Auth-Subject", res.id_token.sub)
+  ngx.req.set_header("X-Auth-Userid", res.id_token.preferred_username)
+  ngx.req.set_header("X-Auth-Username", res.id_token.preferred_username)
+  ngx.req.set_header("X-Auth-Locale", res.id_token.locale)
+
+  ngx.var.forc_upstream = route.upstream
+end
+
+return forc_router
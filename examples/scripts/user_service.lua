@@ -1,9 +1,116 @@
 local user_service = {}
 
+-- Shared dict holding the ACL snapshot pulled from FORC, see examples/openresty_configuration.md.
+local ACL_DICT = "forc_acls"
+local VERSION_KEY = "version"
+-- Time of the last successful pull and seconds after which the snapshot is not used anymore without a new pull.
+local PULLED_KEY = "pulled"
+local MAX_AGE_KEY = "max_age"
+
 function user_service.file_exists(file)
   local f = io.open(file, "rb")
   if f then f:close() end
   return f ~= nil
 end
 
+-- Check whether a user was added to a backend.
+-- Answers from the ACL snapshot without touching the disk while it is loaded and recent, otherwise checks the user
+-- file, so a removed user does not keep access while FORC is unreachable.
+function user_service.is_allowed(backend_id, user, user_path)
+  local acls = ngx.shared[ACL_DICT]
+  if acls and acls:get(VERSION_KEY) then
+    local pulled, max_age = acls:get(PULLED_KEY), acls:get(MAX_AGE_KEY)
+    if pulled and max_age and ngx.now() - pulled <= max_age then
+      return acls:get(backend_id .. "/" .. user) ~= nil
+    end
+  end
+  return user_service.file_exists(user_path .. user)
+end
+
+local function apply_snapshot(acls, snapshot, version)
+  local keep = {}
+  for backend_id, users in pairs(snapshot.acls or {}) do
+    for _, user in ipairs(users) do
+      local key = backend_id .. "/" .. user
+      keep[key] = true
+      local ok, err = acls:safe_set(key, true)
+      if not ok then
+        -- An incomplete snapshot must not be used, fall back to the user files.
+        acls:delete(VERSION_KEY)
+        return nil, err
+      end
+    end
+  end
+  for _, key in ipairs(acls:get_keys(0)) do
+    if key ~= VERSION_KEY and key ~= PULLED_KEY and key ~= MAX_AGE_KEY and not keep[key] then
+      acls:delete(key)
+    end
+  end
+  acls:set(VERSION_KEY, version)
+  return true
+end
+
+-- Pull the ACL snapshot from FORC periodically, call it in init_worker_by_lua_block.
+-- opts.url: FORC ACL endpoint, e.g. http://127.0.0.1:5000/acls
+-- opts.api_key: FORC API key
+-- opts.interval: Seconds between two pulls, default 1. Removed users keep access for at most this long while FORC
+-- answers. If pulls fail for twice the interval, the snapshot is dropped and the user files are checked again.
+function user_service.start_acl_sync(opts)
+  -- The shared dict is shared by all workers, a single worker is enough to keep it up to date.
+  if ngx.worker.id() ~= 0 then
+    return
+  end
+  local cjson = require "cjson.safe"
+  local http = require "resty.http"
+  local interval = opts.interval or 1
+
+  local function pulled(acls)
+    acls:set(MAX_AGE_KEY, 2 * interval)
+    acls:set(PULLED_KEY, ngx.now())
+  end
+
+  local function failed(acls)
+    local last = acls:get(PULLED_KEY)
+    if last and ngx.now() - last > 2 * interval then
+      acls:delete(VERSION_KEY)
+    end
+  end
+
+  local function pull(premature)
+    if premature then
+      return
+    end
+    local acls = ngx.shared[ACL_DICT]
+    local httpc = http.new()
+    httpc:set_timeout(5000)
+    local res, err = httpc:request_uri(opts.url, {
+      headers = { ["X-API-KEY"] = opts.api_key, ["If-None-Match"] = acls:get(VERSION_KEY) }
+    })
+    if not res then
+      ngx.log(ngx.ERR, "Was not able to pull ACL snapshot from FORC: ", err)
+      failed(acls)
+      return
+    end
+    if res.status == 304 then
+      pulled(acls)
+      return
+    end
+    local snapshot = res.status == 200 and cjson.decode(res.body)
+    if not snapshot then
+      ngx.log(ngx.ERR, "Invalid ACL snapshot from FORC, status ", res.status)
+      failed(acls)
+      return
+    end
+    local ok, apply_err = apply_snapshot(acls, snapshot, res.headers["ETag"])
+    if ok then
+      pulled(acls)
+    else
+      ngx.log(ngx.ERR, "Was not able to store ACL snapshot: ", apply_err)
+    end
+  end
+
+  ngx.timer.at(0, pull)
+  ngx.timer.every(interval, pull)
+end
+
 return user_service